@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+'''
+Reports how many Complex objects and how much memory are allocated when
+building identity and gate matrices, and the peak memory of an evolution
+loop with immutable matrices and with reused buffers.
+
+@author: Jordi Llull
+'''
+import os
+import sys
+import inspect
+cmd_folder = os.path.realpath(os.path.abspath(os.path.split(inspect.getfile(inspect.currentframe()))[0]) + "/..")
+if cmd_folder not in sys.path:
+    sys.path.insert(0, cmd_folder)
+
+from qsimulator.qmath import ComplexM, ComplexMBuffer
+from math import sqrt
+import tracemalloc
+import time
+
+
+def hadamard():
+    x = 1 / sqrt(2)
+    return ComplexM(2, 2, [[x, x], [x, -x]])
+
+
+def identity(n):
+    return ComplexM(n, n, [[1 if i == j else 0 for j in range(n)] for i in range(n)])
+
+
+def hadamard_layer(nqubits):
+    h = hadamard()
+    result = h
+    for _ in range(nqubits - 1):
+        result = result.tensor(h)
+    return result
+
+
+def measure(name, build):
+    tracemalloc.start()
+    matrix = build()
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    distinct = len({id(x) for row in matrix for x in row})
+    m, n = matrix.size
+    print("{0:<32} {1:>10} {2:>10} {3:>12}".format(name, m * n, distinct, size // 1024))
+
+
+def evolve_immutable(u, v, steps):
+    for _ in range(steps):
+        v = u * v
+    return v
+
+
+def evolve_buffers(u, v, steps):
+    u = ComplexMBuffer.from_complexm(u)
+    state = ComplexMBuffer.from_complexm(v)
+    out = ComplexMBuffer(*v.size)
+    for _ in range(steps):
+        u.matmul_into(state, out)
+        state, out = out, state
+    return state
+
+
+def measure_evolution(name, evolve):
+    u = hadamard_layer(6)
+    v = ComplexM(64, 1, [[1 if i == 0 else 0] for i in range(64)])
+    start = time.perf_counter()
+    evolve(u, v, 200)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    evolve(u, v, 200)
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print("{0:<32} {1:>12} {2:>12.3f}".format(name, peak // 1024, elapsed))
+
+
+def main():
+    print("{0:<32} {1:>10} {2:>10} {3:>12}".format("matrix", "values", "Complex", "memory (KB)"))
+    i256 = identity(256)
+
+    measure("ComplexM 256x256 identity", lambda: identity(256))
+    measure("get_identity() 256x256", lambda: i256.get_identity())
+    measure("H⊗H⊗...⊗H (8 qubits)", lambda: hadamard_layer(8))
+    measure("I256 * I256", lambda: i256 * i256)
+
+    print()
+    print("{0:<32} {1:>12} {2:>12}".format("evolution (200 steps, 64 values)", "peak (KB)", "time (s)"))
+    measure_evolution("u * v", evolve_immutable)
+    measure_evolution("ComplexMBuffer.matmul_into", evolve_buffers)
+
+if __name__ == '__main__':
+    main()
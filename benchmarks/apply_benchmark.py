@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+'''
+Measures a program applying thousands of gates to the registers of a quantum
+computer, compiling the kernel of every gate each time versus reusing the
+kernels kept by the gate library.
+
+@author: Jordi Llull
+'''
+import os
+import sys
+import inspect
+cmd_folder = os.path.realpath(os.path.abspath(os.path.split(inspect.getfile(inspect.currentframe()))[0]) + "/..")
+if cmd_folder not in sys.path:
+    sys.path.insert(0, cmd_folder + "/qsimulator")
+
+from qbackend import PythonBackend, get_default_backend
+from qcomputer import QComputer
+from qinstrhandler import InitializeHandler, ApplyHandler
+from qinstruction import Initialize, Apply, Register, Variable, CNot, H, Identity
+from qmath import ComplexM
+from timeit import default_timer
+
+NREGISTERS = 4
+NGATES = 4000
+
+
+def get_program():
+    gates = [H(), CNot(), Variable('S'), Identity(4), CNot()]
+    program = [Initialize(Register(i)) for i in range(NREGISTERS)]
+    program += [Apply(gates[i % len(gates)], Register(i % NREGISTERS)) for i in range(NGATES)]
+    return program
+
+
+def run(backend, program, reuse):
+    qcomp = QComputer([InitializeHandler, ApplyHandler], sqrt_size=3, nregisters=NREGISTERS, backend=backend)
+    qcomp.set_variable('S', ComplexM(2, 2, [[1, 0], [0, 1j]]))
+
+    start = default_timer()
+    for instruction in program:
+        if not reuse:
+            qcomp.gate_library.clear()
+        qcomp.execute(instruction)
+    return default_timer() - start
+
+
+def main():
+    program = get_program()
+    print("{0} gates on {1} registers of 9 qubits".format(NGATES, NREGISTERS))
+    print("{0:>10} {1:>12} {2:>12}".format("backend", "no cache", "library"))
+    for backend in {type(b): b for b in (PythonBackend(), get_default_backend())}.values():
+        print("{0:>10} {1:>12.5f} {2:>12.5f}".format(type(backend).__name__.replace('Backend', ''),
+                                                     run(backend, program, False),
+                                                     run(backend, program, True)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+'''
+Compares applying an operator to many states one by one with applying it to
+the whole batch of states with a single matrix product.
+
+@author: Jordi Llull
+'''
+import os
+import sys
+import inspect
+cmd_folder = os.path.realpath(os.path.abspath(os.path.split(inspect.getfile(inspect.currentframe()))[0]) + "/..")
+if cmd_folder not in sys.path:
+    sys.path.insert(0, cmd_folder)
+
+from qsimulator.qmath import ComplexM
+from random import Random
+from timeit import default_timer
+
+SIZE = 32
+BATCHES = (16, 64, 256)
+
+
+def random_matrix(m, n, rand):
+    values = [[(rand.uniform(-1, 1), rand.uniform(-1, 1)) for _ in range(n)] for _ in range(m)]
+    return ComplexM(m, n, values)
+
+
+def one_by_one(u, vectors):
+    states = [u * v for v in vectors]
+    return states, [v.norm() for v in states]
+
+
+def batched(u, vectors):
+    states = u.apply_batch(ComplexM.from_columns(vectors))
+    return states, states.column_norms()
+
+
+def measure(run, u, vectors):
+    start = default_timer()
+    run(u, vectors)
+    return default_timer() - start
+
+
+def main():
+    rand = Random(0)
+    u = random_matrix(SIZE, SIZE, rand)
+
+    print("{0:>8} {1:>12} {2:>12}".format("states", "one by one", "batched"))
+    for k in BATCHES:
+        vectors = [random_matrix(SIZE, 1, rand) for _ in range(k)]
+        print("{0:>8} {1:>12.5f} {2:>12.5f}".format(k, measure(one_by_one, u, vectors), measure(batched, u, vectors)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+'''
+Micro benchmark of the scalar operations done in the inner loop of the
+ComplexM multiplication.
+
+@author: Jordi Llull
+'''
+import os
+import sys
+import inspect
+cmd_folder = os.path.realpath(os.path.abspath(os.path.split(inspect.getfile(inspect.currentframe()))[0]) + "/..")
+if cmd_folder not in sys.path:
+    sys.path.insert(0, cmd_folder)
+
+from qsimulator.qmath import Complex, ComplexM
+from random import Random
+from timeit import Timer
+
+N = 10000
+
+
+def per_operation(statement, setup_globals, number):
+    timer = Timer(statement, globals=setup_globals)
+    return min(timer.repeat(repeat=5, number=number)) / (number * N) * 1e9
+
+
+def main():
+    rand = Random(0)
+    a = [Complex(rand.uniform(-1, 1), rand.uniform(-1, 1)) for _ in range(N)]
+    b = [Complex(rand.uniform(-1, 1), rand.uniform(-1, 1)) for _ in range(N)]
+    values = [(x.real_value, x.imaginary_value) for x in a]
+    namespace = {'a': a, 'b': b, 'values': values, 'Complex': Complex}
+
+    benchmarks = [
+        ("Complex(real, imaginary)", "[Complex(x, y) for x, y in values]"),
+        ("Complex((real, imaginary))", "[Complex(v) for v in values]"),
+        ("Complex + Complex", "[x + y for x, y in zip(a, b)]"),
+        ("Complex * Complex", "[x * y for x, y in zip(a, b)]"),
+        ("Complex + 1", "[x + 1 for x in a]"),
+        ("acc += Complex * Complex", "acc = Complex(0)\nfor x, y in zip(a, b): acc += x * y"),
+    ]
+
+    print("{0:<28} {1:>10}".format("operation", "ns/op"))
+    for name, statement in benchmarks:
+        print("{0:<28} {1:>10.1f}".format(name, per_operation(statement, namespace, 10)))
+
+    m = ComplexM(64, 64, [[(rand.uniform(-1, 1), rand.uniform(-1, 1)) for _ in range(64)] for _ in range(64)])
+    namespace['m'] = m
+    timer = Timer("m * m", globals=namespace)
+    print("{0:<28} {1:>10.2f}".format("64x64 product (ms)", min(timer.repeat(repeat=5, number=1)) * 1e3))
+
+if __name__ == '__main__':
+    main()
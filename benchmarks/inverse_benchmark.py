@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+'''
+Measures the inverse of matrices of growing size: unitary matrices are
+inverted with their adjoint (the time includes checking that they are
+unitary, the verdict is cached afterwards), other ones with a LU
+decomposition.
+
+@author: Jordi Llull
+'''
+import os
+import sys
+import inspect
+cmd_folder = os.path.realpath(os.path.abspath(os.path.split(inspect.getfile(inspect.currentframe()))[0]) + "/..")
+if cmd_folder not in sys.path:
+    sys.path.insert(0, cmd_folder)
+
+from qsimulator.qmath import ComplexM, ArrayComplexM, NUMPY, DERIVED_RESULTS_CACHE
+from math import sqrt
+from random import Random
+from timeit import default_timer
+
+SIZES = (8, 16, 32, 64)
+
+
+def random_matrix(n, rand):
+    values = [[(rand.uniform(-1, 1), rand.uniform(-1, 1)) for _ in range(n)] for _ in range(n)]
+    return ComplexM(n, n, values)
+
+
+def hadamard(n):
+    # Sylvester construction of the Hadamard matrix of size n×n (a power of 2)
+    x = 1 / sqrt(n)
+    return ComplexM(n, n, [[x * (-1) ** bin(i & j).count('1') for j in range(n)] for i in range(n)])
+
+
+def measure(matrix):
+    DERIVED_RESULTS_CACHE.clear()
+    start = default_timer()
+    matrix.inverse()
+    return default_timer() - start
+
+
+def main():
+    rand = Random(0)
+    print("{0:>6} {1:>12} {2:>12} {3:>12}".format("size", "unitary", "LU", "numpy"))
+    for n in SIZES:
+        a = random_matrix(n, rand)
+        array_time = measure(ArrayComplexM.from_complexm(a)) if NUMPY else float('nan')
+        print("{0:>6} {1:>12.5f} {2:>12.5f} {3:>12.5f}".format(n, measure(hadamard(n)), measure(a), array_time))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+'''
+Measures how the pure python ComplexM matrix multiplication scales from 8x8 to
+256x256 matrices.
+
+@author: Jordi Llull
+'''
+import os
+import sys
+import inspect
+cmd_folder = os.path.realpath(os.path.abspath(os.path.split(inspect.getfile(inspect.currentframe()))[0]) + "/..")
+if cmd_folder not in sys.path:
+    sys.path.insert(0, cmd_folder)
+
+from qsimulator.qmath import ComplexM
+from random import Random
+from timeit import default_timer
+
+SIZES = (8, 16, 32, 64, 128, 256)
+
+
+def random_matrix(n, rand):
+    values = [[(rand.uniform(-1, 1), rand.uniform(-1, 1)) for _ in range(n)] for _ in range(n)]
+    return ComplexM(n, n, values)
+
+
+def time_product(a, b, repeat):
+    best = None
+    for _ in range(repeat):
+        start = default_timer()
+        a * b
+        elapsed = default_timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    rand = Random(0)
+    previous = None
+
+    print("{0:>8} {1:>12} {2:>8}".format("size", "seconds", "ratio"))
+    for n in SIZES:
+        a = random_matrix(n, rand)
+        b = random_matrix(n, rand)
+        elapsed = time_product(a, b, repeat=3 if n <= 64 else 1)
+        # An O(n^3) product should take ~8 times longer when doubling n
+        ratio = "" if previous is None else "{0:.1f}".format(elapsed / previous)
+        print("{0:>8} {1:>12.5f} {2:>8}".format("{0}x{0}".format(n), elapsed, ratio))
+        previous = elapsed
+
+if __name__ == '__main__':
+    main()
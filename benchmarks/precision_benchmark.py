@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+'''
+Compares the complex128 and complex64 precisions of ArrayComplexM: memory of
+the state vector, time per evolution step and drift of the norm of the state
+after many steps of a unitary evolution (it should stay 1).
+
+@author: Jordi Llull
+'''
+import os
+import sys
+import inspect
+cmd_folder = os.path.realpath(os.path.abspath(os.path.split(inspect.getfile(inspect.currentframe()))[0]) + "/..")
+if cmd_folder not in sys.path:
+    sys.path.insert(0, cmd_folder)
+
+from qsimulator.qmath import ArrayComplexM, KroneckerOperator, PRECISIONS, NUMPY
+from math import cos, sin
+from random import Random
+from timeit import default_timer
+
+QUBITS = (12, 16, 20)
+STEPS = 100
+
+
+def rotation(rand, precision):
+    # Rx(t) = [[cos t/2, -i sin t/2], [-i sin t/2, cos t/2]] is unitary
+    t = rand.uniform(0, 3)
+    c = cos(t / 2)
+    s = sin(t / 2)
+    return ArrayComplexM(2, 2, [[c, (0, -s)], [(0, -s), c]], precision)
+
+
+def evolve(nqubits, precision):
+    rand = Random(nqubits)
+    u = KroneckerOperator(*[rotation(rand, precision) for _ in range(nqubits)])
+    state = ArrayComplexM(2 ** nqubits, 1, [[1 if i == 0 else 0] for i in range(2 ** nqubits)], precision)
+
+    start = default_timer()
+    for _ in range(STEPS):
+        state = u * state
+    elapsed = default_timer() - start
+
+    return state.array.nbytes, elapsed / STEPS, abs(state.norm() - 1)
+
+
+def main():
+    if not NUMPY:
+        print("This benchmark needs numpy to be installed")
+        return
+
+    print("{0:>7} {1:>11} {2:>12} {3:>14} {4:>12}".format("qubits", "precision", "memory (KB)", "ms per step",
+                                                       "norm drift"))
+    for nqubits in QUBITS:
+        for precision in PRECISIONS:
+            memory, step, drift = evolve(nqubits, precision)
+            print("{0:>7} {1:>11} {2:>12} {3:>14.3f} {4:>12.2e}".format(nqubits, precision, memory // 1024,
+                                                                        step * 1000, drift))
+
+if __name__ == '__main__':
+    main()
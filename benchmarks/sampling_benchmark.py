@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+'''
+Measures drawing many shots from the state of a register, computing the
+distribution and sampling it from scratch for every shot versus drawing all
+the shots from the sampler of the register.
+
+@author: Jordi Llull
+'''
+import os
+import sys
+import inspect
+cmd_folder = os.path.realpath(os.path.abspath(os.path.split(inspect.getfile(inspect.currentframe()))[0]) + "/..")
+if cmd_folder not in sys.path:
+    sys.path.insert(0, cmd_folder + "/qsimulator")
+
+from qbackend import OutcomeSampler
+from qcomputer import QComputer
+from qinstrhandler import InitializeHandler, ApplyHandler
+from qinstruction import Initialize, Apply, Register, CNot, H
+from timeit import default_timer
+
+NAIVE_SHOTS = 1000
+SHOTS = (10 ** 4, 10 ** 5, 10 ** 6)
+
+
+def get_register():
+    qcomp = QComputer([InitializeHandler, ApplyHandler], sqrt_size=3, nregisters=1)
+    for instruction in (Initialize(Register(0)), Apply(H(), Register(0)), Apply(CNot(), Register(0))):
+        qcomp.execute(instruction)
+    return qcomp.registers[0]
+
+
+def naive(register, shots):
+    backend = register.backend
+    return [OutcomeSampler(backend.probabilities(register.state)).sample()[0] for _ in range(shots)]
+
+
+def sampled(register, shots):
+    return register.get_sampler().counts(shots)
+
+
+def measure(run, register, shots):
+    start = default_timer()
+    run(register, shots)
+    return default_timer() - start
+
+
+def main():
+    register = get_register()
+    naive_time = measure(naive, register, NAIVE_SHOTS) / NAIVE_SHOTS
+    print("{0:>10} {1:>12} {2:>12}".format("shots", "naive", "sampler"))
+    for shots in SHOTS:
+        print("{0:>10} {1:>12.5f} {2:>12.5f}".format(shots, naive_time * shots, measure(sampled, register, shots)))
+    print("(the naive times are extrapolated from {0} shots)".format(NAIVE_SHOTS))
+
+if __name__ == '__main__':
+    main()
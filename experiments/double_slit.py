@@ -11,12 +11,12 @@ cmd_folder = os.path.realpath(os.path.abspath(os.path.split(inspect.getfile(insp
 if cmd_folder not in sys.path:
     sys.path.insert(0, cmd_folder)
 
-from qsimulator.qmath import ComplexM
+from qsimulator.qmath import ComplexM, SparseComplexM
 from math import sqrt
 
 
 def get_non_quantum_matrix():
-    return ComplexM(8, 8,
+    return SparseComplexM(8, 8,
             [
              [(0, 0)  , (0, 0)     , (0, 0)     , (0, 0), (0, 0), (0, 0), (0, 0), (0, 0)],
              [(1 / 2) , (0, 0)     , (0, 0)     , (0, 0), (0, 0), (0, 0), (0, 0), (0, 0)],
@@ -33,7 +33,7 @@ def get_non_quantum_matrix():
 def get_quantum_matrix():
     s2 = sqrt(2)
     s6 = sqrt(6)
-    return ComplexM(8, 8,
+    return SparseComplexM(8, 8,
             [
              [(0, 0)      , (0, 0)             , (0, 0)             , (0, 0), (0, 0), (0, 0), (0, 0), (0, 0)],
              [(1 / s2, 0) , (0, 0)             , (0, 0)             , (0, 0), (0, 0), (0, 0), (0, 0), (0, 0)],
@@ -61,9 +61,9 @@ def main():
     v = ComplexM(8, 1, [[1], [0], [0], [0], [0], [0], [0], [0]])
 
     print("The probability vector for a NON quantum particle is:")
-    print(a * a * v)
+    print((a.lazy() * a * v).evaluate())
     print("The probability vector for a quantum particle is:")
-    print(get_probability_matrix(b * b * v))
+    print(get_probability_matrix((b.lazy() * b * v).evaluate()))
 
 if __name__ == '__main__':
     main()
@@ -10,7 +10,7 @@ cmd_folder = os.path.realpath(os.path.abspath(os.path.split(inspect.getfile(insp
 if cmd_folder not in sys.path:
     sys.path.insert(0, cmd_folder)
 
-from qsimulator.qmath import ComplexM
+from qsimulator.qmath import ComplexM, SparseComplexM
 
 
 def main():
@@ -26,7 +26,7 @@ def main():
         vector.append(int(input()))
 
     vector = tuple(map(lambda x: [x], vector))
-    cmatrix = ComplexM(m_len, m_len, matrix)
+    cmatrix = SparseComplexM(m_len, m_len, matrix)
     cvector = ComplexM(m_len, 1, vector)
 
     print("Transition matrix")
@@ -36,10 +36,9 @@ def main():
     print(cvector)
     print()
 
-    for i in range(1, 10):
-        print("t={0}".format(str(i)))
-        print(cmatrix * cvector)
-        cmatrix = cmatrix * cmatrix
+    for t, state in cmatrix.evolve(cvector, [2 ** i for i in range(9)]):
+        print("t={0}".format(str(t)))
+        print(state)
 
 
 
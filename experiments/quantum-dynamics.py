@@ -32,18 +32,9 @@ def main():
     )
     v0 = ComplexM(4, 1, [ [1], [0], [0], [0]])
 
-    v1 = u * v0
-    v2 = u * v1
-    v3 = u * v2
-
-    print("Probabilities at t=0")
-    print(getProbabilityMatrix(v0))
-    print("Probabilities at t=1")
-    print(getProbabilityMatrix(v1))
-    print("Probabilities at t=2")
-    print(getProbabilityMatrix(v2))
-    print("Probabilities at t=3")
-    print(getProbabilityMatrix(v3))
+    for t, v in u.evolve(v0, range(4)):
+        print("Probabilities at t={0}".format(t))
+        print(getProbabilityMatrix(v))
 
 if __name__ == '__main__':
     main()
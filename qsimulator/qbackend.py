@@ -0,0 +1,466 @@
+#!/usr/bin/env python3
+'''
+State vector backends of the quantum computer simulator
+
+A register of n qubits is simulated as the vector of its 2^n amplitudes. The
+basis state |b⟩ is stored at the index int(b, 2), so qubit 0 is the most
+significant bit of the index. Gates are applied by updating only the groups
+of amplitudes whose indexes differ in the targeted qubits, the operator of the
+whole register is never built.
+
+@author: Jordi Llull
+'''
+
+from abc import ABCMeta, abstractmethod
+from bisect import bisect_right
+from itertools import accumulate
+from random import Random
+from qmath import ComplexM, ArrayComplexM, LinearOperator, KroneckerOperator, ProductChain, \
+                  IdentityOp, PermutationOp, DEFAULT_PRECISION, NUMPY, check_precision, \
+                  apply_on_axis, complex_rows, hadamard_scale, fwht, as_array, materialize
+if NUMPY:
+    import numpy
+
+
+class StateVectorBackend(metaclass=ABCMeta):
+    """
+    Stores and evolves the state vectors of the registers of a QComputer
+    """
+
+    @property
+    def precision(self):
+        return DEFAULT_PRECISION
+
+    @abstractmethod
+    def basis_state(self, nqubits, index=0):
+        '''
+        Returns the state of nqubits qubits that is the basis state |index⟩
+        '''
+        return
+
+    def apply(self, state, matrix, qubits):
+        '''
+        Applies a gate of size 2^k×2^k to the k given qubits of the state and
+        returns the new state. The state given may be modified.
+        @matrix: ComplexM or LinearOperator
+        @qubits: sequence of k distinct qubit indexes
+        '''
+        return self.compile(matrix, qubits, self.get_nqubits(state))(state)
+
+    def compile(self, matrix, qubits, nqubits):
+        '''
+        Returns a kernel that applies the gate to the given qubits of a state
+        of nqubits qubits. A kernel is a function that takes a state and
+        returns the new state (the state given may be modified), everything
+        that doesn't depend on the state is computed only once.
+
+        Identities compile to a function that returns the state untouched,
+        the Hadamard gate to the in place fast Walsh–Hadamard transform,
+        PermutationOp gates to a gather of the amplitudes and lazy products
+        and tensor products to the kernels of their operands, so they are
+        never materialized.
+        @matrix: ComplexM or LinearOperator
+        @qubits: sequence of k distinct qubit indexes
+        '''
+        qubits = tuple(qubits)
+        self._check_gate(matrix, qubits, nqubits)
+
+        if isinstance(matrix, IdentityOp):
+            return lambda state: state
+        elif _is_hadamard(matrix):
+            return lambda state: self.apply_hadamard(state, qubits)
+        elif isinstance(matrix, ProductChain) and matrix.scalar is None:
+            # The last operand of the product is the first one applied
+            kernels = [self.compile(operand, qubits, nqubits) for operand in reversed(matrix.operands)]
+            return _compose(kernels)
+        elif isinstance(matrix, KroneckerOperator) and \
+                all(factor.is_squared() and _is_power_of_2(factor.size[0]) for factor in matrix.factors):
+            # Every factor acts on its own slice of the targeted qubits, so
+            # the H factors are applied together with a single transform
+            kernels = []
+            hadamard_qubits = []
+            start = 0
+            for factor in matrix.factors:
+                k = factor.size[0].bit_length() - 1
+                if _is_hadamard(factor):
+                    hadamard_qubits.extend(qubits[start:start + k])
+                else:
+                    kernels.append(self.compile(factor, qubits[start:start + k], nqubits))
+                start += k
+            if hadamard_qubits:
+                kernels.append(lambda state: self.apply_hadamard(state, hadamard_qubits))
+            return _compose(kernels)
+
+        return self._compile(matrix, qubits, nqubits)
+
+    @abstractmethod
+    def _compile(self, matrix, qubits, nqubits):
+        '''
+        Returns the kernel of a dense gate or a PermutationOp, already checked
+        to be applicable to the given qubits
+        '''
+        return
+
+    def apply_hadamard(self, state, qubits=None):
+        '''
+        Applies the Hadamard gate to each of the given qubits (all of them if
+        None) with the in place fast Walsh–Hadamard transform of qmath.fwht
+        and returns the state
+        '''
+        return fwht(state, qubits=self._get_qubits(state, qubits))
+
+    @abstractmethod
+    def probabilities(self, state):
+        '''
+        Returns the probability of observing every basis state
+        '''
+        return
+
+    def marginal_probabilities(self, state, qubits=None):
+        '''
+        Returns the probability of observing every value of the given qubits
+        (all of them if None), the first qubit given being the most
+        significant bit of the outcome
+        '''
+        probabilities = self.probabilities(state)
+        if qubits is None:
+            return probabilities
+        nqubits = self.get_nqubits(state)
+        shifts = [nqubits - 1 - q for q in self._check_qubits(qubits, nqubits)]
+
+        marginal = [0.0] * (1 << len(shifts))
+        for index, p in enumerate(probabilities):
+            outcome = 0
+            for shift in shifts:
+                outcome = outcome << 1 | index >> shift & 1
+            marginal[outcome] += p
+        return marginal
+
+    def sampler(self, state, qubits=None, seed=None):
+        '''
+        Returns an OutcomeSampler drawing the values of the given qubits (all
+        of them if None) with the probabilities given by the state
+        '''
+        return OutcomeSampler(self.marginal_probabilities(state, qubits), seed)
+
+    @abstractmethod
+    def to_complexm(self, state):
+        '''
+        Returns the state as a ComplexM vector of size 2^n×1
+        '''
+        return
+
+    @abstractmethod
+    def from_complexm(self, vector):
+        '''
+        Returns the state given by a ComplexM vector of size 2^n×1
+        '''
+        return
+
+    def get_nqubits(self, state):
+        size = len(state)
+        nqubits = size.bit_length() - 1
+        if size != 1 << nqubits:
+            raise ValueError("The size of a state vector should be a power of 2")
+        return nqubits
+
+    def _check_gate(self, matrix, qubits, nqubits):
+        '''
+        Checks that the gate can be applied to the given qubits of a state of
+        nqubits qubits
+        '''
+        if not isinstance(matrix, (ComplexM, LinearOperator)):
+            raise TypeError("Cannot apply an object of class {0} as a gate"
+                            .format(matrix.__class__.__name__))
+        if len(set(qubits)) != len(qubits):
+            raise ValueError("A gate can't be applied twice to the same qubit")
+        for q in qubits:
+            if not 0 <= q < nqubits:
+                raise IndexError("The qubit {0} is out of range".format(q))
+        m, n = matrix.size
+        if m != n or m != 1 << len(qubits):
+            raise ValueError("A gate of size {0}x{1} can't be applied to {2} qubits"
+                             .format(m, n, len(qubits)))
+
+    def _get_sources(self, permutation, qubits, nqubits):
+        '''
+        Returns the index of the amplitude that every amplitude of the state
+        is moved from and the phase it is multiplied by when the PermutationOp
+        is applied to the given qubits
+        '''
+        k = len(qubits)
+        shifts = [nqubits - 1 - q for q in qubits]
+        mask = sum(1 << shift for shift in shifts)
+        inverse = [0] * len(permutation.permutation)
+        for j, i in enumerate(permutation.permutation):
+            inverse[i] = j
+
+        sources = []
+        phases = []
+        for index in range(1 << nqubits):
+            targeted = 0
+            for shift in shifts:
+                targeted = targeted << 1 | index >> shift & 1
+            j = inverse[targeted]
+            source = index & ~mask
+            for bit, shift in enumerate(shifts):
+                if j >> (k - 1 - bit) & 1:
+                    source |= 1 << shift
+            sources.append(source)
+            phases.append(complex(permutation.phases[j]))
+        return sources, phases
+
+    def _check_qubits(self, qubits, nqubits):
+        qubits = tuple(qubits)
+        if len(set(qubits)) != len(qubits):
+            raise ValueError("A qubit can't be given twice")
+        for q in qubits:
+            if not 0 <= q < nqubits:
+                raise IndexError("The qubit {0} is out of range".format(q))
+        return qubits
+
+    def _get_qubits(self, state, qubits):
+        nqubits = self.get_nqubits(state)
+        if qubits is None:
+            return range(nqubits)
+        qubits = sorted(set(qubits))
+        for q in qubits:
+            if not 0 <= q < nqubits:
+                raise IndexError("The qubit {0} is out of range".format(q))
+        return qubits
+
+
+class PythonBackend(StateVectorBackend):
+    """
+    State vectors stored as lists of builtin complex numbers
+    """
+    def __init__(self, precision=DEFAULT_PRECISION):
+        check_precision(precision)
+        if precision != DEFAULT_PRECISION:
+            raise ValueError("PythonBackend only supports the {0} precision".format(DEFAULT_PRECISION))
+
+    def basis_state(self, nqubits, index=0):
+        state = [0j] * (1 << nqubits)
+        state[index] = 1 + 0j
+        return state
+
+    def _compile(self, matrix, qubits, nqubits):
+        k = len(qubits)
+
+        if isinstance(matrix, PermutationOp):
+            sources, phases = self._get_sources(matrix, qubits, nqubits)
+            if all(phase == 1 for phase in phases):
+                return lambda state: [state[source] for source in sources]
+            return lambda state: [phase * state[source] for source, phase in zip(sources, phases)]
+
+        rows = complex_rows(materialize(matrix))
+
+        if qubits == tuple(range(qubits[0], qubits[0] + k)):
+            # The targets are consecutive qubits: the state is a tensor of
+            # shape (2^q, 2^k, 2^(n-q-k)) and the gate acts on its middle axis
+            outer = 1 << qubits[0]
+            inner = 1 << (nqubits - qubits[0] - k)
+            return lambda state: apply_on_axis(state, rows, outer, inner)
+
+        # Offset of every amplitude of a group from the index of its first one
+        shifts = [nqubits - 1 - q for q in qubits]
+        offsets = []
+        for sub in range(1 << k):
+            offset = 0
+            for bit, shift in enumerate(shifts):
+                if sub >> (k - 1 - bit) & 1:
+                    offset |= 1 << shift
+            offsets.append(offset)
+
+        # The first index of every group has the targeted bits set to 0
+        low_shifts = sorted(shifts)
+        bases = []
+        for i in range(1 << (nqubits - k)):
+            base = i
+            for shift in low_shifts:
+                base = (base >> shift << (shift + 1)) | (base & ((1 << shift) - 1))
+            bases.append(base)
+
+        def apply_on_groups(state):
+            for base in bases:
+                group = [state[base + offset] for offset in offsets]
+                for offset, row in zip(offsets, rows):
+                    state[base + offset] = sum((a * x for a, x in zip(row, group) if a != 0), 0j)
+            return state
+        return apply_on_groups
+
+    def probabilities(self, state):
+        return [x.real * x.real + x.imag * x.imag for x in state]
+
+    def to_complexm(self, state):
+        return ComplexM(len(state), 1, [[x] for x in state])
+
+    def from_complexm(self, vector):
+        if not isinstance(vector, ComplexM) or not vector.is_vector():
+            raise TypeError("A state should be a ComplexM vector")
+        state = [complex(row[0]) for row in vector]
+        self.get_nqubits(state)
+        return state
+
+
+class NumpyBackend(StateVectorBackend):
+    """
+    State vectors stored as numpy arrays of the given precision
+    """
+    def __init__(self, precision=DEFAULT_PRECISION):
+        if not NUMPY:
+            raise ImportError("NumpyBackend requires numpy to be installed")
+        check_precision(precision)
+        self._precision = precision
+
+    @property
+    def precision(self):
+        return self._precision
+
+    def basis_state(self, nqubits, index=0):
+        state = numpy.zeros(1 << nqubits, dtype=self._precision)
+        state[index] = 1
+        return state
+
+    def _compile(self, matrix, qubits, nqubits):
+        k = len(qubits)
+
+        if isinstance(matrix, PermutationOp):
+            sources, phases = self._get_sources(matrix, qubits, nqubits)
+            sources = numpy.array(sources, dtype=numpy.intp)
+            if all(phase == 1 for phase in phases):
+                return lambda state: state[sources]
+            phases = numpy.array(phases, dtype=self._precision)
+            return lambda state: state[sources] * phases
+
+        gate = as_array(materialize(matrix), self._precision).astype(self._precision, copy=False)
+        gate = gate.reshape((2,) * (2 * k))
+        shape = (2,) * nqubits
+        axes = (list(range(k, 2 * k)), list(qubits))
+        source, destination = list(range(k)), list(qubits)
+
+        def contract(state):
+            result = numpy.tensordot(gate, state.reshape(shape), axes=axes)
+            result = numpy.moveaxis(result, source, destination)
+            return numpy.ascontiguousarray(result).reshape(1 << nqubits)
+        return contract
+
+    def probabilities(self, state):
+        return state.real ** 2 + state.imag ** 2
+
+    def marginal_probabilities(self, state, qubits=None):
+        probabilities = self.probabilities(state)
+        if qubits is None:
+            return probabilities
+        nqubits = self.get_nqubits(state)
+        qubits = self._check_qubits(qubits, nqubits)
+
+        # Sum over the axes of the other qubits and put the remaining ones in
+        # the order they were given
+        others = tuple(q for q in range(nqubits) if q not in qubits)
+        marginal = probabilities.reshape((2,) * nqubits).sum(axis=others)
+        kept = sorted(qubits)
+        marginal = numpy.transpose(marginal, [kept.index(q) for q in qubits])
+        return marginal.reshape(1 << len(qubits))
+
+    def to_complexm(self, state):
+        return ArrayComplexM._from_array(state.reshape((len(state), 1)).copy())
+
+    def from_complexm(self, vector):
+        if not isinstance(vector, ComplexM) or not vector.is_vector():
+            raise TypeError("A state should be a ComplexM vector")
+        state = as_array(vector, self._precision).astype(self._precision).reshape(vector.size[0])
+        self.get_nqubits(state)
+        return state
+
+
+def _is_hadamard(matrix):
+    return isinstance(matrix, ComplexM) and hadamard_scale(matrix) is not None
+
+
+def _is_power_of_2(n):
+    return n > 0 and n & (n - 1) == 0
+
+
+def _compose(kernels):
+    '''
+    Returns the kernel that applies the given kernels in order
+    '''
+    if len(kernels) == 1:
+        return kernels[0]
+
+    def composed(state):
+        for kernel in kernels:
+            state = kernel(state)
+        return state
+    return composed
+
+
+class OutcomeSampler(object):
+    """
+    Draws outcomes with the given probabilities
+
+    The cumulative distribution is computed once and every shot is a binary
+    search of an uniform random number in it, so any number of shots can be
+    drawn in O(log n) each without simulating the state again.
+    """
+    def __init__(self, probabilities, seed=None):
+        '''
+        @probabilities: sequence of the probabilities of the outcomes 0..n-1,
+                        normalized when they don't add up to 1
+        @seed: seed of the random number generator
+        '''
+        if NUMPY:
+            cumulative = numpy.cumsum(numpy.asarray(probabilities, dtype=numpy.float64))
+            self._random = numpy.random.default_rng(seed)
+        else:
+            cumulative = list(accumulate(map(float, probabilities)))
+            self._random = Random(seed)
+
+        if len(cumulative) == 0 or not cumulative[-1] > 0:
+            raise ValueError("Can't sample from a distribution without any possible outcome")
+
+        self._cumulative = cumulative
+        self._total = float(cumulative[-1])
+
+    def __len__(self):
+        return len(self._cumulative)
+
+    def sample(self, shots=1):
+        '''
+        Returns a list with the outcomes of the given number of shots
+        '''
+        last = len(self._cumulative) - 1
+        if NUMPY:
+            uniform = self._random.random(shots) * self._total
+            outcomes = numpy.searchsorted(self._cumulative, uniform, side='right')
+            return numpy.minimum(outcomes, last).tolist()
+
+        cumulative, total, random = self._cumulative, self._total, self._random.random
+        return [min(bisect_right(cumulative, random() * total), last) for _ in range(shots)]
+
+    def counts(self, shots):
+        '''
+        Returns a list with the number of times every outcome was drawn in the
+        given number of shots
+        '''
+        if NUMPY:
+            uniform = self._random.random(shots) * self._total
+            outcomes = numpy.searchsorted(self._cumulative, uniform, side='right')
+            outcomes = numpy.minimum(outcomes, len(self._cumulative) - 1)
+            return numpy.bincount(outcomes, minlength=len(self._cumulative)).tolist()
+
+        counts = [0] * len(self._cumulative)
+        for outcome in self.sample(shots):
+            counts[outcome] += 1
+        return counts
+
+
+def get_default_backend(precision=DEFAULT_PRECISION):
+    '''
+    Returns the numpy backend if numpy is installed, the pure Python one
+    otherwise
+    '''
+    if NUMPY:
+        return NumpyBackend(precision)
+    return PythonBackend(precision)
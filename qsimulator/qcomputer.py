@@ -5,8 +5,10 @@ Quantum Computer simulator
 @author: jllull
 '''
 
-from qmath import ComplexM
+from qmath import Complex, ComplexM, ArrayComplexM, DEFAULT_PRECISION, check_precision
 from qinstrhandler import DummyPrintHandler
+from qbackend import get_default_backend
+from qgates import GateLibrary
 from qinstruction import Instruction, Select, Initialize, Apply, Concat, \
                          Measure, Tensor, Inverse, Variable
 
@@ -23,11 +25,25 @@ class UnableToExecuteInstructionError(Exception):
 
 class QComputer(object):
 
-    def __init__(self, handlers, sqrt_size=3, nregisters=16):
-        '''Initialize a quantum computer with nregisters of size sqrt_size x sqrt_size'''
+    def __init__(self, handlers, sqrt_size=3, nregisters=16, precision=DEFAULT_PRECISION, backend=None):
+        '''
+        Initialize a quantum computer with nregisters of size sqrt_size x sqrt_size
+
+        The values of the registers are stored with the given precision,
+        complex64 halves their memory but needs numpy to be installed. Every
+        register of n = sqrt_size² qubits also holds its quantum state as a
+        vector of 2^n amplitudes managed by the given StateVectorBackend (by
+        default the numpy one if numpy is installed).
+        '''
+        check_precision(precision)
+        if backend is None:
+            backend = get_default_backend(precision)
 
         self._sqrt_size = sqrt_size
-        self._registers = [QRegister(sqrt_size) for _ in range(nregisters)]
+        self._precision = precision
+        self._backend = backend
+        self._gate_library = GateLibrary(backend)
+        self._registers = [QRegister(sqrt_size, precision, backend) for _ in range(nregisters)]
         self._variables = {}
 
         self._handlers = {}
@@ -44,6 +60,18 @@ class QComputer(object):
     def sqrt_size(self):
         return self._sqrt_size
 
+    @property
+    def precision(self):
+        return self._precision
+
+    @property
+    def backend(self):
+        return self._backend
+
+    @property
+    def gate_library(self):
+        return self._gate_library
+
     @property
     def registers(self):
         return self._registers
@@ -53,7 +81,15 @@ class QComputer(object):
         return self._variables
 
     def set_variable(self, var_name, value):
-        self._variables[var_name] = QVariable(value)
+        '''
+        Stores the value in the variable. The value is kept as it is, it isn't
+        copied, and an existing variable is reused.
+        '''
+        variable = self._variables.get(var_name)
+        if variable is None:
+            self._variables[var_name] = QVariable(value)
+        else:
+            variable.value = value
 
     def register_handler(self, handler):
         '''
@@ -92,7 +128,7 @@ class QComputer(object):
             if not reg.is_initialized:
                 reg_info = "R{0}: Not initialized\n".format(i)
             else:
-                reg_info = "R{0}:\n{1}\n".format(i, str(reg.value))
+                reg_info = "R{0}:\n{1}\n".format(i, reg.state_to_string())
 
             info += reg_info
         return info
@@ -116,9 +152,13 @@ class QComputer(object):
 
 
 class QRegister(object):
-    def __init__(self, sqrt_size=3):
+    def __init__(self, sqrt_size=3, precision=DEFAULT_PRECISION, backend=None):
         self._sqrt_size = sqrt_size
+        self._precision = precision
+        self._backend = backend if backend is not None else get_default_backend(precision)
         self._value = None
+        self._state = None
+        self._samplers = {}
 
     # We are storing quantum registers values as Complex Matrices of size
     # sqrt_size × sqrt_size but it is convenient to also allow accessing them
@@ -151,6 +191,67 @@ class QRegister(object):
     def size(self):
         return self._sqrt_size ** 2
 
+    @property
+    def nqubits(self):
+        return self.size
+
+    @property
+    def backend(self):
+        return self._backend
+
+    # The quantum state of the register is the vector of the 2^n amplitudes
+    # of its basis states, stored by the backend
+    @property
+    def state(self):
+        if not self.is_initialized:
+            raise UnboundLocalError("Can't access the state of a not initialized register")
+        return self._state
+
+    @state.setter
+    def state(self, state):
+        self._state = state
+        self._samplers.clear()
+
+    def to_complexm(self):
+        '''
+        Returns the quantum state of the register as a 2^n×1 ComplexM
+        '''
+        return self._backend.to_complexm(self.state)
+
+    def state_to_string(self):
+        '''
+        Returns the basis states of the register whose amplitude is not zero
+        with their amplitudes, one per line
+        '''
+        lines = []
+        for index, amplitude in enumerate(self.state):
+            if amplitude != 0:
+                bitstring = format(index, '0{0}b'.format(self.nqubits))
+                lines.append("|{0}⟩ {1}".format(bitstring, Complex(complex(amplitude)).to_string()))
+        return "\n".join(lines)
+
+    def get_sampler(self, qubits=None):
+        '''
+        Returns an OutcomeSampler of the values of the given qubits (all of
+        them if None). The distribution is computed only once for every state
+        of the register, so any number of shots can be drawn from it.
+        '''
+        key = None if qubits is None else tuple(qubits)
+        sampler = self._samplers.get(key)
+        if sampler is None:
+            sampler = self._samplers[key] = self._backend.sampler(self.state, qubits)
+        return sampler
+
+    def measure(self):
+        '''
+        Measures every qubit of the register, its state collapses to the
+        basis state observed. Returns the observed bitstring.
+        '''
+        outcome = self.get_sampler().sample()[0]
+        bitstring = format(outcome, '0{0}b'.format(self.nqubits))
+        self.initialize(bitstring)
+        return bitstring
+
     @value.setter
     def value(self, value):
         self._value = value
@@ -171,14 +272,23 @@ class QRegister(object):
         return bitstring_to_matrix(bitstring, self.sqrt_size)
 
     def initialize(self, value=None):
+        self._samplers.clear()
         if value is None:
             matrix = [[0 for _ in range(self._sqrt_size)] for _ in range(self._sqrt_size)]
+            self._state = self._backend.basis_state(self.nqubits, 0)
         else:
             matrix = self._get_matrix_from_bitstring(value)
+            # The first bit of the bitstring is the qubit 0, the most significant one
+            self._state = self._backend.basis_state(self.nqubits, int(value, 2) << (self.nqubits - len(value)))
 
-        self.value = ComplexM(self._sqrt_size, self._sqrt_size, matrix)
+        if self._precision == DEFAULT_PRECISION:
+            self.value = ComplexM(self._sqrt_size, self._sqrt_size, matrix)
+        else:
+            self.value = ArrayComplexM(self._sqrt_size, self._sqrt_size, matrix, self._precision)
 
 class QVariable(object):
+    __slots__ = ('_value',)
+
     def __init__(self, value):
         self._value = value
 
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+'''
+Library of the gates of the quantum assembler language
+
+@author: Jordi Llull
+'''
+
+from collections.abc import Hashable
+from math import sqrt
+from qinstruction import Gate, CNot, H, Identity
+from qmath import ComplexM, LinearOperator, KroneckerOperator, ProductChain, IdentityOp, \
+                  PermutationOp, DerivedResultsCache, hadamard_scale, materialize
+
+# Results of TENSOR and CONCAT with more elements are kept lazy
+MAX_DENSE_ELEMENTS = 2 ** 12
+
+
+# Operators of the gates, built once so their derived results (adjoint,
+# unitarity verdict...) are cached too
+_GATE_OPERATORS = {}
+
+# Gates that are their own inverse
+SELF_INVERSE_GATES = (H, CNot, Identity)
+
+
+def get_gate_operator(gate):
+    '''
+    Returns the operator of a gate of the assembler language: H is the 2×2
+    Hadamard gate, CNOT the 4×4 PermutationOp([0, 1, 3, 2]) and In the n×n
+    IdentityOp
+    @gate: Gate
+    '''
+    if not isinstance(gate, (H, CNot, Identity)):
+        raise TypeError("Unknown gate {0}".format(gate))
+
+    key = str(gate)
+    operator = _GATE_OPERATORS.get(key)
+    if operator is None:
+        if isinstance(gate, H):
+            x = 1 / sqrt(2)
+            operator = ComplexM(2, 2, [[x, x], [x, -x]])
+        elif isinstance(gate, CNot):
+            operator = PermutationOp([0, 1, 3, 2])
+        else:
+            operator = IdentityOp(gate.size)
+        _GATE_OPERATORS[key] = operator
+    return operator
+
+
+def get_operator(matrix):
+    '''
+    Returns the operator of a gate, other matrices are returned as they are
+    @matrix: Gate, ComplexM or LinearOperator
+    '''
+    if isinstance(matrix, Gate):
+        return get_gate_operator(matrix)
+    return matrix
+
+
+def _is_structured(matrix):
+    return isinstance(matrix, (IdentityOp, PermutationOp))
+
+
+def _is_lazy(matrix):
+    return isinstance(matrix, LinearOperator) and not _is_structured(matrix)
+
+
+def _is_hadamard_layer(matrix):
+    '''
+    Tells whether a matrix is H or a KroneckerOperator of H factors
+    '''
+    factors = matrix.factors if isinstance(matrix, KroneckerOperator) else (matrix,)
+    return all(isinstance(factor, ComplexM) and hadamard_scale(factor) is not None for factor in factors)
+
+
+def tensor_operands(a, b):
+    '''
+    Returns the tensor product a ⊗ b. Products of identities and
+    permutations are a PermutationOp (or an IdentityOp), products of lazy
+    operands or with more than MAX_DENSE_ELEMENTS elements a
+    KroneckerOperator of the operands as they are, so big results are never
+    built and identities, permutations and lazy products stay structured.
+    Tensor powers of H are kept as a KroneckerOperator of H factors too, so
+    they are applied with the fast Walsh–Hadamard transform.
+    @a: Gate, ComplexM or LinearOperator
+    @b: Gate, ComplexM or LinearOperator
+    '''
+    a = get_operator(a)
+    b = get_operator(b)
+    if _is_structured(a) and _is_structured(b):
+        return a.tensor(b)
+
+    elements = a.size[0] * a.size[1] * b.size[0] * b.size[1]
+    if _is_lazy(a) or _is_lazy(b) or elements > MAX_DENSE_ELEMENTS or \
+            (_is_hadamard_layer(a) and _is_hadamard_layer(b)):
+        return KroneckerOperator(a, b)
+    return materialize(a).tensor(materialize(b))
+
+
+def concat_operands(a, b):
+    '''
+    Returns the operator that applies a and then b, i.e. the product b·a.
+    Identities are dropped, permutations compose into a PermutationOp and
+    products of lazy operands or with more than MAX_DENSE_ELEMENTS elements
+    are kept as a ProductChain.
+    @a: Gate, ComplexM or LinearOperator
+    @b: Gate, ComplexM or LinearOperator
+    '''
+    a = get_operator(a)
+    b = get_operator(b)
+    if a.size[0] != b.size[1]:
+        raise ValueError("Can't concat a matrix of size {0}x{1} with a matrix of size {2}x{3}"
+                         .format(a.size[0], a.size[1], b.size[0], b.size[1]))
+
+    if isinstance(a, IdentityOp):
+        return b
+    elif isinstance(b, IdentityOp):
+        return a
+    elif _is_structured(a) and _is_structured(b):
+        return b * a
+
+    elements = b.size[0] * a.size[1]
+    if _is_lazy(a) or _is_lazy(b) or elements > MAX_DENSE_ELEMENTS:
+        return ProductChain(b, a)
+    return materialize(b) * materialize(a)
+
+
+def inverse_operand(matrix):
+    '''
+    Returns the inverse of a matrix. The gates H, CNOT and In are their own
+    inverse, so the gate itself is returned and applying it acts on the same
+    qubits (every qubit for H). Structured and lazy operators are inverted
+    symbolically, the inverse of an unitary ComplexM is its adjoint and other
+    matrices are inverted with a LU decomposition (see ComplexM.inverse).
+    @matrix: Gate, ComplexM or LinearOperator
+    '''
+    if isinstance(matrix, SELF_INVERSE_GATES):
+        return matrix
+    return get_operator(matrix).inverse()
+
+
+def get_gate_targets(matrix, nqubits):
+    '''
+    Returns the qubits of a register of nqubits qubits a gate is applied to. A
+    gate of size 2^k×2^k acts on the k leading qubits of the register.
+    @matrix: ComplexM or LinearOperator
+    '''
+    m, n = matrix.size
+    k = m.bit_length() - 1
+    if m != n or m != 1 << k or k > nqubits:
+        raise ValueError("A gate of size {0}x{1} can't be applied to a register of {2} qubits"
+                         .format(m, n, nqubits))
+    return tuple(range(k))
+
+
+class _OperatorKey(object):
+    '''
+    Key of a lazy operator in the cache of kernels. It is equal only to the
+    key of the same operator, which it keeps alive so its id isn't reused
+    while the kernel is cached.
+    '''
+    __slots__ = ('operator',)
+
+    def __init__(self, operator):
+        self.operator = operator
+
+    def __eq__(self, other):
+        return isinstance(other, _OperatorKey) and other.operator is self.operator
+
+    def __hash__(self):
+        return id(self.operator)
+
+
+class GateLibrary(object):
+    """
+    Kernels of the gates applied to the registers of a QComputer
+
+    The kernel of a gate is compiled by the backend once per (gate, width,
+    target qubits) and kept in a least recently used cache, so applying the
+    same gate again to a register of the same width doesn't build any matrix.
+    The H gate is applied to every qubit of the register with the fast
+    Walsh–Hadamard transform of the backend.
+    """
+    def __init__(self, backend, maxsize=256, max_elements=2 ** 22):
+        '''
+        @backend: StateVectorBackend
+        @maxsize: maximum number of kernels kept
+        @max_elements: maximum number of amplitudes of the states the kept
+                       kernels are compiled for
+        '''
+        self._backend = backend
+        self._kernels = DerivedResultsCache(maxsize, max_elements)
+
+    @property
+    def backend(self):
+        return self._backend
+
+    def get_kernel(self, matrix, nqubits):
+        '''
+        Returns the kernel that applies the gate to a register of nqubits
+        qubits. The kernel takes the state of the register and returns the new
+        one.
+        @matrix: Gate, ComplexM or LinearOperator
+        '''
+        backend = self._backend
+        if isinstance(matrix, H):
+            targets = tuple(range(nqubits))
+            key = (str(matrix), nqubits, targets)
+            return self._kernels.get(key, lambda: lambda state: backend.apply_hadamard(state), 1 << nqubits)
+
+        if isinstance(matrix, Gate):
+            operator = get_gate_operator(matrix)
+            key = str(matrix)
+        else:
+            operator = matrix
+            key = matrix
+
+        targets = get_gate_targets(operator, nqubits)
+
+        def compute():
+            return backend.compile(operator, targets, nqubits)
+
+        if isinstance(key, LinearOperator) and not isinstance(key, Hashable):
+            # Lazy operators are compared by identity: applying the same
+            # variable again reuses its kernel without evaluating it
+            key = _OperatorKey(key)
+        elif not isinstance(key, Hashable):
+            # Mutable matrices (a ComplexMBuffer) can't be cached
+            return compute()
+        return self._kernels.get((key, nqubits, targets), compute, 1 << nqubits)
+
+    def info(self):
+        return self._kernels.info()
+
+    def clear(self):
+        self._kernels.clear()
@@ -6,11 +6,32 @@ Quantum Computer simulator
 '''
 
 from qinstruction import Instruction, Select, Initialize, Apply, Concat, \
-                         Measure, Tensor, Inverse
+                         Measure, Tensor, Inverse, Gate, Variable, Register
 from qmath import ComplexM
+from qgates import tensor_operands, concat_operands, inverse_operand
 from abc import ABCMeta, abstractmethod
 
 
+def get_operand(computer, matrix):
+    '''
+    Returns the value of an operand of an instruction: gates are returned as
+    they are, variables are replaced by their values, which are not copied,
+    and registers by their quantum state as a 2^n×1 ComplexM
+    @computer: QComputer
+    @matrix: Gate, Variable or Register
+    '''
+    if isinstance(matrix, Gate):
+        return matrix
+    elif isinstance(matrix, Variable):
+        if matrix.name not in computer.variables:
+            raise KeyError("The variable {0} is not defined".format(matrix.name))
+        return computer.variables[matrix.name].value
+    elif isinstance(matrix, Register):
+        return computer.registers[matrix.number].to_complexm()
+
+    raise TypeError("Can't use an object of type {0} as a matrix".format(type(matrix)))
+
+
 class InstructionHandler(metaclass=ABCMeta):
 
     def __init__(self, instruction):
@@ -80,6 +101,107 @@ class SelectHandler(InstructionHandler):
         computer.set_variable(variable, value)
 
 
+class ApplyHandler(InstructionHandler):
+
+    @classmethod
+    def get_handled_instructions(cls):
+        '''
+        @return: A tuple of handled instructions
+        '''
+        return (Apply,)
+
+    def execute(self, computer):
+        '''
+        @computer: QComputer
+        '''
+        register = computer.registers[self.instruction.register.number]
+        matrix = get_operand(computer, self.instruction.matrix)
+
+        # The kernels of the gates are compiled once by the gate library and
+        # reused by every APPLY on a register of the same size
+        kernel = computer.gate_library.get_kernel(matrix, register.nqubits)
+        register.state = kernel(register.state)
+
+
+class MeasureHandler(InstructionHandler):
+
+    @classmethod
+    def get_handled_instructions(cls):
+        '''
+        @return: A tuple of handled instructions
+        '''
+        return (Measure,)
+
+    def execute(self, computer):
+        '''
+        @computer: QComputer
+        '''
+        register = computer.registers[self.instruction.register.number]
+        bitstring = register.measure()
+
+        # The result of the measure is saved as a vector of bits, like the
+        # result of a select
+        value = ComplexM(1, len(bitstring), [list(map(int, bitstring))])
+
+        computer.set_variable(self.instruction.realvar.name, value)
+
+
+class TensorHandler(InstructionHandler):
+
+    @classmethod
+    def get_handled_instructions(cls):
+        '''
+        @return: A tuple of handled instructions
+        '''
+        return (Tensor,)
+
+    def execute(self, computer):
+        '''
+        @computer: QComputer
+        '''
+        op1 = get_operand(computer, self.instruction.op1)
+        op2 = get_operand(computer, self.instruction.op2)
+
+        computer.set_variable(self.instruction.variable.name, tensor_operands(op1, op2))
+
+
+class ConcatHandler(InstructionHandler):
+
+    @classmethod
+    def get_handled_instructions(cls):
+        '''
+        @return: A tuple of handled instructions
+        '''
+        return (Concat,)
+
+    def execute(self, computer):
+        '''
+        @computer: QComputer
+        '''
+        matrix1 = get_operand(computer, self.instruction.matrix1)
+        matrix2 = get_operand(computer, self.instruction.matrix2)
+
+        computer.set_variable(self.instruction.variable.name, concat_operands(matrix1, matrix2))
+
+
+class InverseHandler(InstructionHandler):
+
+    @classmethod
+    def get_handled_instructions(cls):
+        '''
+        @return: A tuple of handled instructions
+        '''
+        return (Inverse,)
+
+    def execute(self, computer):
+        '''
+        @computer: QComputer
+        '''
+        matrix = get_operand(computer, self.instruction.matrix)
+
+        computer.set_variable(self.instruction.variable.name, inverse_operand(matrix))
+
+
 class DummyPrintHandler(InstructionHandler):
 
     @classmethod
@@ -4,75 +4,119 @@ Handles complex numbers
 @author: Jordi Llull
 '''
 
-from math import sqrt
+from math import sqrt, hypot
 from math import sin, cos, atan, pi
+from operator import add, sub, mul, neg
+from itertools import chain, islice, repeat
+from functools import reduce
+from abc import ABCMeta, abstractmethod
+from collections import OrderedDict, namedtuple
 try:
     from prettytable import PrettyTable
     PRETTY_PRINT = True
 except ImportError:
     PRETTY_PRINT = False
+try:
+    import numpy
+    NUMPY = True
+except ImportError:
+    NUMPY = False
 
 
 class Complex(object):
+    """
+    Complex number.
+
+    Complex numbers are immutable values: the operations always return new
+    numbers, so they can be safely shared between matrices and caches.
+    """
+
+    __slots__ = ('_real', '_imaginary')
 
     def __init__(self, real=None, imaginary=None):
         if imaginary is None:
             value = real
             if value is None:
-                self.value = (0, 0)
+                self._real = 0
+                self._imaginary = 0
             elif isinstance(value, (int, float)):
-                self.value = (value, 0)
+                self._real = value
+                self._imaginary = 0
             elif isinstance(value, Complex):
-                self.value = (value.real_value, value.imaginary_value)
+                self._real = value._real
+                self._imaginary = value._imaginary
+            elif isinstance(value, complex):
+                self._real = value.real
+                self._imaginary = value.imag
             elif isinstance(value, (tuple, list)) and len(value) == 2:
-                self.value = (value[0], value[1])
+                if not isinstance(value[0], (int, float)) or not isinstance(value[1], (int, float)):
+                    raise TypeError("The real and the imaginary part of a complex number should be valid real numbers")
+                self._real = value[0]
+                self._imaginary = value[1]
             else:
 
                 raise TypeError("Cannot make a complex number from an object of class {0}"
                                 .format(value.__class__.__name__))
+        elif isinstance(real, (int, float)) and isinstance(imaginary, (int, float)):
+            self._real = real
+            self._imaginary = imaginary
         else:
-            self.value = (real, imaginary)
+            raise TypeError("The real and the imaginary part of a complex number should be valid real numbers")
+
+    @staticmethod
+    def _make(real, imaginary):
+        '''
+        Trusted constructor used internally when real and imaginary are
+        already known to be valid real numbers
+        '''
+        c = _new_object(Complex)
+        c._real = real
+        c._imaginary = imaginary
+        return c
 
     @property
     def value(self):
-        return self._value
-
-    @value.setter
-    def value(self, new_value):
-        if not isinstance(new_value, tuple):
-            raise ValueError("The complex value should be a tuple of size 2")
-
-        if isinstance(new_value[0], (int, float)) and isinstance(new_value[1], (int, float)):
-            self._value = new_value
-        else:
-            raise TypeError("The real and the imaginary part of a complex number should be valid real numbers")
+        return (self._real, self._imaginary)
 
     @property
     def real_value(self):
-        return self.value[0]
+        return self._real
 
     @property
     def imaginary_value(self):
-        return self.value[1]
+        return self._imaginary
 
     def __str__(self):
         return self.to_string()
 
+    def __complex__(self):
+        return complex(self._real, self._imaginary)
+
     def __add__(self, other):
-        other = Complex(other)
+        if not isinstance(other, Complex):
+            other = Complex(other)
 
-        real = self.real_value + other.real_value
-        imaginary = self.imaginary_value + other.imaginary_value
+        return _make_complex(self._real + other._real, self._imaginary + other._imaginary)
 
-        return Complex(real, imaginary)
+    __radd__ = __add__
 
     def __sub__(self, other):
-        other = Complex(other)
+        if not isinstance(other, Complex):
+            other = Complex(other)
+
+        return _make_complex(self._real - other._real, self._imaginary - other._imaginary)
 
-        return self.__add__(-other)
+    def __rsub__(self, other):
+        return Complex(other) - self
 
     def __mul__(self, other):
-        if isinstance(other, ComplexM):
+        if isinstance(other, Complex):
+            a = self._real
+            b = self._imaginary
+            c = other._real
+            d = other._imaginary
+            return _make_complex(a * c - b * d, a * d + b * c)
+        elif isinstance(other, (ComplexM, LinearOperator)):
             return other * self
         else:
             other = Complex(other)
@@ -80,13 +124,17 @@ class Complex(object):
             real = (self.real_value * other.real_value) - (self.imaginary_value * other.imaginary_value)
             imaginary = (self.real_value * other.imaginary_value) + (self.imaginary_value * other.real_value)
 
-            return Complex(real, imaginary)
+            return _make_complex(real, imaginary)
+
+    def __rmul__(self, other):
+        return self * Complex(other)
 
     def __div__(self, other):
         return self.__truediv__(other)
 
     def __truediv__(self, other):
-        other = Complex(other)
+        if not isinstance(other, Complex):
+            other = Complex(other)
         dividend = other.real_value ** 2.0 + other.imaginary_value ** 2.0
         if dividend == 0:
             raise ZeroDivisionError("Can't divide a complex number by 0")
@@ -94,29 +142,42 @@ class Complex(object):
         real = (self.real_value * other.real_value + self.imaginary_value * other.imaginary_value) / dividend
         imaginary = (self.imaginary_value * other.real_value - self.real_value * other.imaginary_value) / dividend
 
-        return Complex(real, imaginary)
+        return _make_complex(real, imaginary)
+
+    def __rtruediv__(self, other):
+        return Complex(other) / self
 
     def __neg__(self):
-        return Complex(-self.real_value, -self.imaginary_value)
+        return _make_complex(-self._real, -self._imaginary)
 
     def __abs__(self):
         '''
         returns the modulus of the complex number
         '''
-        return sqrt(self.real_value ** 2 + self.imaginary_value ** 2)
+        return sqrt(self._real ** 2 + self._imaginary ** 2)
 
     def __eq__(self, other):
-        other = Complex(other)
-        return self.real_value == other.real_value and self.imaginary_value == other.imaginary_value
+        if not isinstance(other, Complex):
+            other = Complex(other)
+        return self._real == other._real and self._imaginary == other._imaginary
 
     def get_value(self):
-        return self.__value
+        return self.value
+
+    @staticmethod
+    def intern(value):
+        '''
+        Returns a shared instance when value is one of the common constants
+        (0, ±1, ±i, ±1/√2, ±i/√2) or a Complex equal to value otherwise
+        '''
+        return _to_complex(value)
 
     def set_value_from_polar(self, modulus, angle):
-        real = modulus * cos(angle)
-        imaginary = modulus * sin(angle)
-        self.value = (real, imaginary)
-        return self
+        '''
+        Returns the complex number with the given modulus and angle. Complex
+        numbers are immutable, so self is not modified.
+        '''
+        return _make_complex(modulus * cos(angle), modulus * sin(angle))
 
     def get_value_as_polar(self):
         a = self.real_value
@@ -132,52 +193,348 @@ class Complex(object):
         return (modulus, angle)
 
     def conjugate(self):
-        return Complex(self.real_value, -self.imaginary_value)
+        return _make_complex(self._real, -self._imaginary)
 
     def to_string(self):
         string = ""
+        real = _format_number(self.real_value)
+        imaginary = _format_number(abs(self.imaginary_value))
         if self.real_value != 0:
             if self.imaginary_value == 0:
-                string = "{0}".format(self.real_value)
+                string = "{0}".format(real)
             else:
-                i = abs(self.imaginary_value) if abs(self.imaginary_value) != 1 else ""
-                string = "{real}{sign}{imaginary}i".format(real=self.real_value,
+                i = imaginary if imaginary != 1 else ""
+                string = "{real}{sign}{imaginary}i".format(real=real,
                                                            imaginary=i,
                                                            sign='+' if self.imaginary_value > 0 else "-")
         elif self.imaginary_value != 0:
             sign = "-" if self.imaginary_value < 0 else ""
-            imaginary = abs(self.imaginary_value) if abs(self.imaginary_value) != 1 else ""
-            string = "{0}{1}i".format(sign, imaginary)
+            i = imaginary if imaginary != 1 else ""
+            string = "{0}{1}i".format(sign, i)
         else:
             string = "0"
 
         return string
 
 
+_new_object = object.__new__
+_make_complex = Complex._make
+
+
+def _build_interned_table():
+    table = {}
+    s2 = [1 / sqrt(2), sqrt(2) / 2]
+    values = [(0, 0), (1, 0), (-1, 0), (0, 1), (0, -1)]
+    for x in s2:
+        values += [(x, 0), (-x, 0), (0, x), (0, -x)]
+
+    for real, imaginary in values:
+        table[(real, imaginary)] = _make_complex(real, imaginary)
+
+    return table
+
+# Common values (0, ±1, ±i, ±1/√2, ±i/√2) are interned so the matrices
+# using them share the same Complex objects
+_INTERNED_COMPLEX = _build_interned_table()
+
+
+def _interned_complex(real, imaginary):
+    '''
+    Same as Complex._make but returning the interned instance of common values
+    '''
+    c = _INTERNED_COMPLEX.get((real, imaginary))
+    return c if c is not None else _make_complex(real, imaginary)
+
+
+_ONE = _interned_complex(1, 0)
+_MINUS_ONE = _interned_complex(-1, 0)
+
+
+def _to_complex(x):
+    '''
+    Converts any value accepted by the Complex constructor to a Complex,
+    reusing the interned instances of common values
+    '''
+    if isinstance(x, Complex):
+        return _INTERNED_COMPLEX.get((x._real, x._imaginary), x)
+    elif isinstance(x, (int, float)):
+        c = _INTERNED_COMPLEX.get((x, 0))
+    elif isinstance(x, complex):
+        c = _INTERNED_COMPLEX.get((x.real, x.imag))
+    elif isinstance(x, (tuple, list)) and len(x) == 2 and \
+            isinstance(x[0], (int, float)) and isinstance(x[1], (int, float)):
+        c = _INTERNED_COMPLEX.get((x[0], x[1]))
+    else:
+        c = None
+    return c if c is not None else Complex(x)
+
+
+def _format_number(x):
+    '''
+    Integral floats are displayed as integers so a value prints the same way
+    regardless of the kernel that computed it
+    '''
+    if isinstance(x, float) and x.is_integer():
+        return int(x)
+    return x
+
+
+# Maximum ratio of non zero values of a SparseComplexM for which the sparse
+# kernels are used
+SPARSE_DENSITY_THRESHOLD = 0.25
+
+# Size of the tiles in which the matrix multiplication is split
+MATMUL_BLOCK_SIZE = 64
+
+# Precisions of the values of an ArrayComplexM. complex64 halves the memory
+# and the bandwidth used at the cost of ~7 significant digits instead of ~16.
+# ComplexM and the other pure Python matrices always use double precision.
+PRECISIONS = ('complex128', 'complex64')
+DEFAULT_PRECISION = 'complex128'
+
+
+def check_precision(precision):
+    '''
+    Raises a ValueError if precision is not one of PRECISIONS
+    '''
+    if precision not in PRECISIONS:
+        raise ValueError("Unknown precision {0}, expected one of {1}"
+                         .format(precision, ', '.join(PRECISIONS)))
+
+
+def _split_float_planes(rows):
+    '''
+    Given an iterable of rows of Complex numbers returns two lists of rows of
+    floats, one with the real parts and the other with the imaginary parts.
+    '''
+    real = []
+    imaginary = []
+    for row in rows:
+        real.append([x.real_value for x in row])
+        imaginary.append([x.imaginary_value for x in row])
+
+    return real, imaginary
+
+
+def _fused_dot(a, b, conjugate):
+    '''
+    Returns the real and imaginary parts of Σ aᵢⱼ·bᵢⱼ (or Σ conj(aᵢⱼ)·bᵢⱼ if
+    conjugate is True) for two matrices of the same size without building any
+    intermediate Complex
+    '''
+    a_real, a_imaginary, a_sign = a._float_planes(by_rows=True)
+    b_real, b_imaginary, b_sign = b._float_planes(by_rows=True)
+    if conjugate:
+        a_sign = -a_sign
+
+    a_real = [x for row in a_real for x in row]
+    a_imaginary = [x for row in a_imaginary for x in row]
+    b_real = [x for row in b_real for x in row]
+    b_imaginary = [x for row in b_imaginary for x in row]
+
+    rr = sum(map(mul, a_real, b_real))
+    ii = sum(map(mul, a_imaginary, b_imaginary))
+    ri = sum(map(mul, a_real, b_imaginary))
+    ir = sum(map(mul, a_imaginary, b_real))
+
+    return rr - a_sign * b_sign * ii, b_sign * ri + a_sign * ir
+
+
+def _scaled_planes(matrix, coefficient):
+    '''
+    Returns two iterators over the real and the imaginary parts of the values
+    of coefficient·matrix in row major order. Nothing is computed until the
+    iterators are consumed.
+    '''
+    real, imaginary, sign = matrix._float_planes(by_rows=True)
+    cr = coefficient.real_value
+    ci = coefficient.imaginary_value
+
+    if ci == 0 and cr == 1:
+        imaginary = chain.from_iterable(imaginary)
+        return chain.from_iterable(real), imaginary if sign == 1 else map(neg, imaginary)
+    elif ci == 0 and cr == -1:
+        imaginary = chain.from_iterable(imaginary)
+        return map(neg, chain.from_iterable(real)), map(neg, imaginary) if sign == 1 else imaginary
+
+    # (x + i·s·y)(cr + i·ci) = (x·cr - y·s·ci) + i(x·ci + y·s·cr)
+    sci = sign * ci
+    scr = sign * cr
+    return (map(lambda x, y: x * cr - y * sci, chain.from_iterable(real), chain.from_iterable(imaginary)),
+            map(lambda x, y: x * ci + y * scr, chain.from_iterable(real), chain.from_iterable(imaginary)))
+
+
+def _combined_planes(terms):
+    '''
+    Returns two iterators over the real and the imaginary parts of the values
+    of Σ cₖ·Aₖ for the given (Aₖ, cₖ) pairs in row major order
+    '''
+    planes = [_scaled_planes(matrix, coefficient) for matrix, coefficient in terms]
+    add_planes = lambda a, b: map(add, a, b)
+
+    return reduce(add_planes, (p[0] for p in planes)), reduce(add_planes, (p[1] for p in planes))
+
+
+def _linear_combination(terms):
+    '''
+    Returns the ComplexM Σ cₖ·Aₖ for the given (Aₖ, cₖ) pairs of matrices of
+    the same size computing every value in a single pass over the operands and
+    without any intermediate matrix
+    '''
+    m, n = terms[0][0].size
+    values = map(_interned_complex, *_combined_planes(terms))
+
+    return ComplexM._from_matrix(m, n, tuple(tuple(islice(values, n)) for _ in range(m)))
+
+
+def _linear_combination_norm(terms):
+    '''
+    Returns the norm of Σ cₖ·Aₖ for the given (Aₖ, cₖ) pairs without building
+    the combination. As ComplexM.norm() it is the square root of the inner
+    product of the combination with itself.
+    '''
+    m, n = terms[0][0].size
+    # Σ conj(vᵢ)·vᵢ for vectors and Tr(Aᵀ·A) = Σ aᵢⱼ·aᵢⱼ for squared matrices
+    sign = 1 if n == 1 else -1
+    real, imaginary = _combined_planes(terms)
+    rr = 0.0
+    ii = 0.0
+    for x, y in zip(real, imaginary):
+        rr += x * x
+        ii += y * y
+
+    return sqrt(rr + sign * ii)
+
+
+# Default tolerances used when checking whether two values are equal
+DEFAULT_ATOL = 1e-08
+DEFAULT_RTOL = 1e-05
+
+
+def _is_close(real, imaginary, expected_real, expected_imaginary, atol, rtol):
+    '''
+    Same criteria as numpy.isclose: |a - b| <= atol + rtol·|b|
+    '''
+    return hypot(real - expected_real, imaginary - expected_imaginary) <= atol + rtol * hypot(expected_real, expected_imaginary)
+
+
+def _is_identity(matrix, atol, rtol):
+    '''
+    Checks whether a dense matrix is close to the identity
+    '''
+    real, imaginary, sign = matrix._float_planes(by_rows=True)
+    for i, (row_real, row_imaginary) in enumerate(zip(real, imaginary)):
+        for j, (x, y) in enumerate(zip(row_real, row_imaginary)):
+            if not _is_close(x, sign * y, 1 if i == j else 0, 0, atol, rtol):
+                return False
+    return True
+
+
+def check_matrix_size(m, n, matrix):
+    '''
+    Raises a ValueError if the given bidimensional array is not of size m×n
+    '''
+    len_m = len(matrix)
+    len_n = [lx for lx in map(lambda x: len(x), matrix) if lx != n]
+
+    if len_m != m or len_n != []:
+        if len_n != []:
+            len_n = len_n[0]
+        else:
+            len_n = n
+        raise ValueError("Expected a bidimensional array of length {0}x{1}. An array of {2}x{3} was given instead"
+                         .format(m, n, len_m, len_n))
+
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize', 'elements', 'max_elements'])
+
+
+class DerivedResultsCache(object):
+    """
+    Least recently used cache for the expensive results derived from immutable
+    matrices (inverse, powers, eigendecomposition...).
+
+    Every entry has a weight (roughly the number of complex values it keeps
+    alive) and the least recently used entries are evicted when either the
+    number of entries is over maxsize or the total weight is over
+    max_elements, so the memory used by the cache is bounded even for large
+    matrices.
+    """
+    def __init__(self, maxsize=1024, max_elements=2 ** 20):
+        self._maxsize = maxsize
+        self._max_elements = max_elements
+        self._entries = OrderedDict()
+        self._elements = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, compute, weight):
+        '''
+        Returns the cached value for key, calling compute() to get it if it
+        is not in the cache
+        '''
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[0]
+
+        self.misses += 1
+        value = compute()
+        if weight <= self._max_elements:
+            self._entries[key] = (value, weight)
+            self._elements += weight
+            self._evict()
+        return value
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def _evict(self):
+        while len(self._entries) > self._maxsize or self._elements > self._max_elements:
+            _, (_, weight) = self._entries.popitem(last=False)
+            self._elements -= weight
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self._maxsize, len(self._entries),
+                         self._elements, self._max_elements)
+
+    def clear(self):
+        self._entries.clear()
+        self._elements = 0
+        self.hits = 0
+        self.misses = 0
+
+
+DERIVED_RESULTS_CACHE = DerivedResultsCache()
+
+
 class ComplexM(object):
     """
     Complex matrix manipulation
     """
     def __init__(self, m, n, matrix):
-        len_m = len(matrix)
-        len_n = [lx for lx in map(lambda x: len(x), matrix) if lx != n]
-
-        if len_m != m or len_n != []:
-            if len_n != []:
-                len_n = len_n[0]
-            else:
-                len_n = n
-            raise ValueError("Expected a bidimensional array of length {0}x{1}. An array of {2}x{3} was given instead"
-                             .format(m, n, len_m, len_n))
+        check_matrix_size(m, n, matrix)
 
         self._size = (m, n)
 
         my_mat = []
         for row in matrix:
-            my_mat.append(tuple(map(lambda x: Complex(x), row)))
+            my_mat.append(tuple(map(_to_complex, row)))
 
         self._matrix = tuple(my_mat)
 
+    @staticmethod
+    def _from_matrix(m, n, matrix):
+        '''
+        Trusted constructor used by the kernels, matrix should already be a
+        tuple of m tuples of n Complex numbers
+        '''
+        instance = _new_object(ComplexM)
+        instance._size = (m, n)
+        instance._matrix = matrix
+        return instance
+
     @property
     def matrix(self):
         return self._matrix
@@ -197,26 +554,40 @@ class ComplexM(object):
                 raise ValueError("Can't sum ComplexM of size {0} with a ComplexM of size {1}"
                                  .format(self_size, other_size))
 
-            new_values = tuple(map(lambda r1, r2: tuple(map(lambda x, y: x + y, r1, r2)), self, other))
+            new_values = tuple(map(lambda r1, r2: tuple(map(add, r1, r2)), self, other))
             m, n = self.size
-            return ComplexM(m, n, tuple(new_values))
+            return ComplexM._from_matrix(m, n, new_values)
         else:
             raise TypeError("Cannot sum a ComplexM with and object of class {0}"
                             .format(other.__class__.__name__))
 
     def __sub__(self, other):
-        return self.__add__(-other)
+        if isinstance(other, ComplexM):
+            self._check_same_size(other, "subtract")
+            return _linear_combination(((self, _ONE), (other, _MINUS_ONE)))
+        else:
+            raise TypeError("Cannot subtract a ComplexM with and object of class {0}"
+                            .format(other.__class__.__name__))
+
+    def _check_same_size(self, other, operation):
+        if self.size != other.size:
+            self_size = 'x'.join(map(lambda x: str(x), self.size))
+            other_size = 'x'.join(map(lambda x: str(x), other.size))
+            raise ValueError("Can't {0} ComplexM of size {1} with a ComplexM of size {2}"
+                             .format(operation, self_size, other_size))
 
     def __eq__(self, other):
+        if isinstance(other, LinearOperator):
+            return other == self
         if self.size != other.size:
             return False
 
         return self.matrix == other.matrix
 
     def __scalarmul__(self, other):
-        new_values = tuple(map(lambda i: tuple(map(lambda j: other * j, i)), self))
+        new_values = tuple(map(lambda i: tuple(map(other.__mul__, i)), self))
         m, n = self.size
-        return ComplexM(m, n, new_values)
+        return ComplexM._from_matrix(m, n, new_values)
 
     def __matrixmul__(self, other):
         sm, sn = self.size
@@ -226,40 +597,83 @@ class ComplexM(object):
             raise TypeError("Cannot multiply a ComplexM of size {0}x{1} with a ComplexM of size {2}x{3}"
                             .format(str(sm), str(sn), str(om), str(on)))
 
-        new_values = [[Complex(0) for _ in range(on)] for _ in range(sm)]
-
-        for i in range(sm):
-            for j in range(on):
-                for r1, r2 in zip(self.get_row(i), other.get_col(j)):
-                    new_values[i][j] += r1*r2
-
-        return ComplexM(sm, on, new_values)
+        # The rows of self and the columns of other (transposed only once) are
+        # split into lists of plain floats so every element of the result is
+        # computed with four C level dot products instead of building a
+        # Complex object for every partial product. The imaginary parts of a
+        # conjugated view are not negated, its sign is applied to the sums.
+        a_real, a_imaginary, a_sign = self._float_planes(by_rows=True)
+        b_real, b_imaginary, b_sign = other._float_planes(by_rows=False)
+        ab_sign = a_sign * b_sign
+
+        new_values = [[None] * on for _ in range(sm)]
+        make = _interned_complex
+
+        # Computing the product tile by tile keeps the rows and columns we are
+        # working with small enough to stay in cache
+        block = MATMUL_BLOCK_SIZE
+        for ib in range(0, sm, block):
+            for jb in range(0, on, block):
+                for i in range(ib, min(ib + block, sm)):
+                    ar = a_real[i]
+                    ai = a_imaginary[i]
+                    row = new_values[i]
+                    for j in range(jb, min(jb + block, on)):
+                        br = b_real[j]
+                        bi = b_imaginary[j]
+                        real = sum(map(mul, ar, br)) - ab_sign * sum(map(mul, ai, bi))
+                        imaginary = b_sign * sum(map(mul, ar, bi)) + a_sign * sum(map(mul, ai, br))
+                        row[j] = make(real, imaginary)
+
+        return ComplexM._from_matrix(sm, on, tuple(map(tuple, new_values)))
 
     def __mul__(self, other):
         if isinstance(other, Complex):  # Scalar multiplication
             return self.__scalarmul__(other)
         elif isinstance(other, ComplexM):
             return self.__matrixmul__(other)
+        elif isinstance(other, LinearOperator):
+            return other.__rmul__(self)
         else:
             raise TypeError("Cannot sum a complex number with and object of class {0}"
                             .format(other.__class__.__name__))
 
     def __neg__(self):
-        new_values = tuple(map(lambda i: tuple(map(lambda j:-j, i)), self))
+        new_values = tuple(map(lambda i: tuple(map(neg, i)), self))
         m, n = self.size
-        return ComplexM(m,n, new_values)
+        return ComplexM._from_matrix(m, n, new_values)
 
     def __getitem__(self, i):
         return self.matrix[i]
 
+    def _float_planes(self, by_rows):
+        '''
+        Returns the tuple (real, imaginary, sign) where real and imaginary are
+        lists with the real and imaginary parts of the rows (or the columns if
+        by_rows is False) of the matrix and sign is -1 when the imaginary
+        parts should be negated to obtain the actual values.
+        '''
+        rows = self.matrix if by_rows else zip(*self.matrix)
+        real, imaginary = _split_float_planes(rows)
+        return real, imaginary, 1
+
     def inner_product(self, other):
         if not isinstance(other, ComplexM):
             raise TypeError("Cannot do the inner_product of ComplexM with an object of class {0}".format(other.__class__.__name__))
 
-        if self.is_vector() and other.is_vector():
-            return (self.adjoint() * other).trace()
+        return _interned_complex(*self._inner_product_parts(other))
+
+    def _inner_product_parts(self, other):
+        '''
+        Returns the real and imaginary parts of the inner product computed in
+        a single pass over both matrices
+        '''
+        if self.is_vector() and other.is_vector() and self.size == other.size:
+            # ⟨v, w⟩ = Σ conj(vᵢ)·wᵢ
+            return _fused_dot(self, other, conjugate=True)
         elif self.is_squared() and other.is_squared() and self.size[0] == other.size[0]:
-            return (self.transpose() * other).trace()
+            # Tr(Aᵀ·B) = Σ aᵢⱼ·bᵢⱼ
+            return _fused_dot(self, other, conjugate=False)
         else:
             self_size = 'x'.join(map(lambda x: str(x), self.size))
             other_size = 'x'.join(map(lambda x: str(x), other.size))
@@ -267,18 +681,19 @@ class ComplexM(object):
                              .format(self_size, other_size))
 
     def conjugate(self):
-        new_values = tuple(map(lambda r: tuple(map(lambda x: x.conjugate(), r)), self))
-        m, n = self.size
-        return ComplexM(m, n, new_values)
+        return _ComplexMView(self, transposed=False, conjugated=True)
 
     def transpose(self):
-        m, n = self.size
-        new_values = [[self[j][i] for j in range(m)] for i in range(n)]
+        return self._memoized('transpose', self._compute_transpose)
 
-        return ComplexM(n, m, new_values)
+    def _compute_transpose(self):
+        return _ComplexMView(self, transposed=True, conjugated=False)
 
     def adjoint(self):
-        return self.conjugate().transpose()
+        return self._memoized('adjoint', self._compute_adjoint)
+
+    def _compute_adjoint(self):
+        return _ComplexMView(self, transposed=True, conjugated=True)
 
     def is_vector(self):
         return self.size[1] == 1
@@ -290,57 +705,388 @@ class ComplexM(object):
         if not self.is_squared():
             raise ValueError("A matrix of size {0}x{1} is not an squared matrix"
                              .format(str(self.size[0]), str(self.size[1])))
-        res = Complex(0)
-        for i in range(self.size[0]):
-            res += self[i][i]
+        return self._memoized('trace', self._compute_trace)
+
+    def _compute_trace(self):
+        diagonal = [row[i] for i, row in enumerate(self)]
 
-        return res
+        return _interned_complex(sum(x.real_value for x in diagonal), sum(x.imaginary_value for x in diagonal))
 
     def norm(self):
-        return sqrt(self.inner_product(self).real_value)
+        return self._memoized('norm', lambda: sqrt(self._inner_product_parts(self)[0]))
+
+    def _memoized(self, operation, compute):
+        '''
+        Returns the result of a cheap operation without arguments, computed
+        once and kept by the matrix itself. Looking it up doesn't need the
+        hash of the matrix, which costs as much as computing the result.
+        '''
+        derived = self.__dict__.setdefault('_derived', {})
+        if operation not in derived:
+            derived[operation] = compute()
+        return derived[operation]
+
+    def _cached(self, operation, compute):
+        '''
+        Returns the result of an expensive operation, looking for it first in
+        the cache of derived results so equal matrices share it
+        '''
+        m, n = self.size
+        # The cache keeps both the matrix (as part of the key) and the result
+        return DERIVED_RESULTS_CACHE.get((operation, self._cache_type(), self), compute, 2 * m * n)
+
+    def _cache_type(self):
+        '''
+        Part of the keys of the cache of derived results telling apart equal
+        matrices whose results are stored differently
+        '''
+        return type(self)
+
+    def __hash__(self):
+        h = self.__dict__.get('_hash')
+        if h is None:
+            h = self.__dict__['_hash'] = hash((self.size, self._nonzero_entries()))
+        return h
+
+    def _nonzero_entries(self):
+        '''
+        Returns a tuple with the tuples (i, j, real, imaginary) of every non
+        zero value in row major order. Its hash is the hash of the matrix,
+        which does not depend on how the values are stored.
+        '''
+        real, imaginary, sign = self._float_planes(by_rows=True)
+        entries = []
+        for i, (row_real, row_imaginary) in enumerate(zip(real, imaginary)):
+            for j, (x, y) in enumerate(zip(row_real, row_imaginary)):
+                if x or y:
+                    entries.append((i, j, x, sign * y))
+        return tuple(entries)
 
     def distance(self, other):
-        return (self - other).norm()
+        if not isinstance(other, ComplexM):
+            raise TypeError("Cannot compute the distance between a ComplexM and an object of class {0}"
+                            .format(other.__class__.__name__))
+        self._check_same_size(other, "compute the distance of")
+        if not self.is_vector() and not self.is_squared():
+            raise ValueError("Cannot compute the distance between ComplexM of size {0}x{1}"
+                             .format(str(self.size[0]), str(self.size[1])))
+
+        # ‖A - B‖ is reduced in a single pass without building A - B
+        return _linear_combination_norm(((self, _ONE), (other, _MINUS_ONE)))
+
+    def tensor(self, other, lazy=False):
+        '''
+        Returns the tensor product of self and other. When lazy is True the
+        product is not computed and a KroneckerOperator is returned instead.
+        '''
+        if lazy or isinstance(other, KroneckerOperator):
+            return KroneckerOperator(self, other)
 
-    def tensor(self, other):
         (sm, sn) = self.size
         (m, n) = other.size
         # We are using the formal definition of Tensor here. I.e:
         #     Being size of B m×n
         #     (A ⊗ B)[i, j] = A[i/m, j/n] * B[i % m, j % n]
         tensorFnx = lambda i, j: self[i // m][j // n] * other[i % m][j % n]
+        # Tensor products of gates have very few different values, so equal
+        # values share the same Complex object
+        shared = dict(_INTERNED_COMPLEX)
+        flyweight = lambda c: shared.setdefault((c.real_value, c.imaginary_value), c)
         tensor_size = (sm * m, sn * n)
-        tensor_matrix = [[tensorFnx(i, j) for j in range(tensor_size[1])] for i in range(tensor_size[0])]
+        tensor_matrix = tuple(tuple(flyweight(tensorFnx(i, j)) for j in range(tensor_size[1])) for i in range(tensor_size[0]))
 
-        return ComplexM(tensor_size[0], tensor_size[1], tensor_matrix)
+        return ComplexM._from_matrix(tensor_size[0], tensor_size[1], tensor_matrix)
 
-    def is_hermitian(self):
-        return self.is_squared() and self.adjoint() == self
+    def is_hermitian(self, atol=None, rtol=None):
+        '''
+        Checks whether the matrix is equal to its adjoint. Two values a and b
+        are considered equal when |a - b| <= atol + rtol·|b|, by default with
+        the tolerances given by get_tolerances().
+        '''
+        atol, rtol = self.get_tolerances(atol, rtol)
+        return self.is_squared() and self._cached_verdict('hermitian', atol, rtol, self._check_hermitian)
 
-    def is_unitary(self):
-        if not self.is_squared():
-            return False
-        return self * self.adjoint() == self.get_identity()
+    def is_unitary(self, atol=None, rtol=None):
+        '''
+        Checks whether self * self.adjoint() is the identity. Two values a and
+        b are considered equal when |a - b| <= atol + rtol·|b|, by default with
+        the tolerances given by get_tolerances().
+        '''
+        atol, rtol = self.get_tolerances(atol, rtol)
+        return self.is_squared() and self._cached_verdict('unitary', atol, rtol, self._check_unitary)
+
+    def get_tolerances(self, atol=None, rtol=None):
+        '''
+        Returns the given tolerances, replacing the missing ones by the
+        defaults for the precision the matrix is stored with
+        '''
+        return (DEFAULT_ATOL if atol is None else atol, DEFAULT_RTOL if rtol is None else rtol)
+
+    def _cached_verdict(self, check, atol, rtol, compute):
+        '''
+        Matrices are immutable, so the result of a check is computed only once
+        for every tolerance
+        '''
+        verdicts = self.__dict__.setdefault('_verdicts', {})
+        key = (check, atol, rtol)
+        if key not in verdicts:
+            verdicts[key] = compute(atol, rtol)
+        return verdicts[key]
+
+    def _check_hermitian(self, atol, rtol):
+        # Every aᵢⱼ is compared with conj(aⱼᵢ), stopping at the first mismatch
+        real, imaginary, sign = self._float_planes(by_rows=True)
+        n = self.size[0]
+        for i in range(n):
+            for j in range(i, n):
+                if not _is_close(real[i][j], sign * imaginary[i][j], real[j][i], -sign * imaginary[j][i], atol, rtol):
+                    return False
+        return True
+
+    def _check_unitary(self, atol, rtol):
+        # The rows of a unitary matrix are orthonormal. The inner product of
+        # every pair of rows is computed one by one, stopping at the first one
+        # that does not match the identity.
+        real, imaginary, sign = self._float_planes(by_rows=True)
+        n = self.size[0]
+        for i in range(n):
+            ar = real[i]
+            ai = imaginary[i]
+            for j in range(i, n):
+                br = real[j]
+                bi = imaginary[j]
+                # Σ aᵢₖ·conj(aⱼₖ)
+                dot_real = sum(map(mul, ar, br)) + sum(map(mul, ai, bi))
+                dot_imaginary = sign * (sum(map(mul, ai, br)) - sum(map(mul, ar, bi)))
+                if not _is_close(dot_real, dot_imaginary, 1 if i == j else 0, 0, atol, rtol):
+                    return False
+        return True
 
     def normalize(self):
         norm = self.norm()
+        if norm == 0:
+            raise ZeroDivisionError("Can't divide a complex number by 0")
         (m, n) = self.size
-        new_values = [[self[i][j] / norm for j in range(n)] for i in range(m)]
+        # Same operations as dividing every value by the norm, as Complex does
+        dividend = norm ** 2.0
+        real, imaginary = _scaled_planes(self, _ONE)
+        values = map(lambda x, y: _interned_complex(x * norm / dividend, y * norm / dividend), real, imaginary)
+
+        return ComplexM._from_matrix(m, n, tuple(tuple(islice(values, n)) for _ in range(m)))
+
+    def _get_square(self, i):
+        '''
+        Returns A^(2^i). The squares are kept in the cache of derived results,
+        so they are only computed again once evicted.
+        '''
+        if i == 0:
+            return self
+
+        def compute():
+            half = self._get_square(i - 1)
+            return half * half
+        return self._cached(('power', 1 << i), compute)
+
+    def _get_squares(self, count):
+        '''
+        Returns the list [A, A², A⁴, ...] with count elements
+        '''
+        return [self._get_square(i) for i in range(count)]
+
+    def _count_cached_squares(self):
+        '''
+        Returns how many of the squares A, A², A⁴, ... are available without
+        computing any product
+        '''
+        count = 1
+        while (('power', 1 << count), self._cache_type(), self) in DERIVED_RESULTS_CACHE:
+            count += 1
+        return count
+
+    def power(self, k):
+        '''
+        Returns the kth power of a squared matrix using exponentiation by
+        squaring, so only O(log k) products are computed. Powers are kept in
+        the cache of derived results.
+        '''
+        if not self.is_squared():
+            raise ValueError("Cannot compute the power of a matrix of size {0}x{1}"
+                             .format(str(self.size[0]), str(self.size[1])))
+        if not isinstance(k, int) or k < 0:
+            raise ValueError("The exponent should be a non negative integer")
+
+        if k == 0:
+            return self.get_identity()
+        elif k == 1:
+            return self
+
+        def compute():
+            squares = self._get_squares(k.bit_length())
+            result = None
+            for i in range(k.bit_length()):
+                if k >> i & 1:
+                    result = squares[i] if result is None else result * squares[i]
+            return result
+        return self._cached(('power', k), compute)
+
+    def inverse(self, atol=None, rtol=None):
+        '''
+        Returns the inverse of a squared matrix. The inverse of an unitary
+        matrix is its adjoint, a view built in O(1), other matrices are
+        inverted with a LU decomposition with partial pivoting. Both the
+        unitarity verdict and the inverse are cached.
+        '''
+        if not self.is_squared():
+            raise ValueError("Cannot compute the inverse of a matrix of size {0}x{1}"
+                             .format(str(self.size[0]), str(self.size[1])))
+        if self.is_unitary(atol, rtol):
+            return self.adjoint()
+        return self._cached('inverse', self._compute_inverse)
+
+    def _compute_inverse(self):
+        n = self.size[0]
+        rows = _lu_inverse(complex_rows(self))
+        return ComplexM._from_matrix(n, n, tuple(tuple(_interned_complex(x.real, x.imag) for x in row) for row in rows))
+
+    def evolve(self, vector, steps):
+        '''
+        Generator yielding the tuples (t, state) with the state of the system
+        at each one of the given time steps, being the state at time t
+        selfᵗ * vector.
+
+        For every gap between two consecutive time steps it either applies the
+        matrix once per time step or it applies the cached squares A^(2^i)
+        given by the binary representation of the gap, depending on which one
+        needs less operations.
+        @vector: ComplexM of size n×k
+        @steps: increasing sequence of non negative integers
+        '''
+        if not self.is_squared() or self.size[1] != vector.size[0]:
+            raise ValueError("Cannot evolve a state of size {0}x{1} with a matrix of size {2}x{3}"
+                             .format(str(vector.size[0]), str(vector.size[1]),
+                                     str(self.size[0]), str(self.size[1])))
+
+        n = self.size[0]
+        k = vector.size[1]
+        state = vector
+        t = 0
+        for step in steps:
+            if not isinstance(step, int) or step < t:
+                raise ValueError("The time steps should be an increasing sequence of non negative integers")
+
+            gap = step - t
+            squares = self._count_cached_squares()
+            new_squares = max(gap.bit_length() - squares, 0)
+            stepping_cost = gap * n * n * k
+            squaring_cost = new_squares * n ** 3 + bin(gap).count('1') * n * n * k
+
+            if stepping_cost <= squaring_cost:
+                for _ in range(gap):
+                    state = self * state
+            else:
+                squares = self._get_squares(gap.bit_length())
+                for i in range(gap.bit_length()):
+                    if gap >> i & 1:
+                        state = squares[i] * state
 
-        return ComplexM(m, n, new_values)
+            t = step
+            yield (t, state)
 
-    def get_identity(self):
+    def lazy(self):
+        '''
+        Returns a lazy product chain starting with this matrix. Products with
+        the chain are only computed, in the cheapest order, on evaluate()
+        '''
+        return ProductChain(self)
+
+    def get_identity(self, lazy=False):
+        '''
+        Returns the identity of the size of the matrix, or None if the matrix
+        is not squared. When lazy is True an IdentityOp is returned instead of
+        the dense matrix.
+        '''
         m, n = self.size
         if m != n:
             return None
-        values = [[1 if i == j else 0 for i in range(m)] for j in range(n)]
-        return ComplexM(m, n, values)
+        if lazy:
+            return IdentityOp(m)
+        # The identity only depends on the size of the matrix
+        return DERIVED_RESULTS_CACHE.get(('identity', self._cache_type(), m), self._compute_identity, m * m)
+
+    def _compute_identity(self):
+        return _dense_identity(self.size[0])
 
     def get_row(self, i):
         return self[i]
 
     def get_col(self, j):
-        return self.transpose()[j]
+        return tuple(row[j] for row in self)
+
+    @staticmethod
+    def from_columns(vectors):
+        '''
+        Returns the n×k matrix whose columns are the given k vectors of size n
+        '''
+        vectors = list(vectors)
+        if len(vectors) == 0:
+            raise ValueError("At least one vector is needed to build a matrix from its columns")
+        m = vectors[0].size[0]
+        for vector in vectors:
+            if not isinstance(vector, ComplexM):
+                raise TypeError("Cannot build a ComplexM from an object of class {0}"
+                                .format(vector.__class__.__name__))
+            if vector.size != (m, 1):
+                raise ValueError("All the columns should be vectors of size {0}x1".format(str(m)))
+
+        if NUMPY and all(isinstance(vector, ArrayComplexM) for vector in vectors):
+            return ArrayComplexM._from_array(numpy.hstack([vector.array for vector in vectors]))
+
+        columns = [[row[0] for row in vector] for vector in vectors]
+        return ComplexM._from_matrix(m, len(vectors), tuple(zip(*columns)))
+
+    def get_columns(self):
+        '''
+        Returns the list of the columns of the matrix as vectors
+        '''
+        m = self.size[0]
+        return [ComplexM._from_matrix(m, 1, tuple((x,) for x in column)) for column in zip(*self.matrix)]
+
+    def apply_batch(self, states):
+        '''
+        Applies the matrix to many states with a single matrix product.
+
+        @states: ComplexM of size n×k whose columns are the states, in which
+        case the n×k matrix with the resulting states is returned, or a
+        sequence of vectors of size n×1, in which case the list of resulting
+        vectors is returned
+        '''
+        if isinstance(states, (ComplexM, LinearOperator)):
+            return self * states
+        return (self * ComplexM.from_columns(states)).get_columns()
+
+    def column_norms(self):
+        '''
+        Returns the list with the norm of every column of the matrix
+        '''
+        real, imaginary, _ = self._float_planes(by_rows=False)
+        return [sqrt(sum(map(mul, r, r)) + sum(map(mul, i, i))) for r, i in zip(real, imaginary)]
+
+    def column_probabilities(self):
+        '''
+        Returns a matrix of the same size with the probability |aᵢⱼ|² / ‖aⱼ‖²
+        of observing the state of every column at each of its positions
+        '''
+        m, n = self.size
+        real, imaginary, _ = self._float_planes(by_rows=False)
+        columns = []
+        for r, i in zip(real, imaginary):
+            squares = list(map(add, map(mul, r, r), map(mul, i, i)))
+            total = sum(squares)
+            if total == 0:
+                raise ZeroDivisionError("Can't compute the probabilities of a column with norm 0")
+            columns.append([_interned_complex(x / total, 0.0) for x in squares])
+
+        return ComplexM._from_matrix(m, n, tuple(zip(*columns)))
 
     def to_string(self):
         if PRETTY_PRINT:
@@ -361,6 +1107,2102 @@ class ComplexM(object):
             return string
 
 
+class _ComplexMView(ComplexM):
+    """
+    Transposed and/or conjugated view of a ComplexM.
+
+    The view shares the values of its source matrix. The product, comparison
+    and inner product kernels read the source values directly, the values of
+    the view are only materialized when they are accessed element-wise.
+    """
+    def __init__(self, source, transposed, conjugated):
+        if isinstance(source, _ComplexMView):
+            transposed = transposed != source._transposed
+            conjugated = conjugated != source._conjugated
+            source = source._source
+
+        m, n = source.size
+        self._source = source
+        self._transposed = transposed
+        self._conjugated = conjugated
+        self._size = (n, m) if transposed else (m, n)
+        self._matrix = None
+
+    @property
+    def matrix(self):
+        if self._matrix is None:
+            matrix = self._source.matrix
+            if self._transposed:
+                matrix = tuple(zip(*matrix))
+            if self._conjugated:
+                matrix = tuple(tuple(map(Complex.conjugate, row)) for row in matrix)
+            self._matrix = matrix
+        return self._matrix
+
+    def _float_planes(self, by_rows):
+        real, imaginary, sign = self._source._float_planes(by_rows != self._transposed)
+        return real, imaginary, -sign if self._conjugated else sign
+
+    def __eq__(self, other):
+        if isinstance(other, LinearOperator):
+            return other == self
+        if self.size != other.size:
+            return False
+
+        real, imaginary, sign = self._float_planes(by_rows=True)
+        other_real, other_imaginary, other_sign = other._float_planes(by_rows=True)
+        if real != other_real:
+            return False
+        if sign == other_sign:
+            return imaginary == other_imaginary
+        return all(x == -y for row, other_row in zip(imaginary, other_imaginary) for x, y in zip(row, other_row))
+
+    __hash__ = ComplexM.__hash__
+
+
+class ArrayComplexM(ComplexM):
+    """
+    Complex matrix stored as a single contiguous numpy array of complex128
+    values, or complex64 if that precision is asked for.
+
+    It exposes the same interface as ComplexM so both can be used
+    interchangeably, but every operation is computed by a vectorized numpy
+    kernel instead of looping over Complex objects. The Complex objects
+    returned by the element access are only built on demand.
+    """
+    def __init__(self, m, n, matrix, precision=DEFAULT_PRECISION):
+        if not NUMPY:
+            raise ImportError("ArrayComplexM requires numpy to be installed")
+        check_precision(precision)
+
+        if isinstance(matrix, numpy.ndarray):
+            if matrix.shape != (m, n):
+                raise ValueError("Expected a bidimensional array of length {0}x{1}. An array of {2} was given instead"
+                                 .format(m, n, 'x'.join(map(lambda x: str(x), matrix.shape))))
+            array = numpy.array(matrix, dtype=precision)
+        else:
+            check_matrix_size(m, n, matrix)
+            values = [[complex(Complex(x)) for x in row] for row in matrix]
+            array = numpy.array(values, dtype=precision).reshape((m, n))
+
+        array.flags.writeable = False
+        self._size = (m, n)
+        self._array = array
+        self._matrix = None
+
+    @classmethod
+    def _from_array(cls, array):
+        '''
+        Wraps an array computed by one of our kernels without copying it
+        '''
+        instance = cls.__new__(cls)
+        array.flags.writeable = False
+        instance._size = array.shape
+        instance._array = array
+        instance._matrix = None
+        return instance
+
+    @classmethod
+    def from_complexm(cls, matrix, precision=None):
+        '''
+        Builds an ArrayComplexM with the same values of the given ComplexM. If
+        no precision is given an ArrayComplexM keeps its own and any other
+        matrix gets the default one.
+        '''
+        if isinstance(matrix, ArrayComplexM):
+            return matrix if precision is None else matrix.astype(precision)
+        m, n = matrix.size
+        return cls(m, n, matrix.matrix, DEFAULT_PRECISION if precision is None else precision)
+
+    @property
+    def precision(self):
+        return self._array.dtype.name
+
+    def astype(self, precision):
+        '''
+        Returns the matrix with its values stored with the given precision
+        '''
+        check_precision(precision)
+        if precision == self.precision:
+            return self
+        return self._from_array(self._array.astype(precision))
+
+    def _cache_type(self):
+        return (type(self), self.precision)
+
+    def to_complexm(self):
+        '''
+        Returns a ComplexM backed by Complex objects with the same values
+        '''
+        m, n = self.size
+        return ComplexM(m, n, self.matrix)
+
+    @property
+    def array(self):
+        return self._array
+
+    @property
+    def matrix(self):
+        if self._matrix is None:
+            self._matrix = tuple(tuple(_interned_complex(x.real, x.imag) for x in row) for row in self._array.tolist())
+        return self._matrix
+
+    def __add__(self, other):
+        if isinstance(other, ComplexM):
+            self._check_same_size(other, "sum")
+            return self._from_array(self._array + as_array(other, self.precision))
+        else:
+            raise TypeError("Cannot sum a ComplexM with and object of class {0}"
+                            .format(other.__class__.__name__))
+
+    def __sub__(self, other):
+        if isinstance(other, ComplexM):
+            self._check_same_size(other, "subtract")
+            return self._from_array(self._array - as_array(other, self.precision))
+        else:
+            raise TypeError("Cannot subtract a ComplexM with and object of class {0}"
+                            .format(other.__class__.__name__))
+
+    def __eq__(self, other):
+        if isinstance(other, LinearOperator):
+            return other == self
+        if self.size != other.size:
+            return False
+
+        return bool(numpy.array_equal(self._array, as_array(other)))
+
+    __hash__ = ComplexM.__hash__
+
+    def _nonzero_entries(self):
+        rows, cols = numpy.nonzero(self._array)
+        values = self._array[rows, cols].tolist()
+        return tuple((i, j, x.real, x.imag) for i, j, x in zip(rows.tolist(), cols.tolist(), values))
+
+    def __scalarmul__(self, other):
+        return self._from_array(self._array * complex(other))
+
+    def __matrixmul__(self, other):
+        sm, sn = self.size
+        om, on = other.size
+
+        if sn != om:
+            raise TypeError("Cannot multiply a ComplexM of size {0}x{1} with a ComplexM of size {2}x{3}"
+                            .format(str(sm), str(sn), str(om), str(on)))
+
+        return self._from_array(numpy.dot(self._array, as_array(other, self.precision)))
+
+    def __neg__(self):
+        return self._from_array(-self._array)
+
+    def _inner_product_parts(self, other):
+        if self.is_vector() and other.is_vector() and self.size == other.size:
+            value = numpy.vdot(self._array, as_array(other, self.precision))
+        elif self.is_squared() and other.is_squared() and self.size[0] == other.size[0]:
+            # Same as (self.transpose() * other).trace() but without
+            # computing the whole product
+            value = numpy.sum(self._array * as_array(other, self.precision))
+        else:
+            self_size = 'x'.join(map(lambda x: str(x), self.size))
+            other_size = 'x'.join(map(lambda x: str(x), other.size))
+            raise ValueError("Cannot do the inner_product of a ComplexM of size {0} with a ComplexM of size {1}"
+                             .format(self_size, other_size))
+
+        return float(value.real), float(value.imag)
+
+    def conjugate(self):
+        return self._from_array(numpy.conjugate(self._array))
+
+    def _compute_transpose(self):
+        return self._from_array(self._array.transpose())
+
+    def _compute_adjoint(self):
+        return self._from_array(numpy.conjugate(self._array).transpose())
+
+    def _compute_trace(self):
+        value = numpy.trace(self._array)
+        return Complex(float(value.real), float(value.imag))
+
+    def tensor(self, other, lazy=False):
+        if lazy or isinstance(other, KroneckerOperator):
+            return KroneckerOperator(self, other)
+        return self._from_array(numpy.kron(self._array, as_array(other, self.precision)))
+
+    def get_tolerances(self, atol=None, rtol=None):
+        # The rounding errors of complex64 values are far bigger than the
+        # default tolerances and grow with the number of terms of the sums
+        default = 10 * self.size[0] * float(numpy.finfo(self._array.dtype).eps)
+        return (max(DEFAULT_ATOL, default) if atol is None else atol,
+                max(DEFAULT_RTOL, default) if rtol is None else rtol)
+
+    def _check_hermitian(self, atol, rtol):
+        return bool(numpy.allclose(self._array, numpy.conjugate(self._array).transpose(), rtol=rtol, atol=atol))
+
+    def _compute_inverse(self):
+        try:
+            return self._from_array(numpy.linalg.inv(self._array))
+        except numpy.linalg.LinAlgError:
+            raise ValueError("Cannot compute the inverse of a singular matrix")
+
+    def _check_unitary(self, atol, rtol):
+        product = numpy.dot(self._array, numpy.conjugate(self._array).transpose())
+        return bool(numpy.allclose(product, numpy.identity(self.size[0]), rtol=rtol, atol=atol))
+
+    def distance(self, other):
+        return (self - other).norm()
+
+    def normalize(self):
+        norm = self.norm()
+        if norm == 0:
+            raise ZeroDivisionError("Can't divide a complex number by 0")
+        return self._from_array(self._array / norm)
+
+    def _compute_identity(self):
+        return self._from_array(numpy.identity(self.size[0], dtype=self._array.dtype))
+
+    def get_col(self, j):
+        return tuple(_make_complex(x.real, x.imag) for x in self._array[:, j].tolist())
+
+    def get_columns(self):
+        return [self._from_array(self._array[:, j:j + 1]) for j in range(self.size[1])]
+
+    def column_norms(self):
+        return numpy.linalg.norm(self._array, axis=0).tolist()
+
+    def column_probabilities(self):
+        squares = self._array.real ** 2 + self._array.imag ** 2
+        totals = squares.sum(axis=0)
+        if not totals.all():
+            raise ZeroDivisionError("Can't compute the probabilities of a column with norm 0")
+        return self._from_array((squares / totals).astype(self._array.dtype))
+
+
+def as_array(matrix, precision=None):
+    '''
+    Returns the numpy array holding the values of any ComplexM. The values of
+    a matrix that is not an ArrayComplexM are converted with the given
+    precision.
+    '''
+    if isinstance(matrix, ArrayComplexM):
+        return matrix.array
+    return ArrayComplexM.from_complexm(matrix, precision).array
+
+
+class SparseComplexM(ComplexM):
+    """
+    Complex matrix that only stores its non zero values.
+
+    The values are kept in compressed sparse row (CSR) format: for the row i
+    the column indices of its non zero values are in
+    indices[indptr[i]:indptr[i + 1]] and their values at the same positions of
+    values. Operations between sparse matrices use kernels that only visit the
+    non zero values unless the operands are too dense to benefit from it, in
+    which case the dense kernels of ComplexM are used.
+    """
+    def __init__(self, m, n, matrix):
+        check_matrix_size(m, n, matrix)
+
+        rows = []
+        for row in matrix:
+            values = {}
+            for j, x in enumerate(row):
+                value = complex(Complex(x))
+                if value != 0:
+                    values[j] = value
+            rows.append(values)
+
+        self._set_rows(m, n, rows)
+
+    @classmethod
+    def from_entries(cls, m, n, entries):
+        '''
+        Builds a SparseComplexM from its entries in coordinate (COO) format.
+        @entries: dict {(i, j): value} or iterable of (i, j, value)
+        '''
+        if isinstance(entries, dict):
+            entries = ((i, j, value) for (i, j), value in entries.items())
+
+        rows = [{} for _ in range(m)]
+        for i, j, value in entries:
+            if not (0 <= i < m and 0 <= j < n):
+                raise IndexError("The entry ({0}, {1}) is out of a matrix of size {2}x{3}".format(i, j, m, n))
+            rows[i][j] = rows[i].get(j, 0) + complex(Complex(value))
+
+        return cls._from_rows(m, n, rows)
+
+    @classmethod
+    def from_complexm(cls, matrix):
+        '''
+        Builds a SparseComplexM with the same values of the given ComplexM
+        '''
+        if isinstance(matrix, SparseComplexM):
+            return matrix
+        m, n = matrix.size
+        return cls(m, n, matrix.matrix)
+
+    @classmethod
+    def _from_rows(cls, m, n, rows):
+        '''
+        Builds a SparseComplexM from a list with a dict {column: value} for
+        every row
+        '''
+        instance = cls.__new__(cls)
+        instance._set_rows(m, n, rows)
+        return instance
+
+    def _set_rows(self, m, n, rows):
+        indptr = [0]
+        indices = []
+        values = []
+        for row in rows:
+            for j in sorted(row):
+                if row[j] != 0:
+                    indices.append(j)
+                    values.append(row[j])
+            indptr.append(len(indices))
+
+        self._size = (m, n)
+        self._indptr = indptr
+        self._indices = indices
+        self._values = values
+        self._matrix = None
+
+    def to_complexm(self):
+        '''
+        Returns a dense ComplexM with the same values
+        '''
+        m, n = self.size
+        return ComplexM(m, n, self.matrix)
+
+    @property
+    def matrix(self):
+        if self._matrix is None:
+            m, n = self.size
+            zero = _to_complex(0)
+            matrix = []
+            for i in range(m):
+                row = [zero] * n
+                for j, value in self._row_items(i):
+                    row[j] = _interned_complex(value.real, value.imag)
+                matrix.append(tuple(row))
+            self._matrix = tuple(matrix)
+        return self._matrix
+
+    @property
+    def nnz(self):
+        '''
+        Number of stored non zero values
+        '''
+        return len(self._values)
+
+    @property
+    def density(self):
+        m, n = self.size
+        return self.nnz / float(m * n) if m * n else 0.0
+
+    def _row_items(self, i):
+        start = self._indptr[i]
+        stop = self._indptr[i + 1]
+        return zip(self._indices[start:stop], self._values[start:stop])
+
+    def _rows(self):
+        return [dict(self._row_items(i)) for i in range(self.size[0])]
+
+    def _is_sparse_enough(self):
+        return self.density <= SPARSE_DENSITY_THRESHOLD
+
+    def __add__(self, other):
+        if isinstance(other, SparseComplexM):
+            self._check_same_size(other, "sum")
+            return self._combine(other, 1)
+        elif isinstance(other, ComplexM):
+            return self.to_complexm() + other
+        else:
+            raise TypeError("Cannot sum a ComplexM with and object of class {0}"
+                            .format(other.__class__.__name__))
+
+    def __sub__(self, other):
+        if isinstance(other, SparseComplexM):
+            self._check_same_size(other, "subtract")
+            return self._combine(other, -1)
+        elif isinstance(other, ComplexM):
+            return self.to_complexm() - other
+        else:
+            raise TypeError("Cannot subtract a ComplexM with and object of class {0}"
+                            .format(other.__class__.__name__))
+
+    def _combine(self, other, sign):
+        rows = self._rows()
+        for i, row in enumerate(rows):
+            for j, value in other._row_items(i):
+                row[j] = row.get(j, 0) + sign * value
+        m, n = self.size
+        return SparseComplexM._from_rows(m, n, rows)
+
+    def __eq__(self, other):
+        if isinstance(other, SparseComplexM):
+            return (self.size == other.size and self._indptr == other._indptr and
+                    self._indices == other._indices and self._values == other._values)
+        return super().__eq__(other)
+
+    __hash__ = ComplexM.__hash__
+
+    def _nonzero_entries(self):
+        return tuple((i, j, value.real, value.imag) for i in range(self.size[0]) for j, value in self._row_items(i))
+
+    def __scalarmul__(self, other):
+        c = complex(other)
+        m, n = self.size
+        return SparseComplexM._from_rows(m, n, [{j: c * v for j, v in self._row_items(i)} for i in range(m)])
+
+    def __neg__(self):
+        return self.__scalarmul__(Complex(-1))
+
+    def __matrixmul__(self, other):
+        sm, sn = self.size
+        om, on = other.size
+
+        if sn != om:
+            raise TypeError("Cannot multiply a ComplexM of size {0}x{1} with a ComplexM of size {2}x{3}"
+                            .format(str(sm), str(sn), str(om), str(on)))
+
+        if not self._is_sparse_enough():
+            return self.to_complexm() * other
+
+        if isinstance(other, SparseComplexM):
+            if not other._is_sparse_enough():
+                return self * other.to_complexm()
+
+            # Row by row product only visiting the non zero values of both
+            # operands
+            rows = []
+            for i in range(sm):
+                acc = {}
+                for k, a in self._row_items(i):
+                    for j, b in other._row_items(k):
+                        acc[j] = acc.get(j, 0) + a * b
+                rows.append(acc)
+            return SparseComplexM._from_rows(sm, on, rows)
+
+        # Sparse times dense: every row of the result is a linear combination
+        # of the rows of other selected by the non zero values of self
+        b_rows = complex_rows(other)
+        new_values = []
+        for i in range(sm):
+            acc = [0j] * on
+            for k, a in self._row_items(i):
+                acc = [x + a * y for x, y in zip(acc, b_rows[k])]
+            new_values.append(tuple(_interned_complex(z.real, z.imag) for z in acc))
+        return ComplexM._from_matrix(sm, on, tuple(new_values))
+
+    def _inner_product_parts(self, other):
+        if self.is_vector() and other.is_vector() and self.size == other.size:
+            conjugate = True
+        elif self.is_squared() and other.is_squared() and self.size[0] == other.size[0]:
+            conjugate = False
+        else:
+            self_size = 'x'.join(map(lambda x: str(x), self.size))
+            other_size = 'x'.join(map(lambda x: str(x), other.size))
+            raise ValueError("Cannot do the inner_product of a ComplexM of size {0} with a ComplexM of size {1}"
+                             .format(self_size, other_size))
+
+        # Only the non zero values of self contribute to the sum
+        res = 0j
+        for i in range(self.size[0]):
+            if isinstance(other, SparseComplexM):
+                other_row = dict(other._row_items(i))
+            else:
+                other_row = other[i]
+            for j, a in self._row_items(i):
+                if isinstance(other, SparseComplexM):
+                    b = other_row.get(j, 0)
+                else:
+                    b = complex(other_row[j])
+                res += (a.conjugate() if conjugate else a) * b
+
+        return res.real, res.imag
+
+    def conjugate(self):
+        m, n = self.size
+        return SparseComplexM._from_rows(m, n, [{j: v.conjugate() for j, v in self._row_items(i)} for i in range(m)])
+
+    def _compute_transpose(self):
+        m, n = self.size
+        rows = [{} for _ in range(n)]
+        for i in range(m):
+            for j, value in self._row_items(i):
+                rows[j][i] = value
+        return SparseComplexM._from_rows(n, m, rows)
+
+    def _compute_adjoint(self):
+        return self.conjugate().transpose()
+
+    def _compute_trace(self):
+        res = 0j
+        for i in range(self.size[0]):
+            for j, value in self._row_items(i):
+                if i == j:
+                    res += value
+        return Complex(res.real, res.imag)
+
+    def tensor(self, other, lazy=False):
+        if lazy or isinstance(other, KroneckerOperator):
+            return KroneckerOperator(self, other)
+
+        other = SparseComplexM.from_complexm(other)
+        (sm, sn) = self.size
+        (m, n) = other.size
+        rows = []
+        for i in range(sm):
+            self_row = list(self._row_items(i))
+            for k in range(m):
+                other_row = list(other._row_items(k))
+                rows.append({j * n + l: a * b for j, a in self_row for l, b in other_row})
+        return SparseComplexM._from_rows(sm * m, sn * n, rows)
+
+    def _check_hermitian(self, atol, rtol):
+        rows = self._rows()
+        for i, row in enumerate(rows):
+            for j, value in row.items():
+                other = rows[j].get(i, 0).conjugate()
+                if not _is_close(value.real, value.imag, other.real, other.imag, atol, rtol) or \
+                        not _is_close(other.real, other.imag, value.real, value.imag, atol, rtol):
+                    return False
+        return True
+
+    def _check_unitary(self, atol, rtol):
+        product = self * self.adjoint()
+        if not isinstance(product, SparseComplexM):
+            return _is_identity(product, atol, rtol)
+
+        n = self.size[0]
+        for i in range(n):
+            row = dict(product._row_items(i))
+            row.setdefault(i, 0)
+            for j, value in row.items():
+                if not _is_close(value.real, value.imag, 1 if i == j else 0, 0, atol, rtol):
+                    return False
+        return True
+
+    def distance(self, other):
+        return (self - other).norm()
+
+    def normalize(self):
+        return self.__scalarmul__(Complex(1 / self.norm()))
+
+    def _compute_identity(self):
+        m = self.size[0]
+        return SparseComplexM._from_rows(m, m, [{i: 1 + 0j} for i in range(m)])
+
+
+class ComplexMBuffer(object):
+    """
+    Mutable complex matrix meant for long loops (time steps, evolutions...)
+
+    The values are stored as two flat lists of floats in row major order that
+    are updated in place by the operations ending with an underscore and the
+    in place operators, so a loop reusing its buffers does not build a new
+    matrix on every iteration. ComplexM remains immutable, to_complexm() takes
+    a snapshot of the buffer.
+    """
+    def __init__(self, m, n, matrix=None):
+        if matrix is None:
+            self._size = (m, n)
+            self._real = [0.0] * (m * n)
+            self._imaginary = [0.0] * (m * n)
+        else:
+            self._set_values(ComplexM(m, n, matrix))
+
+    @classmethod
+    def from_complexm(cls, matrix):
+        '''
+        Returns a new buffer with the values of a ComplexM or another buffer
+        '''
+        buffer = cls.__new__(cls)
+        buffer._set_values(matrix)
+        return buffer
+
+    def _set_values(self, matrix):
+        self._size = matrix.size
+        real, imaginary = _flat_float_planes(matrix)
+        self._real = list(real)
+        self._imaginary = list(imaginary)
+
+    def to_complexm(self):
+        m, n = self.size
+        values = map(_interned_complex, self._real, self._imaginary)
+        return ComplexM._from_matrix(m, n, tuple(tuple(islice(values, n)) for _ in range(m)))
+
+    @property
+    def size(self):
+        return self._size
+
+    def __getitem__(self, i):
+        n = self.size[1]
+        return tuple(map(_interned_complex, self._real[i * n:(i + 1) * n], self._imaginary[i * n:(i + 1) * n]))
+
+    def __eq__(self, other):
+        if not isinstance(other, (ComplexM, ComplexMBuffer)) or self.size != other.size:
+            return False
+        real, imaginary = _flat_float_planes(other)
+        return self._real == list(real) and self._imaginary == list(imaginary)
+
+    # The values of a buffer change so it can't be hashed
+    __hash__ = None
+
+    def __str__(self):
+        return self.to_string()
+
+    def to_string(self):
+        return self.to_complexm().to_string()
+
+    def is_vector(self):
+        return self.size[1] == 1
+
+    def is_squared(self):
+        return self.size[0] == self.size[1]
+
+    def _check_same_size(self, other, operation):
+        if not isinstance(other, (ComplexM, ComplexMBuffer)):
+            raise TypeError("Cannot {0} a ComplexMBuffer with an object of class {1}"
+                            .format(operation, other.__class__.__name__))
+        if self.size != other.size:
+            self_size = 'x'.join(map(lambda x: str(x), self.size))
+            other_size = 'x'.join(map(lambda x: str(x), other.size))
+            raise ValueError("Can't {0} ComplexM of size {1} with a ComplexM of size {2}"
+                             .format(operation, self_size, other_size))
+
+    def assign(self, other):
+        '''
+        Copies the values of a ComplexM or a buffer of the same size
+        '''
+        self._check_same_size(other, "assign")
+        real, imaginary = _flat_float_planes(other)
+        self._real[:] = real
+        self._imaginary[:] = imaginary
+        return self
+
+    def __iadd__(self, other):
+        self._check_same_size(other, "sum")
+        real, imaginary = _flat_float_planes(other)
+        self._real[:] = map(add, self._real, real)
+        self._imaginary[:] = map(add, self._imaginary, imaginary)
+        return self
+
+    def __isub__(self, other):
+        self._check_same_size(other, "subtract")
+        real, imaginary = _flat_float_planes(other)
+        self._real[:] = map(sub, self._real, real)
+        self._imaginary[:] = map(sub, self._imaginary, imaginary)
+        return self
+
+    def __imul__(self, other):
+        if isinstance(other, (ComplexM, ComplexMBuffer)):
+            # self = self·other, other has to be squared to keep the size
+            if not other.is_squared():
+                raise ValueError("Cannot multiply in place a ComplexMBuffer by a non squared matrix")
+            # The product is computed in a scratch buffer kept with the buffer
+            # whose storage is then swapped with ours
+            scratch = self.__dict__.get('_scratch')
+            if scratch is None or scratch.size != self.size:
+                scratch = self.__dict__['_scratch'] = ComplexMBuffer(*self.size)
+            self.matmul_into(other, scratch)
+            self._real, scratch._real = scratch._real, self._real
+            self._imaginary, scratch._imaginary = scratch._imaginary, self._imaginary
+            return self
+        return self.scale_(other)
+
+    def scale_(self, c):
+        '''
+        Multiplies in place every value by the complex number c
+        '''
+        if not isinstance(c, Complex):
+            c = Complex(c)
+        cr = c.real_value
+        ci = c.imaginary_value
+        if ci == 0:
+            self._real[:] = map(mul, self._real, repeat(cr))
+            self._imaginary[:] = map(mul, self._imaginary, repeat(cr))
+        else:
+            real = self._real[:]
+            self._real[:] = map(lambda x, y: x * cr - y * ci, real, self._imaginary)
+            self._imaginary[:] = map(lambda x, y: x * ci + y * cr, real, self._imaginary)
+        return self
+
+    def norm(self):
+        if self.is_vector():
+            return sqrt(sum(map(mul, self._real, self._real)) + sum(map(mul, self._imaginary, self._imaginary)))
+        elif self.is_squared():
+            return sqrt(sum(map(mul, self._real, self._real)) - sum(map(mul, self._imaginary, self._imaginary)))
+        else:
+            raise ValueError("Cannot compute the norm of a ComplexM of size {0}x{1}"
+                             .format(str(self.size[0]), str(self.size[1])))
+
+    def normalize_(self):
+        '''
+        Divides in place every value by the norm of the matrix
+        '''
+        norm = self.norm()
+        if norm == 0:
+            raise ZeroDivisionError("Can't divide a complex number by 0")
+        # Same operations as ComplexM.normalize()
+        dividend = norm ** 2.0
+        self._real[:] = map(lambda x: x * norm / dividend, self._real)
+        self._imaginary[:] = map(lambda x: x * norm / dividend, self._imaginary)
+        return self
+
+    def matmul_into(self, other, out):
+        '''
+        Computes self·other storing the result in the buffer out, which can't
+        be self nor other
+        @other: ComplexM or ComplexMBuffer
+        @out: ComplexMBuffer
+        '''
+        sm, sn = self.size
+        om, on = other.size
+        if sn != om:
+            raise TypeError("Cannot multiply a ComplexM of size {0}x{1} with a ComplexM of size {2}x{3}"
+                            .format(str(sm), str(sn), str(om), str(on)))
+        if not isinstance(out, ComplexMBuffer) or out.size != (sm, on):
+            raise ValueError("The result of the product should be stored in a ComplexMBuffer of size {0}x{1}"
+                             .format(str(sm), str(on)))
+        if out is self or out is other:
+            raise ValueError("The result of the product can't be stored in one of its operands")
+
+        b_real, b_imaginary = _flat_float_planes(other)
+        if not isinstance(other, ComplexMBuffer):
+            b_real = list(b_real)
+            b_imaginary = list(b_imaginary)
+        b_real = [b_real[j::on] for j in range(on)]
+        b_imaginary = [b_imaginary[j::on] for j in range(on)]
+
+        a_real = self._real
+        a_imaginary = self._imaginary
+        out_real = out._real
+        out_imaginary = out._imaginary
+        for i in range(sm):
+            ar = a_real[i * sn:(i + 1) * sn]
+            ai = a_imaginary[i * sn:(i + 1) * sn]
+            for j in range(on):
+                br = b_real[j]
+                bi = b_imaginary[j]
+                out_real[i * on + j] = sum(map(mul, ar, br)) - sum(map(mul, ai, bi))
+                out_imaginary[i * on + j] = sum(map(mul, ar, bi)) + sum(map(mul, ai, br))
+
+        return out
+
+
+def _flat_float_planes(matrix):
+    '''
+    Returns the real and imaginary parts of the values of a ComplexM or a
+    ComplexMBuffer in row major order
+    '''
+    if isinstance(matrix, ComplexMBuffer):
+        return matrix._real, matrix._imaginary
+    return _scaled_planes(matrix, _ONE)
+
+
+class LinearOperator(metaclass=ABCMeta):
+    """
+    Base class of the operators that behave like a ComplexM but are not
+    backed by a dense matrix. They can be multiplied by a ComplexM from both
+    sides and can always be turned into a ComplexM with to_complexm().
+    """
+
+    @property
+    @abstractmethod
+    def size(self):
+        return
+
+    @abstractmethod
+    def __mul__(self, other):
+        return
+
+    @abstractmethod
+    def __rmul__(self, other):
+        return
+
+    @abstractmethod
+    def to_complexm(self):
+        '''
+        Materializes the operator as a ComplexM
+        '''
+        return
+
+    def __getitem__(self, i):
+        return self.to_complexm()[i]
+
+    def __eq__(self, other):
+        if not isinstance(other, (ComplexM, LinearOperator)) or self.size != other.size:
+            return False
+        return self.to_complexm() == materialize(other)
+
+    __hash__ = None
+
+    def __str__(self):
+        return self.to_string()
+
+    def to_string(self):
+        return self.to_complexm().to_string()
+
+    def lazy(self):
+        return ProductChain(self)
+
+    def transpose(self):
+        return self.to_complexm().transpose()
+
+    def conjugate(self):
+        return self.to_complexm().conjugate()
+
+    def adjoint(self):
+        return self.to_complexm().adjoint()
+
+    def inverse(self):
+        return self.to_complexm().inverse()
+
+    def is_vector(self):
+        return self.size[1] == 1
+
+    def is_squared(self):
+        return self.size[0] == self.size[1]
+
+
+class KroneckerOperator(LinearOperator):
+    """
+    Lazy tensor product of a sequence of matrices (A ⊗ B ⊗ ...)
+
+    The tensor product is never built. When multiplied by a matrix each factor
+    is applied on its own axis of the operand, using that
+    (A ⊗ B) v = vec(B V Aᵀ), so applying the tensor product of k gates of size
+    2×2 costs O(k·2^k) instead of O(4^k). The factors can be LinearOperators,
+    identities are skipped and other operators are only materialized with the
+    size of the factor.
+    """
+    def __init__(self, *factors):
+        if len(factors) == 0:
+            raise ValueError("A KroneckerOperator needs at least one factor")
+
+        flat_factors = []
+        for factor in factors:
+            if isinstance(factor, KroneckerOperator):
+                flat_factors.extend(factor.factors)
+            elif isinstance(factor, (ComplexM, LinearOperator)):
+                flat_factors.append(factor)
+            else:
+                raise TypeError("Cannot make a tensor product of an object of class {0}"
+                                .format(factor.__class__.__name__))
+
+        self._factors = tuple(flat_factors)
+        m = 1
+        n = 1
+        for factor in self._factors:
+            m *= factor.size[0]
+            n *= factor.size[1]
+        self._size = (m, n)
+        self._materialized = None
+
+    @property
+    def factors(self):
+        return self._factors
+
+    @property
+    def size(self):
+        return self._size
+
+    def tensor(self, other, lazy=True):
+        return KroneckerOperator(self, other)
+
+    def to_complexm(self):
+        if self._materialized is None:
+            result = materialize(self._factors[0])
+            for factor in self._factors[1:]:
+                result = result.tensor(materialize(factor))
+            self._materialized = result
+        return self._materialized
+
+    def __mul__(self, other):
+        if isinstance(other, Complex):
+            return KroneckerOperator(self._factors[0] * other, *self._factors[1:])
+        elif isinstance(other, KroneckerOperator) and self._is_factor_compatible(other):
+            # Mixed product property: (A ⊗ B)(C ⊗ D) = AC ⊗ BD
+            return KroneckerOperator(*[a * b for a, b in zip(self._factors, other.factors)])
+        elif isinstance(other, (ComplexM, LinearOperator)):
+            return self._apply(materialize(other))
+        else:
+            raise TypeError("Cannot multiply a KroneckerOperator with an object of class {0}"
+                            .format(other.__class__.__name__))
+
+    def __rmul__(self, other):
+        if isinstance(other, Complex):
+            return self * other
+        elif isinstance(other, ComplexM):
+            # X (A ⊗ B) = ((Aᵀ ⊗ Bᵀ) Xᵀ)ᵀ
+            return (self.transpose() * other.transpose()).transpose()
+        else:
+            raise TypeError("Cannot multiply an object of class {0} with a KroneckerOperator"
+                            .format(other.__class__.__name__))
+
+    def _is_factor_compatible(self, other):
+        if len(self._factors) != len(other.factors):
+            return False
+        return all(a.size[1] == b.size[0] for a, b in zip(self._factors, other.factors))
+
+    def transpose(self):
+        return KroneckerOperator(*[factor.transpose() for factor in self._factors])
+
+    def conjugate(self):
+        return KroneckerOperator(*[factor.conjugate() for factor in self._factors])
+
+    def adjoint(self):
+        return KroneckerOperator(*[factor.adjoint() for factor in self._factors])
+
+    def inverse(self):
+        # (A ⊗ B)⁻¹ = A⁻¹ ⊗ B⁻¹
+        return KroneckerOperator(*[factor.inverse() for factor in self._factors])
+
+    def _apply(self, other):
+        m, n = self.size
+        om, on = other.size
+
+        if n != om:
+            raise TypeError("Cannot multiply a KroneckerOperator of size {0}x{1} with a ComplexM of size {2}x{3}"
+                            .format(str(m), str(n), str(om), str(on)))
+
+        if isinstance(other, ArrayComplexM):
+            return self._apply_array(other)
+
+        # The operand is handled as a tensor of shape (n_1, ..., n_k, on)
+        # stored in row major order and each factor is applied on its axis
+        values = [complex(x) for row in other for x in row]
+        dims = [factor.size[1] for factor in self._factors]
+        for axis, factor in enumerate(self._factors):
+            if isinstance(factor, IdentityOp):
+                continue
+            factor = materialize(factor)
+            outer = 1
+            for d in dims[:axis]:
+                outer *= d
+            inner = on
+            for d in dims[axis + 1:]:
+                inner *= d
+            scale = hadamard_scale(factor)
+            if scale is not None:
+                hadamard_on_axis(values, inner, scale)
+            else:
+                values = apply_on_axis(values, complex_rows(factor), outer, inner)
+            dims[axis] = factor.size[0]
+
+        new_values = tuple(tuple(_interned_complex(z.real, z.imag) for z in values[i * on:(i + 1) * on]) for i in range(m))
+        return ComplexM._from_matrix(m, on, new_values)
+
+    def _apply_array(self, other):
+        m = self.size[0]
+        on = other.size[1]
+
+        values = other.array.reshape(tuple(f.size[1] for f in self._factors) + (on,))
+        for axis, factor in enumerate(self._factors):
+            if isinstance(factor, IdentityOp):
+                continue
+            # The factors are cast to the precision of the operand
+            factor = as_array(materialize(factor)).astype(values.dtype, copy=False)
+            values = numpy.tensordot(factor, values, axes=([1], [axis]))
+            values = numpy.moveaxis(values, 0, axis)
+
+        return ArrayComplexM._from_array(numpy.ascontiguousarray(values).reshape((m, on)))
+
+
+def complex_rows(matrix):
+    '''
+    Returns the values of a ComplexM as lists of builtin complex numbers
+    '''
+    return [[complex(x) for x in row] for row in matrix]
+
+
+def apply_on_axis(values, rows, outer, inner):
+    '''
+    Multiplies the matrix given by rows (of size m×d) by the axis of size d of
+    a tensor of shape (outer, d, inner) stored as a flat list, returning the
+    flat list of the resulting tensor of shape (outer, m, inner).
+    '''
+    d = len(rows[0])
+    result = []
+    for o in range(outer):
+        chunks = [values[(o * d + c) * inner:(o * d + c + 1) * inner] for c in range(d)]
+        for row in rows:
+            acc = [0j] * inner
+            for a, chunk in zip(row, chunks):
+                if a != 0:
+                    acc = [x + a * y for x, y in zip(acc, chunk)]
+            result.extend(acc)
+
+    return result
+
+
+def hadamard_scale(matrix):
+    '''
+    Returns s if the matrix is the Hadamard gate [[s, s], [s, -s]] with
+    s = 1/√2, None otherwise
+    '''
+    if matrix.size != (2, 2):
+        return None
+    (a, b), (c, d) = matrix
+    s = a.real_value
+    if a.imaginary_value != 0 or not a == b == c == -d or abs(s * s - 0.5) > DEFAULT_ATOL:
+        return None
+    return s
+
+
+def hadamard_on_axis(values, stride, scale, scratch=None):
+    '''
+    Applies in place the Hadamard butterfly (a, b) → (s·(a + b), s·(a - b))
+    to the pairs of values of a flat list or a contiguous one dimensional
+    numpy array that are stride positions apart. The differences of an array
+    are written to scratch, an array of half its size, when it is given.
+    '''
+    if NUMPY and isinstance(values, numpy.ndarray):
+        # Views of the first and the second value of every pair
+        pairs = values.reshape((-1, 2, stride))
+        x = pairs[:, 0, :]
+        y = pairs[:, 1, :]
+        difference = numpy.subtract(x, y, out=None if scratch is None else scratch.reshape(x.shape))
+        x += y
+        x *= scale
+        numpy.multiply(difference, scale, out=y)
+        return
+
+    size = len(values)
+    step = 2 * stride
+    if stride <= size // step:
+        # Few long pairs of slices, one for each offset within a block
+        for offset in range(stride):
+            x = values[offset::step]
+            y = values[offset + stride::step]
+            values[offset::step] = [(a + b) * scale for a, b in zip(x, y)]
+            values[offset + stride::step] = [(a - b) * scale for a, b in zip(x, y)]
+    else:
+        for start in range(0, size, step):
+            middle = start + stride
+            x = values[start:middle]
+            y = values[middle:middle + stride]
+            values[start:middle] = [(a + b) * scale for a, b in zip(x, y)]
+            values[middle:middle + stride] = [(a - b) * scale for a, b in zip(x, y)]
+
+
+def fwht(values, normalize=True, qubits=None):
+    '''
+    In place fast Walsh–Hadamard transform of a list or a contiguous numpy
+    array of 2^n numbers, that is H^⊗n·v in O(n·2^n). When qubits is given
+    the Hadamard gate is only applied to those qubits (qubit 0 is the most
+    significant bit of the index) in O(len(qubits)·2^n). If normalize is
+    False the butterflies are not scaled by 1/√2. Returns the values.
+    '''
+    size = len(values)
+    if size == 0 or size & (size - 1):
+        raise ValueError("The length of the values should be a power of 2")
+    nqubits = size.bit_length() - 1
+    qubits = range(nqubits) if qubits is None else sorted(set(qubits))
+    for q in qubits:
+        if not 0 <= q < nqubits:
+            raise IndexError("The qubit {0} is out of range".format(str(q)))
+
+    scale = 1 / sqrt(2) if normalize else 1
+    # The same scratch array holds the differences of every qubit
+    scratch = numpy.empty(size // 2, values.dtype) if NUMPY and isinstance(values, numpy.ndarray) else None
+    for q in qubits:
+        hadamard_on_axis(values, 1 << (nqubits - 1 - q), scale, scratch)
+
+    return values
+
+
+def hadamard_transform(matrix, qubits=None):
+    '''
+    Applies the Hadamard gate on the given qubits (all of them if None) to
+    every column of a matrix of size 2^n×k. Qubit 0 is the most significant
+    bit of the row index. It costs O(len(qubits)·2^n·k) instead of the
+    product by a 2^n×2^n matrix.
+    @matrix: ComplexM
+    @qubits: iterable of qubit indexes
+    '''
+    if not isinstance(matrix, ComplexM):
+        raise TypeError("Cannot apply the Hadamard transform to an object of class {0}"
+                        .format(matrix.__class__.__name__))
+    m, n = matrix.size
+    nqubits = m.bit_length() - 1
+    if m != 1 << nqubits:
+        raise ValueError("The number of rows of the matrix should be a power of 2")
+    qubits = range(nqubits) if qubits is None else sorted(set(qubits))
+    for q in qubits:
+        if not 0 <= q < nqubits:
+            raise IndexError("The qubit {0} is out of range".format(str(q)))
+
+    scale = 1 / sqrt(2)
+    if isinstance(matrix, ArrayComplexM):
+        # The matrix is immutable, the butterflies are applied to a copy
+        values = matrix.array.flatten()
+        scratch = numpy.empty(m * n // 2, values.dtype)
+        for q in qubits:
+            hadamard_on_axis(values, n << (nqubits - 1 - q), scale, scratch)
+        return ArrayComplexM._from_array(values.reshape((m, n)))
+
+    values = [complex(x) for row in matrix for x in row]
+    for q in qubits:
+        hadamard_on_axis(values, n << (nqubits - 1 - q), scale)
+
+    new_values = tuple(tuple(_interned_complex(z.real, z.imag) for z in values[i * n:(i + 1) * n]) for i in range(m))
+    return ComplexM._from_matrix(m, n, new_values)
+
+
+def materialize(matrix):
+    '''
+    Returns the ComplexM represented by a ComplexM or a LinearOperator
+    '''
+    if isinstance(matrix, LinearOperator):
+        return matrix.to_complexm()
+    return matrix
+
+
+class ProductChain(LinearOperator):
+    """
+    Lazy product of a chain of matrices A₁ A₂ ... Aₖ
+
+    Multiplying a ProductChain only records the operand. The product is
+    computed when evaluate() is called or an element is accessed, choosing the
+    order of the multiplications that minimizes the number of scalar
+    operations (matrix-chain dynamic programming), so a * a * v is computed as
+    a * (a * v) with two matrix-vector products instead of a matrix-matrix one.
+    """
+    def __init__(self, *operands):
+        if len(operands) == 0:
+            raise ValueError("A ProductChain needs at least one operand")
+
+        self._operands = []
+        self._scalar = None
+        self._materialized = None
+        for operand in operands:
+            self._append(operand)
+
+        if len(self._operands) == 0:
+            raise ValueError("A ProductChain needs at least one matrix operand")
+
+    def _append(self, operand):
+        if isinstance(operand, ProductChain):
+            for chained in operand.operands:
+                self._append(chained)
+            if operand.scalar is not None:
+                self._append(operand.scalar)
+        elif isinstance(operand, Complex):
+            self._scalar = operand if self._scalar is None else self._scalar * operand
+        elif isinstance(operand, (ComplexM, LinearOperator)):
+            if len(self._operands) > 0:
+                m, n = self._operands[-1].size
+                om, on = operand.size
+                if n != om:
+                    raise TypeError("Cannot multiply a ComplexM of size {0}x{1} with a ComplexM of size {2}x{3}"
+                                    .format(str(m), str(n), str(om), str(on)))
+            self._operands.append(operand)
+        else:
+            raise TypeError("Cannot multiply a ProductChain with an object of class {0}"
+                            .format(operand.__class__.__name__))
+
+    @property
+    def operands(self):
+        return tuple(self._operands)
+
+    @property
+    def scalar(self):
+        return self._scalar
+
+    @property
+    def size(self):
+        return (self._operands[0].size[0], self._operands[-1].size[1])
+
+    def lazy(self):
+        return self
+
+    def __mul__(self, other):
+        return ProductChain(self, other)
+
+    def __rmul__(self, other):
+        return ProductChain(other, self)
+
+    def __add__(self, other):
+        return LinearCombination(self) + other
+
+    def __sub__(self, other):
+        return LinearCombination(self) - other
+
+    def __neg__(self):
+        return -LinearCombination(self)
+
+    def transpose(self):
+        # (c·A₁ ... Aₖ)ᵀ = c·Aₖᵀ ... A₁ᵀ
+        return ProductChain(*[operand.transpose() for operand in reversed(self._operands)] +
+                            ([self._scalar] if self._scalar is not None else []))
+
+    def conjugate(self):
+        return ProductChain(*[operand.conjugate() for operand in self._operands] +
+                            ([self._scalar.conjugate()] if self._scalar is not None else []))
+
+    def adjoint(self):
+        return self.transpose().conjugate()
+
+    def inverse(self):
+        # (c·A₁ ... Aₖ)⁻¹ = Aₖ⁻¹ ... A₁⁻¹ / c
+        if not all(operand.is_squared() for operand in self._operands):
+            return self.to_complexm().inverse()
+        inverse = ProductChain(*[operand.inverse() for operand in reversed(self._operands)])
+        if self._scalar is not None:
+            inverse = inverse * (_ONE / self._scalar)
+        return inverse
+
+    def to_complexm(self):
+        return materialize(self.evaluate())
+
+    def evaluate(self):
+        '''
+        Computes the product of the chain with the optimal parenthesization
+        '''
+        if self._materialized is None:
+            split = self._get_parenthesization()
+            result = self._evaluate_range(split, 0, len(self._operands) - 1)
+            if self._scalar is not None:
+                result = result * self._scalar
+            self._materialized = result
+        return self._materialized
+
+    def _evaluate_range(self, split, i, j):
+        if i == j:
+            operand = self._operands[i]
+            return operand.evaluate() if isinstance(operand, LinearCombination) else operand
+        k = split[i][j]
+        return self._evaluate_range(split, i, k) * self._evaluate_range(split, k + 1, j)
+
+    def _get_parenthesization(self):
+        '''
+        Returns the table of the matrix-chain dynamic programming where
+        split[i][j] is the operand after which the product of the operands
+        i..j has to be split
+        '''
+        operands = self._operands
+        count = len(operands)
+        dims = [operands[0].size[0]] + [operand.size[1] for operand in operands]
+
+        cost = [[0] * count for _ in range(count)]
+        split = [[0] * count for _ in range(count)]
+        for length in range(1, count):
+            for i in range(count - length):
+                j = i + length
+                best = None
+                for k in range(i, j):
+                    # A sparse operand only costs its non zero entries
+                    if i == k and isinstance(operands[i], SparseComplexM):
+                        product = operands[i].nnz * dims[j + 1]
+                    else:
+                        product = dims[i] * dims[k + 1] * dims[j + 1]
+                    candidate = cost[i][k] + cost[k + 1][j] + product
+                    if best is None or candidate < best:
+                        best = candidate
+                        split[i][j] = k
+                cost[i][j] = best
+
+        return split
+
+
+class LinearCombination(LinearOperator):
+    """
+    Lazy linear combination c₁·A₁ + c₂·A₂ + ... of matrices of the same size
+
+    It is built adding and subtracting lazy expressions, for instance
+    a.lazy() * alpha + b.lazy() * beta, and it is computed in a single pass
+    over the operands with a single output matrix. Its norm is reduced without
+    building the combination at all.
+    """
+    def __init__(self, *operands):
+        self._terms = []
+        self._materialized = None
+        for operand in operands:
+            self._append(operand, _ONE)
+
+        if len(self._terms) == 0:
+            raise ValueError("A LinearCombination needs at least one operand")
+
+    def _append(self, operand, coefficient):
+        if isinstance(operand, LinearCombination):
+            for matrix, c in operand.terms:
+                self._append_term(matrix, coefficient * c)
+        elif isinstance(operand, ProductChain) and len(operand.operands) == 1:
+            # A scaled matrix is a term of the combination
+            scalar = operand.scalar
+            self._append_term(operand.operands[0], coefficient if scalar is None else coefficient * scalar)
+        elif isinstance(operand, (ComplexM, LinearOperator)):
+            self._append_term(operand, coefficient)
+        else:
+            raise TypeError("Cannot sum a ComplexM with and object of class {0}"
+                            .format(operand.__class__.__name__))
+
+    def _append_term(self, matrix, coefficient):
+        if len(self._terms) > 0 and self._terms[0][0].size != matrix.size:
+            self_size = 'x'.join(map(lambda x: str(x), self.size))
+            other_size = 'x'.join(map(lambda x: str(x), matrix.size))
+            raise ValueError("Can't sum ComplexM of size {0} with a ComplexM of size {1}"
+                             .format(self_size, other_size))
+        self._terms.append((matrix, coefficient))
+
+    @property
+    def terms(self):
+        return tuple(self._terms)
+
+    @property
+    def size(self):
+        return self._terms[0][0].size
+
+    def lazy(self):
+        return self
+
+    def __add__(self, other):
+        result = LinearCombination(self)
+        result._append(other, _ONE)
+        return result
+
+    def __sub__(self, other):
+        result = LinearCombination(self)
+        result._append(other, _MINUS_ONE)
+        return result
+
+    def __neg__(self):
+        return self * _MINUS_ONE
+
+    def __mul__(self, other):
+        if isinstance(other, Complex):
+            result = LinearCombination(self)
+            result._terms = [(matrix, c * other) for matrix, c in result._terms]
+            return result
+        return ProductChain(self, other)
+
+    def __rmul__(self, other):
+        if isinstance(other, Complex):
+            return self * other
+        return ProductChain(other, self)
+
+    def to_complexm(self):
+        return self.evaluate()
+
+    def evaluate(self):
+        '''
+        Computes the combination in a single pass over its operands
+        '''
+        if self._materialized is None:
+            terms = [(materialize(matrix), c) for matrix, c in self._terms]
+            if all(isinstance(matrix, ArrayComplexM) for matrix, c in terms):
+                result = as_array(terms[0][0]) * complex(terms[0][1])
+                for matrix, c in terms[1:]:
+                    result += as_array(matrix) * complex(c)
+                self._materialized = ArrayComplexM._from_array(result)
+            else:
+                self._materialized = _linear_combination(terms)
+        return self._materialized
+
+    def norm(self):
+        if self._materialized is not None:
+            return self._materialized.norm()
+        if not self.is_vector() and not self.is_squared():
+            raise ValueError("Cannot compute the norm of a ComplexM of size {0}x{1}"
+                             .format(str(self.size[0]), str(self.size[1])))
+        return _linear_combination_norm([(materialize(matrix), c) for matrix, c in self._terms])
+
+
+class IdentityOp(LinearOperator):
+    """
+    Identity operator of size n×n
+
+    Multiplying by it returns the other operand and it is only densified when
+    the ComplexM is asked for.
+    """
+    def __init__(self, n):
+        if n <= 0:
+            raise ValueError("The size of an identity should be positive")
+        self._n = n
+
+    @property
+    def size(self):
+        return (self._n, self._n)
+
+    def to_complexm(self):
+        n = self._n
+        return DERIVED_RESULTS_CACHE.get(('identity', ComplexM, n), lambda: _dense_identity(n), n * n)
+
+    def _nonzero_entries(self):
+        return tuple((i, i, 1.0, 0.0) for i in range(self._n))
+
+    def __eq__(self, other):
+        if isinstance(other, IdentityOp):
+            return self._n == other.size[0]
+        return super().__eq__(other)
+
+    def __hash__(self):
+        return _structured_hash(self)
+
+    def __mul__(self, other):
+        if isinstance(other, Complex):
+            return DiagonalOp([other] * self._n)
+        _check_product_size(self, other)
+        return other
+
+    def __rmul__(self, other):
+        if isinstance(other, Complex):
+            return self * other
+        _check_product_size(other, self)
+        return other
+
+    def tensor(self, other, lazy=False):
+        '''
+        The tensor product of identities is an identity and the one with a
+        PermutationOp a PermutationOp
+        '''
+        if isinstance(other, IdentityOp):
+            return IdentityOp(self._n * other.size[0])
+        elif isinstance(other, PermutationOp):
+            return PermutationOp(range(self._n)).tensor(other)
+        return self.to_complexm().tensor(materialize(other), lazy)
+
+    def transpose(self):
+        return self
+
+    def conjugate(self):
+        return self
+
+    def adjoint(self):
+        return self
+
+    def inverse(self):
+        return self
+
+
+class DiagonalOp(LinearOperator):
+    """
+    Diagonal matrix stored as the list of its n diagonal values
+
+    Products with a matrix of size n×k scale its rows (or its columns when
+    multiplied from the right) in O(n·k).
+    """
+    def __init__(self, values):
+        self._values = tuple(map(_to_complex, values))
+        if len(self._values) == 0:
+            raise ValueError("A DiagonalOp needs at least one value")
+
+    @property
+    def values(self):
+        return self._values
+
+    @property
+    def size(self):
+        n = len(self._values)
+        return (n, n)
+
+    def to_complexm(self):
+        n = len(self._values)
+        zero = _to_complex(0)
+        rows = tuple(tuple(value if i == j else zero for j in range(n)) for i, value in enumerate(self._values))
+        return ComplexM._from_matrix(n, n, rows)
+
+    def _nonzero_entries(self):
+        return tuple((i, i, value._real, value._imaginary) for i, value in enumerate(self._values)
+                     if value._real or value._imaginary)
+
+    def __eq__(self, other):
+        if isinstance(other, DiagonalOp):
+            return self._values == other.values
+        return super().__eq__(other)
+
+    def __hash__(self):
+        return _structured_hash(self)
+
+    def __mul__(self, other):
+        if isinstance(other, Complex):
+            return DiagonalOp([value * other for value in self._values])
+        _check_product_size(self, other)
+        if isinstance(other, IdentityOp):
+            return self
+        elif isinstance(other, DiagonalOp):
+            return DiagonalOp([a * b for a, b in zip(self._values, other.values)])
+        elif isinstance(other, PermutationOp):
+            # D·P maps |j⟩ to dσ(j)·phaseⱼ·|σ(j)⟩
+            return PermutationOp(other.permutation,
+                                 [self._values[i] * phase for i, phase in zip(other.permutation, other.phases)])
+        elif isinstance(other, ArrayComplexM):
+            return ArrayComplexM._from_array(_diagonal_array(self._values, other.array.dtype)[:, None] * other.array)
+
+        other = materialize(other)
+        m, n = other.size
+        rows = tuple(_scale_values(value, row) for value, row in zip(self._values, other))
+        return ComplexM._from_matrix(m, n, rows)
+
+    def __rmul__(self, other):
+        if isinstance(other, Complex):
+            return self * other
+        _check_product_size(other, self)
+        if isinstance(other, ArrayComplexM):
+            return ArrayComplexM._from_array(other.array * _diagonal_array(self._values, other.array.dtype)[None, :])
+
+        m, n = other.size
+        rows = tuple(tuple(map(mul, row, self._values)) for row in materialize(other))
+        return ComplexM._from_matrix(m, n, rows)
+
+    def transpose(self):
+        return self
+
+    def conjugate(self):
+        return DiagonalOp([value.conjugate() for value in self._values])
+
+    def adjoint(self):
+        return self.conjugate()
+
+    def inverse(self):
+        return DiagonalOp([1 / value for value in self._values])
+
+
+class PermutationOp(LinearOperator):
+    """
+    Permutation matrix, optionally with a phase on every column
+
+    It maps the basis vector |j⟩ to phaseⱼ·|σ(j)⟩ where σ is given by the list
+    permutation (CNOT is PermutationOp([0, 1, 3, 2])). Products with a matrix
+    of size n×k move (and scale) its rows or columns in O(n·k) and
+    permutations, diagonals and identities compose into a PermutationOp.
+    """
+    def __init__(self, permutation, phases=None):
+        permutation = tuple(permutation)
+        n = len(permutation)
+        if n == 0 or sorted(permutation) != list(range(n)):
+            raise ValueError("{0} is not a permutation of 0..n-1".format(str(permutation)))
+        if phases is None:
+            phases = [1] * n
+        phases = tuple(map(_to_complex, phases))
+        if len(phases) != n:
+            raise ValueError("A PermutationOp needs a phase for every column")
+
+        self._permutation = permutation
+        self._phases = phases
+
+    @property
+    def permutation(self):
+        return self._permutation
+
+    @property
+    def phases(self):
+        return self._phases
+
+    @property
+    def size(self):
+        n = len(self._permutation)
+        return (n, n)
+
+    def to_complexm(self):
+        n = len(self._permutation)
+        zero = _to_complex(0)
+        rows = [[zero] * n for _ in range(n)]
+        for j, (i, phase) in enumerate(zip(self._permutation, self._phases)):
+            rows[i][j] = phase
+        return ComplexM._from_matrix(n, n, tuple(map(tuple, rows)))
+
+    def _nonzero_entries(self):
+        inverse = self._inverse_permutation()
+        return tuple((i, j, self._phases[j]._real, self._phases[j]._imaginary)
+                     for i, j in enumerate(inverse) if self._phases[j]._real or self._phases[j]._imaginary)
+
+    def __eq__(self, other):
+        if isinstance(other, PermutationOp):
+            return self.size == other.size and self._nonzero_entries() == other._nonzero_entries()
+        return super().__eq__(other)
+
+    def __hash__(self):
+        return _structured_hash(self)
+
+    def __mul__(self, other):
+        if isinstance(other, Complex):
+            return PermutationOp(self._permutation, [phase * other for phase in self._phases])
+        _check_product_size(self, other)
+        if isinstance(other, IdentityOp):
+            return self
+        elif isinstance(other, DiagonalOp):
+            return PermutationOp(self._permutation, [phase * d for phase, d in zip(self._phases, other.values)])
+        elif isinstance(other, PermutationOp):
+            # P₁·P₂ maps |j⟩ to phase₂ⱼ·phase₁σ₂(j)·|σ₁(σ₂(j))⟩
+            return PermutationOp([self._permutation[i] for i in other.permutation],
+                                 [self._phases[i] * phase for i, phase in zip(other.permutation, other.phases)])
+        elif isinstance(other, ArrayComplexM):
+            result = numpy.empty_like(other.array)
+            result[list(self._permutation)] = _diagonal_array(self._phases, other.array.dtype)[:, None] * other.array
+            return ArrayComplexM._from_array(result)
+
+        other = materialize(other)
+        m, n = other.size
+        rows = [None] * m
+        for i, phase, row in zip(self._permutation, self._phases, other):
+            rows[i] = _scale_values(phase, row)
+        return ComplexM._from_matrix(m, n, tuple(rows))
+
+    def __rmul__(self, other):
+        if isinstance(other, Complex):
+            return self * other
+        _check_product_size(other, self)
+        if isinstance(other, ArrayComplexM):
+            return ArrayComplexM._from_array(other.array[:, list(self._permutation)] * _diagonal_array(self._phases, other.array.dtype)[None, :])
+
+        m, n = other.size
+        # (A·P)ᵢⱼ = aᵢσ(j)·phaseⱼ
+        rows = tuple(tuple(map(mul, [row[i] for i in self._permutation], self._phases)) for row in materialize(other))
+        return ComplexM._from_matrix(m, n, rows)
+
+    def tensor(self, other, lazy=False):
+        '''
+        The tensor product of permutations is the permutation that maps
+        |i⟩⊗|j⟩ to phaseᵢ·phase'ⱼ·|σ(i)⟩⊗|σ'(j)⟩
+        '''
+        if isinstance(other, IdentityOp):
+            other = PermutationOp(range(other.size[0]))
+        if isinstance(other, PermutationOp):
+            n = len(other.permutation)
+            return PermutationOp([i * n + j for i in self._permutation for j in other.permutation],
+                                 [a * b for a in self._phases for b in other.phases])
+        return self.to_complexm().tensor(materialize(other), lazy)
+
+    def _inverse_permutation(self):
+        inverse = [0] * len(self._permutation)
+        for j, i in enumerate(self._permutation):
+            inverse[i] = j
+        return inverse
+
+    def transpose(self):
+        # Pᵀ maps |σ(j)⟩ to phaseⱼ·|j⟩
+        inverse = self._inverse_permutation()
+        return PermutationOp(inverse, [self._phases[j] for j in inverse])
+
+    def conjugate(self):
+        return PermutationOp(self._permutation, [phase.conjugate() for phase in self._phases])
+
+    def adjoint(self):
+        return self.transpose().conjugate()
+
+    def inverse(self):
+        inverse = self._inverse_permutation()
+        return PermutationOp(inverse, [1 / self._phases[j] for j in inverse])
+
+
+def _structured_hash(operator):
+    '''
+    Returns the hash of an operator stored by its structure (an IdentityOp, a
+    DiagonalOp or a PermutationOp), which is the hash of the equal ComplexM
+    '''
+    h = operator.__dict__.get('_hash')
+    if h is None:
+        h = operator.__dict__['_hash'] = hash((operator.size, operator._nonzero_entries()))
+    return h
+
+
+def _check_product_size(a, b):
+    '''
+    Raises a TypeError if a and b can't be multiplied
+    '''
+    if not isinstance(a, (ComplexM, LinearOperator)) or not isinstance(b, (ComplexM, LinearOperator)):
+        other = b if isinstance(a, (ComplexM, LinearOperator)) else a
+        raise TypeError("Cannot multiply a matrix with an object of class {0}"
+                        .format(other.__class__.__name__))
+
+    sm, sn = a.size
+    om, on = b.size
+    if sn != om:
+        raise TypeError("Cannot multiply a ComplexM of size {0}x{1} with a ComplexM of size {2}x{3}"
+                        .format(str(sm), str(sn), str(om), str(on)))
+
+
+def _scale_values(c, values):
+    '''
+    Returns the tuple of values multiplied by the Complex c, the same tuple if
+    c is 1
+    '''
+    if c._real == 1 and c._imaginary == 0:
+        return tuple(values)
+    return tuple(map(c.__mul__, values))
+
+
+def _dense_identity(n):
+    zero = _to_complex(0)
+    one = _to_complex(1)
+    values = tuple(tuple(one if i == j else zero for j in range(n)) for i in range(n))
+    return ComplexM._from_matrix(n, n, values)
+
+
+def _diagonal_array(values, dtype):
+    return numpy.array([complex(value) for value in values], dtype=dtype)
+
+
+def _lu_decompose(rows):
+    '''
+    Computes the LU decomposition with partial pivoting P·A = L·U of the
+    matrix given by rows of builtin complex numbers. Returns the rows of L
+    and U packed in a single matrix (the diagonal of L is implicit) and the
+    permutation, where row i of P·A is the row permutation[i] of A.
+    '''
+    n = len(rows)
+    lu = [list(row) for row in rows]
+    permutation = list(range(n))
+    for k in range(n):
+        pivot = max(range(k, n), key=lambda i: abs(lu[i][k]))
+        if lu[pivot][k] == 0:
+            raise ValueError("Cannot compute the inverse of a singular matrix")
+        if pivot != k:
+            lu[k], lu[pivot] = lu[pivot], lu[k]
+            permutation[k], permutation[pivot] = permutation[pivot], permutation[k]
+
+        pivot_row = lu[k]
+        inverse_pivot = 1 / pivot_row[k]
+        for i in range(k + 1, n):
+            row = lu[i]
+            factor = row[k] * inverse_pivot
+            if factor != 0:
+                row[k] = factor
+                for j in range(k + 1, n):
+                    row[j] -= factor * pivot_row[j]
+            else:
+                row[k] = 0j
+    return lu, permutation
+
+
+def _lu_inverse(rows):
+    '''
+    Returns the rows of the inverse of the matrix given by rows of builtin
+    complex numbers, solving L·U·x = P·eⱼ for every column eⱼ of the identity
+    '''
+    n = len(rows)
+    lu, permutation = _lu_decompose(rows)
+    columns = []
+    for j in range(n):
+        # Forward substitution L·y = P·eⱼ
+        y = [1 + 0j if permutation[i] == j else 0j for i in range(n)]
+        for i in range(n):
+            row = lu[i]
+            y[i] -= sum(row[k] * y[k] for k in range(i))
+        # Back substitution U·x = y
+        x = [0j] * n
+        for i in reversed(range(n)):
+            row = lu[i]
+            x[i] = (y[i] - sum(row[k] * x[k] for k in range(i + 1, n))) / row[i]
+        columns.append(x)
+    return [list(row) for row in zip(*columns)]
+
+
+def _jacobi_eigen(rows, max_sweeps=64):
+    '''
+    Computes the eigenvalues and eigenvectors of the hermitian matrix given by
+    its rows of builtin complex numbers with the cyclic Jacobi method. Returns
+    the list of eigenvalues in ascending order and the list of the
+    corresponding eigenvectors.
+    '''
+    n = len(rows)
+    a = [list(row) for row in rows]
+    v = [[1 + 0j if i == j else 0j for j in range(n)] for i in range(n)]
+    scale = sum(abs(x) ** 2 for row in a for x in row)
+
+    for _ in range(max_sweeps):
+        off = sum(abs(a[p][q]) ** 2 for p in range(n) for q in range(n) if p != q)
+        if off <= 1e-30 * scale:
+            break
+
+        for p in range(n - 1):
+            for q in range(p + 1, n):
+                r = abs(a[p][q])
+                if r == 0:
+                    continue
+                # The phase of aₚ𝚚 is moved to the q axis, so the rotation
+                # that zeroes it is the one of a real symmetric matrix
+                phase = a[p][q] / r
+                tau = (a[q][q].real - a[p][p].real) / (2 * r)
+                t = (1 if tau >= 0 else -1) / (abs(tau) + sqrt(1 + tau * tau))
+                c = 1 / sqrt(1 + t * t)
+                s = t * c
+                sp = s * phase.conjugate()
+                cp = c * phase.conjugate()
+
+                # A ← Jᴴ A J where J has the columns (c, -s·e^(-iφ)) and (s, c·e^(-iφ))
+                for row in a:
+                    x = row[p]
+                    y = row[q]
+                    row[p] = c * x - sp * y
+                    row[q] = s * x + cp * y
+                ap = a[p]
+                aq = a[q]
+                for k in range(n):
+                    x = ap[k]
+                    y = aq[k]
+                    ap[k] = c * x - sp.conjugate() * y
+                    aq[k] = s * x + cp.conjugate() * y
+                for row in v:
+                    x = row[p]
+                    y = row[q]
+                    row[p] = c * x - sp * y
+                    row[q] = s * x + cp * y
+
+    order = sorted(range(n), key=lambda k: a[k][k].real)
+    return [a[k][k].real for k in order], [[row[k] for row in v] for k in order]
+
+
+def _hermitian_eigen(hmatrix):
+    '''
+    Returns the eigenvalues in ascending order of a hermitian matrix and the
+    matrix whose columns are the corresponding orthonormal eigenvectors
+    '''
+    if NUMPY:
+        values, vectors = numpy.linalg.eigh(as_array(hmatrix))
+        eigenvectors = ArrayComplexM._from_array(vectors)
+        if not isinstance(hmatrix, ArrayComplexM):
+            eigenvectors = eigenvectors.to_complexm()
+        return values.tolist(), eigenvectors
+
+    n = hmatrix.size[0]
+    values, vectors = _jacobi_eigen(complex_rows(hmatrix))
+    columns = [[_interned_complex(x.real, x.imag) for x in vector] for vector in vectors]
+    return values, ComplexM._from_matrix(n, n, tuple(zip(*columns)))
+
+
+Observation = namedtuple('Observation', ['mean', 'variance', 'distribution'])
+
+
+class Observable(object):
+    """
+    Observable of a quantum system given by a hermitian matrix
+
+    The eigendecomposition of the matrix is computed once (and kept in the
+    cache of derived results), so observing a state only costs projecting it
+    onto the eigenvectors, a single matrix-vector product, and a batch of
+    states a single matrix product.
+    """
+    def __init__(self, hmatrix, atol=None, rtol=None):
+        if not isinstance(hmatrix, ComplexM):
+            raise TypeError("An observable should be a ComplexM, not an object of class {0}"
+                            .format(hmatrix.__class__.__name__))
+        atol, rtol = hmatrix.get_tolerances(atol, rtol)
+        if not hmatrix.is_hermitian(atol, rtol):
+            raise ValueError("An observable should be a hermitian matrix")
+
+        self._matrix = hmatrix
+        self._atol = atol
+        self._rtol = rtol
+
+    @property
+    def matrix(self):
+        return self._matrix
+
+    @property
+    def size(self):
+        return self._matrix.size[0]
+
+    def _get_eigen(self):
+        return self._matrix._cached('eigen', lambda: _hermitian_eigen(self._matrix))
+
+    @property
+    def eigenvalues(self):
+        return tuple(self._get_eigen()[0])
+
+    @property
+    def eigenvectors(self):
+        '''
+        ComplexM whose columns are the eigenvectors of the observable
+        '''
+        return self._get_eigen()[1]
+
+    def observe(self, state):
+        '''
+        Returns the mean, the variance and the distribution of the values
+        observed on the given state. The distribution is a list of pairs
+        (value, probability) for every distinct eigenvalue.
+        @state: ComplexM vector of size n×1
+        '''
+        if not isinstance(state, ComplexM):
+            raise TypeError("A state should be a ComplexM, not an object of class {0}"
+                            .format(state.__class__.__name__))
+        if not state.is_vector():
+            raise ValueError("A state should be a vector")
+
+        return self._observations(state)[0]
+
+    def observe_batch(self, states):
+        '''
+        Observes many states with a single matrix product.
+        @states: ComplexM of size n×k whose columns are the states or a
+        sequence of vectors of size n×1
+        '''
+        if not isinstance(states, ComplexM):
+            states = ComplexM.from_columns(states)
+
+        return self._observations(states)
+
+    def mean(self, state):
+        return self.observe(state).mean
+
+    def variance(self, state):
+        return self.observe(state).variance
+
+    def distribution(self, state):
+        return self.observe(state).distribution
+
+    def _observations(self, states):
+        n = self.size
+        sm, sn = states.size
+        if sm != n:
+            raise TypeError("Cannot multiply a ComplexM of size {0}x{0} with a ComplexM of size {1}x{2}"
+                            .format(str(n), str(sm), str(sn)))
+
+        values, vectors = self._get_eigen()
+        # The coefficients of the states in the basis of eigenvectors
+        probabilities = vectors.adjoint().apply_batch(states).column_probabilities()
+
+        observations = []
+        for column in probabilities.get_columns():
+            p = [x.real_value for row in column for x in row]
+            mean = sum(map(mul, p, values))
+            variance = sum(pk * (value - mean) ** 2 for pk, value in zip(p, values))
+            observations.append(Observation(mean, variance, self._group(p, values)))
+
+        return observations
+
+    def _group(self, probabilities, values):
+        '''
+        Returns the pairs (value, probability) adding up the probabilities of
+        the degenerate eigenvalues
+        '''
+        distribution = []
+        for p, value in zip(probabilities, values):
+            if distribution and abs(value - distribution[-1][0]) <= self._atol + self._rtol * abs(value):
+                distribution[-1] = (distribution[-1][0], distribution[-1][1] + p)
+            else:
+                distribution.append((value, p))
+
+        return distribution
+
+
+PAULI_LETTERS = 'IXYZ'
+
+
+class PauliObservable(object):
+    """
+    Observable given by a weighted sum of Pauli strings, e.g.
+    PauliObservable([(0.5, 'XZ'), (-1, 'IY')]) is 0.5·X⊗Z - I⊗Y
+
+    The first letter of a string acts on the most significant qubit. Every
+    string is kept as X^x·Z^z (with Y = i·X·Z) for two bit masks x and z, so
+    its expectation on a state of n qubits is computed from the amplitudes
+    with index arithmetic in O(2^n), without building any 2^n×2^n matrix:
+    ⟨ψ|X^x·Z^z|ψ⟩ = Σ_b conj(ψ[b⊕x])·(-1)^|b∧z|·ψ[b]
+    """
+    def __init__(self, terms):
+        self._terms = {}
+        self._nqubits = None
+        for coefficient, string in terms:
+            if not isinstance(coefficient, (int, float)):
+                raise TypeError("The coefficients of an observable should be real numbers")
+            self._add_term(coefficient, string)
+
+        if self._nqubits is None:
+            raise ValueError("A PauliObservable needs at least one Pauli string")
+
+    def _add_term(self, coefficient, string):
+        if not isinstance(string, str) or len(string) == 0 or any(p not in PAULI_LETTERS for p in string.upper()):
+            raise ValueError("{0} is not a Pauli string".format(string))
+        if self._nqubits is not None and len(string) != self._nqubits:
+            raise ValueError("All the Pauli strings should act on {0} qubits".format(str(self._nqubits)))
+        self._nqubits = len(string)
+
+        x = 0
+        z = 0
+        c = complex(coefficient)
+        for pauli in string.upper():
+            x <<= 1
+            z <<= 1
+            if pauli in 'XY':
+                x |= 1
+            if pauli in 'ZY':
+                z |= 1
+            if pauli == 'Y':
+                c *= 1j
+        self._terms[(x, z)] = self._terms.get((x, z), 0j) + c
+
+    @property
+    def nqubits(self):
+        return self._nqubits
+
+    @property
+    def terms(self):
+        '''
+        Dict of the coefficients of every term X^x·Z^z indexed by (x, z)
+        '''
+        return dict(self._terms)
+
+    def _get_amplitudes(self, state):
+        if not isinstance(state, ComplexM):
+            raise TypeError("A state should be a ComplexM, not an object of class {0}"
+                            .format(state.__class__.__name__))
+        if state.size != (2 ** self._nqubits, 1):
+            raise ValueError("A state of {0} qubits should be a vector of size {1}x1"
+                             .format(str(self._nqubits), str(2 ** self._nqubits)))
+        if isinstance(state, ArrayComplexM):
+            return state.array.ravel().tolist()
+        return [complex(row[0]) for row in state]
+
+    @staticmethod
+    def _expectation(terms, amplitudes):
+        total = 0j
+        indices = range(len(amplitudes))
+        for (x, z), c in terms.items():
+            if c == 0:
+                continue
+            s = 0j
+            for b in indices:
+                value = amplitudes[b ^ x].conjugate() * amplitudes[b]
+                s += -value if bin(b & z).count('1') & 1 else value
+            total += c * s
+
+        return total / sum(abs(a) ** 2 for a in amplitudes)
+
+    def expectation(self, state):
+        '''
+        Returns the mean value ⟨ψ|H|ψ⟩/⟨ψ|ψ⟩ of the observable on a state
+        @state: ComplexM vector of size 2^n×1
+        '''
+        return self._expectation(self._terms, self._get_amplitudes(state)).real
+
+    def variance(self, state):
+        '''
+        Returns ⟨H²⟩ - ⟨H⟩² on a state, H² is computed multiplying the Pauli
+        strings symbolically
+        '''
+        amplitudes = self._get_amplitudes(state)
+        mean = self._expectation(self._terms, amplitudes).real
+        return self._expectation(self._square_terms(), amplitudes).real - mean ** 2
+
+    def _square_terms(self):
+        # X^x1·Z^z1·X^x2·Z^z2 = (-1)^|z1∧x2|·X^(x1⊕x2)·Z^(z1⊕z2)
+        square = {}
+        for (x1, z1), c1 in self._terms.items():
+            for (x2, z2), c2 in self._terms.items():
+                c = c1 * c2
+                if bin(z1 & x2).count('1') & 1:
+                    c = -c
+                key = (x1 ^ x2, z1 ^ z2)
+                square[key] = square.get(key, 0j) + c
+        return square
+
+    def to_complexm(self):
+        '''
+        Materializes the observable as a ComplexM of size 2^n×2^n
+        '''
+        n = 2 ** self._nqubits
+        rows = [[0j] * n for _ in range(n)]
+        for (x, z), c in self._terms.items():
+            for b in range(n):
+                rows[b ^ x][b] += -c if bin(b & z).count('1') & 1 else c
+        return ComplexM(n, n, rows)
+
+
 def q_observe(vector: 'ComplexM', hmatrix: 'ComplexM'):
     '''
     Simulates an observation in a quantum system.
@@ -377,4 +3219,5 @@ def q_observe(vector: 'ComplexM', hmatrix: 'ComplexM'):
     if not hmatrix.is_hermitian():
         raise ValueError("The second parameter shoudl be a hermitian matrix")
 
-    return hmatrix * vector
+    observation = Observable(hmatrix).observe(vector)
+    return observation.mean, observation.variance
@@ -119,10 +119,16 @@ if __name__ == "__main__":
     from qcomputer import QComputer
     from qinstrhandler import DummyPrintHandler, \
                               InitializeHandler, \
-                              SelectHandler
+                              SelectHandler, \
+                              ApplyHandler, \
+                              MeasureHandler, \
+                              TensorHandler, \
+                              ConcatHandler, \
+                              InverseHandler
 
     parser = yacc.yacc()
-    qcomp = QComputer([DummyPrintHandler, InitializeHandler, SelectHandler])
+    qcomp = QComputer([DummyPrintHandler, InitializeHandler, SelectHandler, ApplyHandler,
+                       MeasureHandler, TensorHandler, ConcatHandler, InverseHandler])
 
     print("\n\n"
           "Quantum Assembler shell. "
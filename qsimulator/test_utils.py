@@ -5,10 +5,16 @@ Created on Nov 28, 2014
 '''
 
 from qcomputer import QComputer
-from qinstrhandler import InitializeHandler, SelectHandler
+from qinstrhandler import InitializeHandler, SelectHandler, ApplyHandler, MeasureHandler, \
+                         TensorHandler, ConcatHandler, InverseHandler
 from qmath import ComplexM
 from qinstruction import Initialize, \
-                         Select
+                         Select, \
+                         Apply, \
+                         Measure, \
+                         Tensor, \
+                         Concat, \
+                         Inverse
 
 from qinstruction import Register, \
                          BitString, \
@@ -23,7 +29,8 @@ def get_dummy_computer(nregisters=4, sqrt_size=3):
 
 
 def get_functional_computer(nregisters=4, sqrt_size=3):
-    handlers = [InitializeHandler, SelectHandler]
+    handlers = [InitializeHandler, SelectHandler, ApplyHandler, MeasureHandler,
+                TensorHandler, ConcatHandler, InverseHandler]
     qcomp = QComputer(handlers=handlers,
                       sqrt_size=sqrt_size,
                       nregisters=nregisters
@@ -50,3 +57,28 @@ def instr_select(var_name, reg_num, offset, numqbits):
                    )
 
     return instr
+
+
+def instr_apply(matrix, reg_num):
+    instr = Apply(matrix, Register(reg_num))
+    return instr
+
+
+def instr_measure(reg_num, var_name):
+    instr = Measure(Register(reg_num), Variable(var_name))
+    return instr
+
+
+def instr_tensor(var_name, op1, op2):
+    instr = Tensor(Variable(var_name), op1, op2)
+    return instr
+
+
+def instr_concat(var_name, matrix1, matrix2):
+    instr = Concat(Variable(var_name), matrix1, matrix2)
+    return instr
+
+
+def instr_inverse(var_name, matrix):
+    instr = Inverse(Variable(var_name), matrix)
+    return instr
@@ -12,8 +12,10 @@ if cmd_folder not in sys.path:
     sys.path.insert(0, cmd_folder)
 
 import unittest
+from math import sqrt
 
-from qmath import ComplexM, q_observe
+import qmath
+from qmath import Complex, ComplexM, KroneckerOperator, Observable, PauliObservable, q_observe
 
 
 class ComplexOperationsTest(unittest.TestCase):
@@ -37,8 +39,124 @@ class ComplexOperationsTest(unittest.TestCase):
 
         a = ComplexM(2, 1, [[1], [0]])
         b = ComplexM(2, 2, [[0, 1], [1, 0]])
-        res = ComplexM(2, 1, [[0], [1]])
-        self.assertEqual(res, q_observe(a, b))
+        mean, variance = q_observe(a, b)
+        self.assertAlmostEqual(0, mean)
+        self.assertAlmostEqual(1, variance)
+
+        # Example 4.2.5 of Yanofsky
+        a = ComplexM(2, 1, [[(sqrt(2) / 2, 0)], [(0, sqrt(2) / 2)]])
+        b = ComplexM(2, 2, [[1, (0, -1)], [(0, 1), 2]])
+        mean, variance = q_observe(a, b)
+        self.assertAlmostEqual(2.5, mean)
+        self.assertAlmostEqual(0.25, variance)
+
+
+class ObservableTest(unittest.TestCase):
+    def setUp(self):
+        self.h = ComplexM(3, 3, [[2, (1, -1), 0], [(1, 1), 3, (0, 2)], [0, (0, -2), -1]])
+        self.states = [ComplexM(3, 1, [[(1, i)], [2], [(0, -i)]]) for i in range(3)]
+
+    def assertObservation(self, state, observation):
+        # ⟨ψ|H|ψ⟩ and ⟨ψ|H²|ψ⟩ - ⟨ψ|H|ψ⟩² computed from the matrix
+        state = state.normalize()
+        mean = state.inner_product(self.h * state).real_value
+        square = state.inner_product(self.h * self.h * state).real_value
+        self.assertAlmostEqual(mean, observation.mean)
+        self.assertAlmostEqual(square - mean ** 2, observation.variance)
+        self.assertAlmostEqual(1, sum(p for value, p in observation.distribution))
+
+    def testEigendecomposition(self):
+        observable = Observable(self.h)
+        vectors = observable.eigenvectors
+        for k, value in enumerate(observable.eigenvalues):
+            v = ComplexM(3, 1, [[x] for x in vectors.get_col(k)])
+            self.assertAlmostEqual(0, (self.h * v).distance(v * Complex(value)))
+        self.assertEqual(list(observable.eigenvalues), sorted(observable.eigenvalues))
+
+    def testJacobi(self):
+        rows = [[complex(x) for x in row] for row in self.h]
+        values, vectors = qmath._jacobi_eigen(rows)
+        for value, vector in zip(values, vectors):
+            hv = [sum(a * x for a, x in zip(row, vector)) for row in rows]
+            for y, x in zip(hv, vector):
+                self.assertAlmostEqual(y, value * x)
+            self.assertAlmostEqual(1, sum(abs(x) ** 2 for x in vector))
+        self.assertEqual(values, sorted(values))
+
+    def testObserve(self):
+        observable = Observable(self.h)
+        for state in self.states:
+            self.assertObservation(state, observable.observe(state))
+        observations = observable.observe_batch(self.states)
+        self.assertEqual(len(observations), 3)
+        for state, observation in zip(self.states, observations):
+            self.assertObservation(state, observation)
+        self.assertEqual(observable.observe_batch(ComplexM.from_columns(self.states)), observations)
+
+    def testDegenerateDistribution(self):
+        observable = Observable(ComplexM(3, 3, [[1, 0, 0], [0, 1, 0], [0, 0, 3]]))
+        distribution = observable.distribution(ComplexM(3, 1, [[1], [1], [(0, 1)]]))
+        self.assertEqual(len(distribution), 2)
+        self.assertAlmostEqual(1, distribution[0][0])
+        self.assertAlmostEqual(2 / 3, distribution[0][1])
+        self.assertAlmostEqual(3, distribution[1][0])
+
+    def testErrors(self):
+        with self.assertRaises(ValueError):
+            Observable(ComplexM(2, 2, [[1, 4], [2, 1]]))
+        with self.assertRaises(TypeError):
+            Observable(1)
+        with self.assertRaises(TypeError):
+            Observable(self.h).observe(ComplexM(2, 1, [[1], [0]]))
+        with self.assertRaises(ValueError):
+            Observable(self.h).observe(self.h)
+
+
+class PauliObservableTest(unittest.TestCase):
+    def setUp(self):
+        self.paulis = {
+            'I': ComplexM(2, 2, [[1, 0], [0, 1]]),
+            'X': ComplexM(2, 2, [[0, 1], [1, 0]]),
+            'Y': ComplexM(2, 2, [[0, (0, -1)], [(0, 1), 0]]),
+            'Z': ComplexM(2, 2, [[1, 0], [0, -1]]),
+        }
+        self.terms = [(0.5, 'XZI'), (-1, 'IYY'), (2, 'ZZZ'), (0.25, 'YXI')]
+        self.state = ComplexM(8, 1, [[(i, 1 - i)] for i in range(8)])
+
+    def dense(self, terms):
+        result = None
+        for c, string in terms:
+            term = KroneckerOperator(*[self.paulis[p] for p in string]).to_complexm() * Complex(c)
+            result = term if result is None else result + term
+        return result
+
+    def testToComplexM(self):
+        observable = PauliObservable(self.terms)
+        self.assertEqual(observable.nqubits, 3)
+        self.assertEqual(observable.to_complexm(), self.dense(self.terms))
+
+    def testExpectationAndVariance(self):
+        observable = PauliObservable(self.terms)
+        mean, variance = q_observe(self.state, self.dense(self.terms))
+        self.assertAlmostEqual(mean, observable.expectation(self.state))
+        self.assertAlmostEqual(variance, observable.variance(self.state))
+
+        # |0⟩ is an eigenvector of Z with eigenvalue 1
+        z = PauliObservable([(1, 'Z')])
+        self.assertEqual(z.expectation(ComplexM(2, 1, [[1], [0]])), 1)
+        self.assertEqual(z.variance(ComplexM(2, 1, [[1], [0]])), 0)
+
+    def testErrors(self):
+        with self.assertRaises(ValueError):
+            PauliObservable([(1, 'XA')])
+        with self.assertRaises(ValueError):
+            PauliObservable([(1, 'XZ'), (1, 'X')])
+        with self.assertRaises(ValueError):
+            PauliObservable([])
+        with self.assertRaises(TypeError):
+            PauliObservable([(1j, 'X')])
+        with self.assertRaises(ValueError):
+            PauliObservable(self.terms).expectation(ComplexM(2, 1, [[1], [0]]))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,247 @@
+'''
+Tests of the state vector backends
+
+@author: Jordi Llull
+'''
+import os
+import sys
+import inspect
+cmd_folder = os.path.realpath(os.path.abspath(
+    os.path.split(inspect.getfile(inspect.currentframe()))[0]) + "/..")
+if cmd_folder not in sys.path:
+    sys.path.insert(0, cmd_folder)
+
+import unittest
+from math import sqrt
+
+from qbackend import PythonBackend, NumpyBackend, OutcomeSampler, get_default_backend
+from qcomputer import QComputer
+from qinstrhandler import InitializeHandler
+from qmath import ComplexM, IdentityOp, PermutationOp, KroneckerOperator, ProductChain, NUMPY
+from test_utils import instr_initialize
+
+
+def full_gate(gate, qubits, nqubits):
+    '''
+    Returns the matrix of the whole register of a gate applied to the given
+    qubits, built element by element from the bits of the indexes
+    '''
+    k = len(qubits)
+
+    def split(index):
+        bits = [index >> (nqubits - 1 - q) & 1 for q in range(nqubits)]
+        targeted = sum(bits[q] << (k - 1 - i) for i, q in enumerate(qubits))
+        rest = [b for q, b in enumerate(bits) if q not in qubits]
+        return targeted, rest
+
+    size = 1 << nqubits
+    matrix = []
+    for i in range(size):
+        ti, ri = split(i)
+        row = []
+        for j in range(size):
+            tj, rj = split(j)
+            row.append(gate[ti][tj] if ri == rj else 0)
+        matrix.append(row)
+    return ComplexM(size, size, matrix)
+
+
+class PythonBackendTest(unittest.TestCase):
+
+    def get_backend(self):
+        return PythonBackend()
+
+    def setUp(self):
+        self.backend = self.get_backend()
+        x = 1 / sqrt(2)
+        self.h = ComplexM(2, 2, [[x, x], [x, -x]])
+        self.x = ComplexM(2, 2, [[0, 1], [1, 0]])
+        self.i = ComplexM(2, 2, [[1, 0], [0, 1]])
+        self.cnot = ComplexM(4, 4, [[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 0, 1], [0, 0, 1, 0]])
+        self.u = ComplexM(2, 2, [[(0.6, 0), (0, 0.8)], [(0, 0.8), (0.6, 0)]])
+        self.state = self.backend.from_complexm(ComplexM(8, 1, [[(i, 1 - i)] for i in range(8)]))
+
+    def assertState(self, expected, state):
+        for x, y in zip(expected, self.backend.to_complexm(state)):
+            self.assertAlmostEqual(complex(x[0]), complex(y[0]))
+
+    def testBasisState(self):
+        state = self.backend.basis_state(3, int('101', 2))
+        self.assertEqual(self.backend.to_complexm(state),
+                         ComplexM(8, 1, [[1 if i == 5 else 0] for i in range(8)]))
+        self.assertEqual(list(self.backend.probabilities(state)), [1 if i == 5 else 0 for i in range(8)])
+
+    def testApplySingleQubitGates(self):
+        vector = self.backend.to_complexm(self.state)
+        expected = self.i.tensor(self.u).tensor(self.i) * vector
+        self.assertState(expected, self.backend.apply(self.state, self.u, [1]))
+
+        state = self.backend.basis_state(3)
+        state = self.backend.apply(state, self.x, [0])
+        self.assertEqual(list(self.backend.probabilities(state)), [0, 0, 0, 0, 1, 0, 0, 0])
+
+    def testApplyMultiQubitGates(self):
+        vector = self.backend.to_complexm(self.state)
+        gate = self.u.tensor(self.cnot)
+
+        # Consecutive qubits
+        self.assertState(gate * vector, self.backend.apply(self.backend.from_complexm(vector), gate, [0, 1, 2]))
+        self.assertState(self.i.tensor(self.cnot) * vector,
+                         self.backend.apply(self.backend.from_complexm(vector), self.cnot, [1, 2]))
+
+        # Non consecutive qubits, in both orders
+        self.assertState(full_gate(self.cnot, [2, 0], 3) * vector,
+                         self.backend.apply(self.backend.from_complexm(vector), self.cnot, [2, 0]))
+        self.assertState(full_gate(gate, [1, 0, 2], 3) * vector,
+                         self.backend.apply(self.backend.from_complexm(vector), gate, [1, 0, 2]))
+
+    def testApplyStructuredGates(self):
+        vector = self.backend.to_complexm(self.state)
+        phased = PermutationOp([1, 0, 3, 2], [1, 1j, -1, 1])
+        self.assertState(full_gate(phased.to_complexm(), [2, 0], 3) * vector,
+                         self.backend.apply(self.backend.from_complexm(vector), phased, [2, 0]))
+        self.assertState(full_gate(self.cnot, [1, 2], 3) * vector,
+                         self.backend.apply(self.backend.from_complexm(vector), PermutationOp([0, 1, 3, 2]), [1, 2]))
+        self.assertState(vector, self.backend.apply(self.backend.from_complexm(vector), IdentityOp(4), [0, 2]))
+
+    def testApplyLazyOperators(self):
+        vector = self.backend.to_complexm(self.state)
+        kron = KroneckerOperator(self.u, self.h)
+        self.assertState(full_gate(kron.to_complexm(), [2, 0], 3) * vector,
+                         self.backend.apply(self.backend.from_complexm(vector), kron, [2, 0]))
+        chain = ProductChain(self.cnot, self.u.tensor(self.h))
+        self.assertState(full_gate(chain.to_complexm(), [1, 2], 3) * vector,
+                         self.backend.apply(self.backend.from_complexm(vector), chain, [1, 2]))
+
+    def testCompiledKernelsCanBeReused(self):
+        kernel = self.backend.compile(self.u, [1], 3)
+        vector = self.backend.to_complexm(self.state)
+        expected = self.i.tensor(self.u).tensor(self.i)
+        self.assertState(expected * expected * vector, kernel(kernel(self.backend.from_complexm(vector))))
+
+    def testBellState(self):
+        state = self.backend.basis_state(2)
+        state = self.backend.apply(state, self.h, [0])
+        state = self.backend.apply(state, self.cnot, [0, 1])
+        for p, expected in zip(self.backend.probabilities(state), [0.5, 0, 0, 0.5]):
+            self.assertAlmostEqual(p, expected)
+
+    def testApplyHadamard(self):
+        vector = self.backend.to_complexm(self.state)
+        expected = self.h.tensor(self.i).tensor(self.h) * vector
+        self.assertState(expected, self.backend.apply_hadamard(self.backend.from_complexm(vector), [0, 2]))
+        expected = self.h.tensor(self.h).tensor(self.h) * vector
+        self.assertState(expected, self.backend.apply_hadamard(self.backend.from_complexm(vector)))
+
+        # The transform updates the state in place, also for a layer of H
+        # factors applied as a gate
+        state = self.backend.from_complexm(vector)
+        self.assertIs(self.backend.apply_hadamard(state, [1]), state)
+        layer = KroneckerOperator(self.h, IdentityOp(2), self.h)
+        state = self.backend.from_complexm(vector)
+        self.assertIs(self.backend.apply(state, layer, [0, 1, 2]), state)
+        self.assertState(layer.to_complexm() * vector, state)
+
+    def testMarginalProbabilities(self):
+        state = self.backend.apply_hadamard(self.backend.basis_state(3, int('010', 2)), [2])
+        self.assertEqual(list(self.backend.marginal_probabilities(self.state)),
+                         list(self.backend.probabilities(self.state)))
+        for p, expected in zip(self.backend.marginal_probabilities(state, [1, 2]), [0, 0, 0.5, 0.5]):
+            self.assertAlmostEqual(p, expected)
+        for p, expected in zip(self.backend.marginal_probabilities(state, [2, 1]), [0, 0.5, 0, 0.5]):
+            self.assertAlmostEqual(p, expected)
+        for p, expected in zip(self.backend.marginal_probabilities(state, [0]), [1, 0]):
+            self.assertAlmostEqual(p, expected)
+
+        with self.assertRaises(ValueError):
+            self.backend.marginal_probabilities(state, [1, 1])
+        with self.assertRaises(IndexError):
+            self.backend.marginal_probabilities(state, [3])
+
+    def testSampler(self):
+        state = self.backend.apply_hadamard(self.backend.basis_state(3, int('010', 2)), [2])
+        sampler = self.backend.sampler(state, [1, 2], seed=0)
+        self.assertEqual(set(sampler.sample(100)), {2, 3})
+
+        counts = sampler.counts(10000)
+        self.assertEqual(counts[:2], [0, 0])
+        self.assertAlmostEqual(counts[2] / 10000, 0.5, delta=0.05)
+
+    def testErrors(self):
+        with self.assertRaises(ValueError):
+            self.backend.apply(self.state, self.cnot, [0])
+        with self.assertRaises(ValueError):
+            self.backend.apply(self.state, self.cnot, [1, 1])
+        with self.assertRaises(IndexError):
+            self.backend.apply(self.state, self.u, [3])
+        with self.assertRaises(TypeError):
+            self.backend.apply(self.state, 1, [0])
+        with self.assertRaises(IndexError):
+            self.backend.apply_hadamard(self.state, [5])
+
+
+@unittest.skipUnless(NUMPY, "numpy is not installed")
+class NumpyBackendTest(PythonBackendTest):
+
+    def get_backend(self):
+        return NumpyBackend()
+
+    def testReducedPrecision(self):
+        backend = NumpyBackend('complex64')
+        state = backend.apply(backend.basis_state(3), self.u, [1])
+        self.assertEqual(state.dtype.name, 'complex64')
+        self.assertEqual(backend.apply_hadamard(state).dtype.name, 'complex64')
+
+
+class OutcomeSamplerTest(unittest.TestCase):
+
+    def testSample(self):
+        sampler = OutcomeSampler([0.2, 0, 0.3, 0.5], seed=1)
+        shots = 20000
+        outcomes = sampler.sample(shots)
+        self.assertEqual(len(outcomes), shots)
+        for outcome, p in enumerate([0.2, 0, 0.3, 0.5]):
+            self.assertAlmostEqual(outcomes.count(outcome) / shots, p, delta=0.02)
+
+    def testCounts(self):
+        sampler = OutcomeSampler([1, 3], seed=1)
+        counts = sampler.counts(20000)
+        self.assertEqual(sum(counts), 20000)
+        self.assertAlmostEqual(counts[1] / 20000, 0.75, delta=0.02)
+
+    def testSamplersAreReproducible(self):
+        self.assertEqual(OutcomeSampler([0.5, 0.5], seed=3).sample(50),
+                         OutcomeSampler([0.5, 0.5], seed=3).sample(50))
+
+    def testImpossibleDistributionsRaiseAnError(self):
+        with self.assertRaises(ValueError):
+            OutcomeSampler([0, 0])
+        with self.assertRaises(ValueError):
+            OutcomeSampler([])
+
+
+class QComputerStateTest(unittest.TestCase):
+
+    def testRegistersHoldTheirQuantumState(self):
+        qcomp = QComputer(handlers=[InitializeHandler], sqrt_size=2, nregisters=2)
+        qcomp.execute(instr_initialize(0, "0110"))
+
+        register = qcomp.registers[0]
+        self.assertEqual(register.nqubits, 4)
+        probabilities = list(qcomp.backend.probabilities(register.state))
+        self.assertEqual(probabilities, [1 if i == 6 else 0 for i in range(16)])
+        with self.assertRaises(UnboundLocalError):
+            qcomp.registers[1].state
+
+    def testPluggableBackend(self):
+        backend = PythonBackend()
+        qcomp = QComputer(handlers=[InitializeHandler], sqrt_size=2, nregisters=1, backend=backend)
+        qcomp.execute(instr_initialize(0))
+
+        self.assertIs(qcomp.backend, backend)
+        self.assertIsInstance(qcomp.registers[0].state, list)
+        self.assertIsInstance(get_default_backend(), NumpyBackend if NUMPY else PythonBackend)
+
+
+if __name__ == "__main__":
+    unittest.main()
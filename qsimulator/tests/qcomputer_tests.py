@@ -14,13 +14,20 @@ if cmd_folder not in sys.path:
 import unittest
 
 from qcomputer import QComputer
-from qmath import ComplexM
+from qmath import ComplexM, KroneckerOperator, IdentityOp, PermutationOp, ProductChain, NUMPY
+from qinstruction import CNot, H, Identity, Variable, Register
+from qinstrhandler import InitializeHandler
 from utils import bitstring_to_matrix
 from test_utils import get_dummy_computer, \
                        get_functional_computer, \
                        zero_matrix, \
                        instr_initialize, \
-                       instr_select
+                       instr_select, \
+                       instr_apply, \
+                       instr_measure, \
+                       instr_tensor, \
+                       instr_concat, \
+                       instr_inverse
 
 
 class QComputerTest(unittest.TestCase):
@@ -76,6 +83,20 @@ class QComputerTest(unittest.TestCase):
 
         self.assertEquals(expected_value, qcomp.variables['V1'].value)
 
+    @unittest.skipUnless(NUMPY, "numpy is not installed")
+    def testRegistersWithReducedPrecision(self):
+        qcomp = QComputer(handlers=[InitializeHandler], sqrt_size=3, nregisters=2, precision='complex64')
+        value = "101100010"
+        qcomp.execute(instr_initialize(0, value))
+
+        self.assertEqual(qcomp.precision, 'complex64')
+        self.assertEqual(qcomp.registers[0].value.precision, 'complex64')
+        self.assertEqual(ComplexM(3, 3, bitstring_to_matrix(value, 3)), qcomp.registers[0].value)
+
+    def testUnknownPrecisionRaisesAnError(self):
+        with self.assertRaises(ValueError):
+            QComputer(handlers=[], precision='float')
+
     def testSelectFromNotInitializedRegistersRaisesAnError(self):
         qcomp = get_functional_computer(nregisters=4, sqrt_size=3)
 
@@ -88,6 +109,253 @@ class QComputerTest(unittest.TestCase):
         with self.assertRaises(IndexError):
             qcomp.execute(instr_select('V1', 0, 0, 10))
 
+    def assertProbabilities(self, expected, qcomp, reg_num):
+        probabilities = qcomp.backend.probabilities(qcomp.registers[reg_num].state)
+        for p, e in zip(probabilities, expected):
+            self.assertAlmostEqual(p, e)
+
+    def testApplyHadamardToARegister(self):
+        qcomp = get_functional_computer(nregisters=2, sqrt_size=2)
+        qcomp.execute(instr_initialize(0))
+        qcomp.execute(instr_apply(H(), 0))
+
+        self.assertProbabilities([1 / 16] * 16, qcomp, 0)
+
+        # H is its own inverse
+        qcomp.execute(instr_apply(H(), 0))
+        self.assertProbabilities([1] + [0] * 15, qcomp, 0)
+
+    def testApplyCNotToTheLeadingQubits(self):
+        qcomp = get_functional_computer(nregisters=2, sqrt_size=2)
+        qcomp.execute(instr_initialize(0, "1001"))
+        qcomp.execute(instr_apply(CNot(), 0))
+
+        self.assertProbabilities([1 if i == int("1101", 2) else 0 for i in range(16)], qcomp, 0)
+
+    def testApplyIdentityKeepsTheState(self):
+        qcomp = get_functional_computer(nregisters=2, sqrt_size=2)
+        qcomp.execute(instr_initialize(0, "0110"))
+        qcomp.execute(instr_apply(Identity(8), 0))
+
+        self.assertProbabilities([1 if i == 6 else 0 for i in range(16)], qcomp, 0)
+
+        with self.assertRaises(ValueError):
+            qcomp.execute(instr_apply(Identity(3), 0))
+        with self.assertRaises(ValueError):
+            qcomp.execute(instr_apply(Identity(32), 0))
+
+    def testApplyVariable(self):
+        qcomp = get_functional_computer(nregisters=2, sqrt_size=2)
+        qcomp.execute(instr_initialize(0))
+        qcomp.set_variable('X', ComplexM(2, 2, [[0, 1], [1, 0]]))
+        qcomp.execute(instr_apply(Variable('X'), 0))
+
+        self.assertProbabilities([1 if i == 8 else 0 for i in range(16)], qcomp, 0)
+
+        with self.assertRaises(KeyError):
+            qcomp.execute(instr_apply(Variable('Y'), 0))
+
+    def testApplyRegisterOfInvalidSizeRaisesAnError(self):
+        qcomp = get_functional_computer(nregisters=2, sqrt_size=3)
+        qcomp.execute(instr_initialize(0))
+        with self.assertRaises(ValueError):
+            qcomp.execute(instr_apply(Register(0), 0))
+
+    def testApplyToNotInitializedRegistersRaisesAnError(self):
+        qcomp = get_functional_computer(nregisters=2, sqrt_size=2)
+        with self.assertRaises(UnboundLocalError):
+            qcomp.execute(instr_apply(H(), 0))
+
+    def testApplyReusesTheKernelsOfTheGates(self):
+        qcomp = get_functional_computer(nregisters=2, sqrt_size=2)
+        qcomp.execute(instr_initialize(0))
+        qcomp.execute(instr_initialize(1))
+        for _ in range(3):
+            qcomp.execute(instr_apply(CNot(), 0))
+            qcomp.execute(instr_apply(CNot(), 1))
+
+        info = qcomp.gate_library.info()
+        self.assertEqual(info.misses, 1)
+        self.assertEqual(info.hits, 5)
+
+    def testApplyReusesTheKernelsOfTheVariables(self):
+        qcomp = get_functional_computer(nregisters=2, sqrt_size=3)
+        qcomp.execute(instr_initialize(0))
+        qcomp.execute(instr_tensor('T', CNot(), Identity(4)))
+        qcomp.execute(instr_tensor('HI', H(), Identity(2)))
+        qcomp.execute(instr_tensor('K', Variable('HI'), Identity(64)))
+        qcomp.execute(instr_concat('C', Variable('K'), Variable('K')))
+        self.assertIsInstance(qcomp.variables['K'].value, KroneckerOperator)
+        self.assertIsInstance(qcomp.variables['C'].value, ProductChain)
+
+        for _ in range(3):
+            for name in ('T', 'K', 'C'):
+                qcomp.execute(instr_apply(Variable(name), 0))
+
+        info = qcomp.gate_library.info()
+        self.assertEqual(info.misses, 3)
+        self.assertEqual(info.hits, 6)
+
+        # An equal permutation built again reuses the kernel too
+        qcomp.execute(instr_tensor('T', CNot(), Identity(4)))
+        qcomp.execute(instr_apply(Variable('T'), 0))
+        self.assertEqual(qcomp.gate_library.info().hits, 7)
+
+    def testMeasureABasisState(self):
+        qcomp = get_functional_computer(nregisters=2, sqrt_size=2)
+        qcomp.execute(instr_initialize(0, "1101"))
+        qcomp.execute(instr_measure(0, 'M'))
+
+        self.assertEqual(ComplexM(1, 4, [[1, 1, 0, 1]]), qcomp.variables['M'].value)
+        self.assertEqual(ComplexM(2, 2, [[1, 1], [0, 1]]), qcomp.registers[0].value)
+
+    def testMeasureCollapsesTheState(self):
+        qcomp = get_functional_computer(nregisters=2, sqrt_size=2)
+        qcomp.execute(instr_initialize(0))
+        qcomp.execute(instr_tensor('HI', H(), Identity(2)))
+        qcomp.execute(instr_apply(Variable('HI'), 0))
+        qcomp.execute(instr_apply(CNot(), 0))
+        qcomp.execute(instr_measure(0, 'M'))
+
+        bits = [int(x[0].real_value) for x in qcomp.variables['M'].value.transpose()]
+        self.assertEqual(bits[0] ^ bits[1], 0)
+        outcome = int(''.join(map(str, bits)), 2)
+        self.assertProbabilities([1 if i == outcome else 0 for i in range(16)], qcomp, 0)
+
+        # Measuring again gives the same outcome
+        qcomp.execute(instr_measure(0, 'N'))
+        self.assertEqual(qcomp.variables['M'].value, qcomp.variables['N'].value)
+
+    def testSamplersAreComputedOncePerState(self):
+        qcomp = get_functional_computer(nregisters=2, sqrt_size=2)
+        qcomp.execute(instr_initialize(0))
+        qcomp.execute(instr_apply(H(), 0))
+
+        register = qcomp.registers[0]
+        sampler = register.get_sampler([0, 1])
+        self.assertIs(sampler, register.get_sampler((0, 1)))
+        self.assertEqual(len(sampler), 4)
+        self.assertEqual(sum(sampler.counts(1000)), 1000)
+
+        qcomp.execute(instr_apply(CNot(), 0))
+        self.assertIsNot(sampler, register.get_sampler([0, 1]))
+
+    def testTensorGates(self):
+        qcomp = get_functional_computer(nregisters=2, sqrt_size=2)
+        qcomp.execute(instr_tensor('U', CNot(), Identity(4)))
+
+        self.assertIsInstance(qcomp.variables['U'].value, PermutationOp)
+        self.assertEqual(qcomp.variables['U'].value.size, (16, 16))
+
+        qcomp.execute(instr_initialize(0, "1001"))
+        qcomp.execute(instr_apply(Variable('U'), 0))
+        self.assertProbabilities([1 if i == int("1101", 2) else 0 for i in range(16)], qcomp, 0)
+
+    def testTensorVariablesWithoutCopies(self):
+        qcomp = get_functional_computer(nregisters=2, sqrt_size=3)
+        qcomp.execute(instr_initialize(0, "100010001"))
+        x = ComplexM(32, 32, [[1 if j == 31 - i else 0 for j in range(32)] for i in range(32)])
+        qcomp.set_variable('X', x)
+        qcomp.execute(instr_tensor('U', Variable('X'), Register(0)))
+
+        value = qcomp.variables['U'].value
+        self.assertIsInstance(value, KroneckerOperator)
+        self.assertIs(value.factors[0], x)
+        # A register stands for its quantum state
+        self.assertEqual(value.factors[1], ComplexM(512, 1, [[1 if i == 0b100010001 else 0] for i in range(512)]))
+
+    def testRegistersUseTheirQuantumState(self):
+        qcomp = get_functional_computer(nregisters=2, sqrt_size=2)
+        qcomp.execute(instr_initialize(0, "1000"))
+        qcomp.execute(instr_apply(CNot(), 0))
+        qcomp.execute(instr_tensor('V', Register(0), Identity(1)))
+
+        state = ComplexM(16, 1, [[1 if i == 0b1100 else 0] for i in range(16)])
+        self.assertEqual(qcomp.registers[0].to_complexm(), state)
+        self.assertEqual(qcomp.variables['V'].value, state)
+        self.assertIn("R0:\n|1100⟩ 1\n", qcomp.get_register_info())
+
+    def testTensorOfAnIdentityIsNotBuilt(self):
+        qcomp = get_functional_computer(nregisters=2, sqrt_size=3)
+        qcomp.execute(instr_tensor('V', Identity(256), H()))
+
+        value = qcomp.variables['V'].value
+        self.assertIsInstance(value, KroneckerOperator)
+        self.assertIsInstance(value.factors[0], IdentityOp)
+
+        # V applies H to the qubit 8 only
+        qcomp.execute(instr_initialize(0, "100000001"))
+        qcomp.execute(instr_apply(Variable('V'), 0))
+        self.assertProbabilities([0.5 if i in (256, 257) else 0 for i in range(512)], qcomp, 0)
+        self.assertIsNone(value._materialized)
+
+    def testConcat(self):
+        qcomp = get_functional_computer(nregisters=2, sqrt_size=2)
+        qcomp.execute(instr_tensor('HI', H(), Identity(2)))
+        qcomp.execute(instr_concat('U', Variable('HI'), CNot()))
+
+        # U applies H to the qubit 0 and then CNOT, preparing a Bell state
+        qcomp.execute(instr_initialize(0))
+        qcomp.execute(instr_apply(Variable('U'), 0))
+        self.assertProbabilities([0.5 if i in (0, 12) else 0 for i in range(16)], qcomp, 0)
+
+    def testConcatOfDifferentSizesRaisesAnError(self):
+        qcomp = get_functional_computer(nregisters=2, sqrt_size=2)
+        with self.assertRaises(ValueError):
+            qcomp.execute(instr_concat('U', H(), CNot()))
+
+    def testInverseUndoesTheOperator(self):
+        qcomp = get_functional_computer(nregisters=2, sqrt_size=2)
+        s = ComplexM(2, 2, [[1, 0], [0, (0, 1)]])
+        qcomp.set_variable('S', s)
+        qcomp.execute(instr_tensor('HI', H(), Identity(2)))
+        qcomp.execute(instr_concat('U', Variable('HI'), CNot()))
+        qcomp.execute(instr_inverse('UINV', Variable('U')))
+        qcomp.execute(instr_inverse('SINV', Variable('S')))
+
+        self.assertIs(qcomp.variables['SINV'].value, s.adjoint())
+
+        qcomp.execute(instr_initialize(0, "0110"))
+        qcomp.execute(instr_apply(Variable('U'), 0))
+        qcomp.execute(instr_apply(Variable('UINV'), 0))
+        self.assertProbabilities([1 if i == 6 else 0 for i in range(16)], qcomp, 0)
+
+    def testInverseOfGatesUndoesTheGate(self):
+        qcomp = get_functional_computer(nregisters=2, sqrt_size=2)
+        for gate in (H(), CNot(), Identity(4)):
+            qcomp.execute(instr_inverse('V', gate))
+            self.assertIsInstance(qcomp.variables['V'].value, type(gate))
+
+            qcomp.execute(instr_initialize(0, "1001"))
+            qcomp.execute(instr_apply(gate, 0))
+            qcomp.execute(instr_apply(Variable('V'), 0))
+            self.assertProbabilities([1 if i == int("1001", 2) else 0 for i in range(16)], qcomp, 0)
+
+        # The inverse of H is applied to every qubit as H
+        qcomp.execute(instr_inverse('V', H()))
+        qcomp.execute(instr_initialize(0))
+        qcomp.execute(instr_apply(Variable('V'), 0))
+        self.assertProbabilities([1 / 16] * 16, qcomp, 0)
+
+    def testInverseOfSingularMatricesRaisesAnError(self):
+        qcomp = get_functional_computer(nregisters=2, sqrt_size=2)
+        qcomp.execute(instr_initialize(0, "1111"))
+        with self.assertRaises(ValueError):
+            qcomp.execute(instr_inverse('V', Register(0)))
+
+    def testSetVariableReusesTheVariable(self):
+        qcomp = get_functional_computer(nregisters=2, sqrt_size=2)
+        qcomp.execute(instr_tensor('U', H(), H()))
+        variable = qcomp.variables['U']
+        qcomp.execute(instr_tensor('U', CNot(), CNot()))
+
+        self.assertIs(variable, qcomp.variables['U'])
+        self.assertIsInstance(variable.value, PermutationOp)
+
+    def testMeasureNotInitializedRegistersRaisesAnError(self):
+        qcomp = get_functional_computer(nregisters=2, sqrt_size=2)
+        with self.assertRaises(UnboundLocalError):
+            qcomp.execute(instr_measure(0, 'M'))
 
 
 
@@ -0,0 +1,155 @@
+'''
+Tests of the gate library
+
+@author: Jordi Llull
+'''
+import os
+import sys
+import inspect
+cmd_folder = os.path.realpath(os.path.abspath(
+    os.path.split(inspect.getfile(inspect.currentframe()))[0]) + "/..")
+if cmd_folder not in sys.path:
+    sys.path.insert(0, cmd_folder)
+
+import unittest
+from math import sqrt
+
+from qbackend import PythonBackend, get_default_backend
+from qgates import GateLibrary, get_gate_operator, get_gate_targets, tensor_operands, concat_operands, \
+                  inverse_operand
+from qinstruction import CNot, H, Identity
+from qmath import ComplexM, IdentityOp, PermutationOp, KroneckerOperator, ProductChain
+
+
+class GateLibraryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = PythonBackend()
+        self.library = GateLibrary(self.backend, maxsize=2)
+
+    def testGateOperators(self):
+        x = 1 / sqrt(2)
+        self.assertEqual(get_gate_operator(H()), ComplexM(2, 2, [[x, x], [x, -x]]))
+        self.assertEqual(get_gate_operator(CNot()).permutation, (0, 1, 3, 2))
+        self.assertEqual(get_gate_operator(Identity(4)).size, (4, 4))
+        with self.assertRaises(TypeError):
+            get_gate_operator(ComplexM(1, 1, [[1]]))
+
+    def testGateTargets(self):
+        self.assertEqual(get_gate_targets(PermutationOp([0, 1, 3, 2]), 3), (0, 1))
+        self.assertEqual(get_gate_targets(IdentityOp(1), 3), ())
+        with self.assertRaises(ValueError):
+            get_gate_targets(IdentityOp(6), 3)
+        with self.assertRaises(ValueError):
+            get_gate_targets(IdentityOp(16), 3)
+
+    def testKernelsAreCachedPerGateAndWidth(self):
+        kernel = self.library.get_kernel(CNot(), 3)
+        self.assertIs(kernel, self.library.get_kernel(CNot(), 3))
+        self.assertIsNot(kernel, self.library.get_kernel(CNot(), 4))
+
+        x = ComplexM(2, 2, [[0, 1], [1, 0]])
+        self.assertIs(self.library.get_kernel(x, 3), self.library.get_kernel(ComplexM(2, 2, [[0, 1], [1, 0]]), 3))
+
+        # Only the two most recently used kernels are kept
+        self.assertIsNot(kernel, self.library.get_kernel(CNot(), 3))
+        self.assertEqual(self.library.info().currsize, 2)
+
+    def testKernels(self):
+        state = self.backend.basis_state(3, int('100', 2))
+        state = self.library.get_kernel(CNot(), 3)(state)
+        self.assertEqual(self.backend.probabilities(state), [0, 0, 0, 0, 0, 0, 1, 0])
+
+        state = self.library.get_kernel(H(), 3)(state)
+        for p in self.backend.probabilities(state):
+            self.assertAlmostEqual(p, 1 / 8)
+
+        state = self.library.get_kernel(Identity(2), 3)(state)
+        state = self.library.get_kernel(H(), 3)(state)
+        for p, expected in zip(self.backend.probabilities(state), [0, 0, 0, 0, 0, 0, 1, 0]):
+            self.assertAlmostEqual(p, expected)
+
+    def testKernelsOfTheDefaultBackend(self):
+        backend = get_default_backend()
+        library = GateLibrary(backend)
+        state = library.get_kernel(get_gate_operator(H()), 2)(backend.basis_state(2))
+        state = library.get_kernel(CNot(), 2)(state)
+        for p, expected in zip(backend.probabilities(state), [0.5, 0, 0, 0.5]):
+            self.assertAlmostEqual(p, expected)
+
+
+class OperandsTest(unittest.TestCase):
+
+    def setUp(self):
+        x = 1 / sqrt(2)
+        self.h = ComplexM(2, 2, [[x, x], [x, -x]])
+        self.u = ComplexM(4, 4, [[(i, j), (j, -i), i + j, (1, i * j)] for i in range(2) for j in range(2)])
+        self.cnot = PermutationOp([0, 1, 3, 2])
+
+    def testTensorOfGates(self):
+        self.assertEqual(tensor_operands(H(), H()), self.h.tensor(self.h))
+        self.assertIsInstance(tensor_operands(H(), H()), KroneckerOperator)
+        self.assertEqual(len(tensor_operands(tensor_operands(H(), H()), H()).factors), 3)
+        self.assertIsInstance(tensor_operands(CNot(), Identity(2)), PermutationOp)
+        self.assertEqual(tensor_operands(CNot(), Identity(2)), self.cnot.to_complexm().tensor(IdentityOp(2).to_complexm()))
+        self.assertEqual(tensor_operands(Identity(2), Identity(4)).size, (8, 8))
+        self.assertEqual(tensor_operands(CNot(), H()), self.cnot.to_complexm().tensor(self.h))
+
+    def testBigTensorsAreLazy(self):
+        uu = tensor_operands(self.u, self.u)
+        self.assertIsInstance(uu, ComplexM)
+        big = tensor_operands(uu, uu)
+        self.assertIsInstance(big, KroneckerOperator)
+        self.assertIs(big.factors[0], uu)
+        self.assertEqual(big.size, (256, 256))
+        self.assertIsInstance(tensor_operands(big, self.u), KroneckerOperator)
+
+        chain = ProductChain(self.h, self.h)
+        lazy = tensor_operands(chain, self.h)
+        self.assertIsInstance(lazy, KroneckerOperator)
+        self.assertIs(lazy.factors[0], chain)
+        self.assertIsNone(chain._materialized)
+
+    def testTensorsKeepStructuredOperands(self):
+        u = tensor_operands(Identity(256), H())
+        self.assertIsInstance(u, KroneckerOperator)
+        self.assertIsInstance(u.factors[0], IdentityOp)
+        self.assertEqual(u.factors[1], self.h)
+
+    def testConcat(self):
+        self.assertIs(concat_operands(Identity(4), self.u), self.u)
+        self.assertIs(concat_operands(self.u, Identity(4)), self.u)
+        self.assertEqual(concat_operands(self.u, CNot()), self.cnot * self.u)
+        self.assertEqual(concat_operands(CNot(), self.u), self.u * self.cnot.to_complexm())
+        self.assertIsInstance(concat_operands(CNot(), CNot()), PermutationOp)
+        self.assertEqual(concat_operands(CNot(), CNot()).permutation, (0, 1, 2, 3))
+        self.assertEqual(concat_operands(H(), H()), self.h * self.h)
+
+    def testBigConcatsAreLazy(self):
+        uu = tensor_operands(self.u, self.u)
+        big = tensor_operands(uu, uu)
+        chain = concat_operands(big, big)
+        self.assertIsInstance(chain, ProductChain)
+        self.assertEqual(chain.operands, (big, big))
+
+    def testInverseOfGates(self):
+        for gate in (H(), CNot(), Identity(8)):
+            self.assertIs(inverse_operand(gate), gate)
+
+    def testInverse(self):
+        self.assertIs(inverse_operand(self.h), self.h.adjoint())
+        self.assertEqual(inverse_operand(PermutationOp([1, 2, 0])).permutation, (2, 0, 1))
+
+        a = ComplexM(3, 3, [[(1, 1), 0, 2], [0, (0, 1), 0], [1, 0, (2, -1)]])
+        inverse = inverse_operand(a)
+        for i, row in enumerate(a * inverse):
+            for j, x in enumerate(row):
+                self.assertAlmostEqual(complex(x), 1 if i == j else 0)
+
+    def testConcatOfDifferentSizesRaisesAnError(self):
+        with self.assertRaises(ValueError):
+            concat_operands(H(), CNot())
+
+
+if __name__ == "__main__":
+    unittest.main()